@@ -15,7 +15,7 @@ if sys.version[0] == '2':
     reload(sys)
     sys.setdefaultencoding('utf8')
 
-from pylho import alerts, colors, debug, log_off_user, terminal
+from pylho import alerts, colors, debug, gpus, log_off_user, terminal
 
 
 EXCLUDE = {
@@ -38,6 +38,10 @@ PAGES = [
         'page': 'debug.md',
         'all_module_functions': [debug],
     },
+    {
+        'page': 'gpus.md',
+        'all_module_classes': [gpus],
+    },
     {
         'page': 'log_off_user.md',
         'all_module_functions': [log_off_user],
@@ -1,6 +1,19 @@
-from . import alerts
-from . import colors
-from . import debug
-from . import log_off_user
-from . import terminal
-from . import bokeh_utils
+'''
+Submodules are loaded lazily on first attribute access (PEP 562) so that
+`import pylho` does not pull in pandas/numpy/bokeh until they are needed.
+'''
+import importlib
+
+__all__ = ['alerts', 'colors', 'debug', 'gpus', 'log_off_user', 'terminal', 'bokeh_utils']
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -1,6 +1,58 @@
 '''
 Functions to send alerts via online/mobile messaging
 '''
+import asyncio
+import atexit
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+# clients are cached so repeated alerts reuse the same connection
+_clients = {}
+_clients_lock = threading.Lock()
+
+# defaults for dispatchers created by `get_dispatcher` (and so by
+# `send_slack(block=False)`). Set these, or the environment variables,
+# before the first alert. ALERT_STORE is an sqlite file that lets several
+# processes on the host share dedup state; None keeps it per-process.
+# ALERT_DEDUP_TTL of 0 disables dedup. The blocking `send_slack` path is
+# neither deduplicated nor rate limited.
+ALERT_STORE = os.environ.get('PYLHO_ALERT_STORE')
+ALERT_DEDUP_TTL = float(os.environ.get('PYLHO_ALERT_DEDUP_TTL', 600))
+ALERT_RATE = float(os.environ.get('PYLHO_ALERT_RATE', 1.0))
+ALERT_BURST = int(os.environ.get('PYLHO_ALERT_BURST', 5))
+
+
+class AlertError(Exception):
+    """Raises error if an alert could not be delivered"""
+    def __init__(self, msg, retry_after=None):
+        super(AlertError, self).__init__(msg)
+        self.retry_after = retry_after
+
+
+def _get_client(key, factory):
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def _butterbot_token():
+    from personal_keys import Long
+    return Long.butterbot['token']
+
 
 def send_text(msg, sid, token, to_number, twilio_number):
     '''Sends text message to any number using valid twilio credentials. Note,
@@ -17,8 +69,10 @@ def send_text(msg, sid, token, to_number, twilio_number):
 
     twilio_number [str] associated phone number of account
     '''
-    from twilio.rest import Client
-    client = Client(sid, token)
+    def factory():
+        from twilio.rest import Client
+        return Client(sid, token)
+    client = _get_client(('twilio', sid, token), factory)
     client.messages.create(to=to_number, from_=twilio_number, body=msg)
 
 
@@ -30,7 +84,7 @@ def send_text_to_long(msg):
     send_text(msg, **twilio_info)
 
 
-def send_slack(msg, token=None, channel='#vpicu-gpu'):
+def send_slack(msg, token=None, channel='#vpicu-gpu', block=True, dedup=True):
     '''Sends message to vpicu.vpicu-gpu channel as ButterBot
 
     # Arguments
@@ -40,11 +94,434 @@ def send_slack(msg, token=None, channel='#vpicu-gpu'):
         ButterBot
 
     channel: [str] channel to post in vpicu slack.
+
+    block: [bool] If False, hands the message to a background
+        `AlertDispatcher` (one per token, see `get_dispatcher`) and returns
+        a Future immediately. Only this path is deduplicated and rate
+        limited; block=True posts every message right away.
+
+    dedup: [bool] If False, msg is never suppressed as a repeat (block=False
+        only). Use for status messages that must always arrive.
     '''
-    from slackclient import SlackClient
     if token is None:
-        from personal_keys import Long
-        butterbot_info = Long.butterbot
+        token = _butterbot_token()
+
+    if not block:
+        return get_dispatcher(token).send(msg, channel=channel, dedup=dedup)
 
-    sc = SlackClient(**butterbot_info)
+    def factory():
+        from slackclient import SlackClient
+        return SlackClient(token=token)
+    sc = _get_client(('slack', token), factory)
     sc.api_call("chat.postMessage", channel=channel, text=msg)
+
+
+class SlackWebClient(object):
+    '''Minimal Slack Web API client that keeps one persistent (keep-alive)
+    HTTP connection, so repeated posts skip connection/TLS setup.
+
+    # Arguments
+    token: [str] Slack bot token. If None, will default to ButterBot
+
+    base_url: [str] Web API root. Point at a local stub server to test, eg.
+        'http://127.0.0.1:8000/api/'
+
+    timeout: [float] socket timeout in secs
+    '''
+    def __init__(self, token=None, base_url='https://slack.com/api/', timeout=10.0):
+        self.token = _butterbot_token() if token is None else token
+        url = urlsplit(base_url)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.path = url.path if url.path.endswith('/') else url.path + '/'
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            conn_cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            self._conn = conn_cls(self.netloc, timeout=self.timeout)
+        return self._conn
+
+    def api_call(self, method, **kwargs):
+        '''Posts kwargs as JSON to Web API method. Returns parsed response.
+        Raises `AlertError` on HTTP errors, rate limits or {"ok": false}'''
+        body = json.dumps(kwargs).encode('utf-8')
+        headers = {'Content-Type': 'application/json; charset=utf-8',
+                   'Authorization': 'Bearer %s' % self.token}
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.request('POST', self.path + method, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                # drop the connection; the next call reconnects
+                self.close()
+                raise AlertError('Could not reach slack: %s' % e)
+
+        if resp.status == 429:
+            raise AlertError('Rate limited by slack', retry_after=float(resp.getheader('Retry-After', 1)))
+        if resp.status != 200:
+            raise AlertError('Slack returned HTTP %i: %s' % (resp.status, data[:200]))
+        ret = json.loads(data.decode('utf-8'))
+        if not ret.get('ok', False):
+            raise AlertError('Slack returned error: %s' % ret.get('error'))
+        return ret
+
+    def post(self, msg, channel='#vpicu-gpu'):
+        return self.api_call('chat.postMessage', channel=channel, text=msg)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# (pattern, replacement) applied in order by `fingerprint`
+_VOLATILE = [(re.compile(p), t) for p, t in [
+    (r'\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b', '<hex>'),
+    (r'\b0x[0-9a-f]+\b|\b(?=[0-9a-f]*\d)[0-9a-f]{8,}\b', '<hex>'),
+    (r'\b\d{4}-\d{2}-\d{2}([ t]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?\b', '<time>'),
+    (r'\b\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?\b', '<time>'),
+    (r'(?<![\w.])[-+]?(\d+\.\d+(e[-+]?\d+)?|\d{5,})(?!\w|\.\w)', '<n>')]]
+
+
+def fingerprint(msg, channel=''):
+    '''Returns fingerprint of msg that ignores the parts that vary between
+    otherwise identical alerts: case, whitespace, hex ids, uuids, memory
+    addresses, dates and times, decimals and long (5+ digit) numbers. Short
+    integers and digits inside words (e.g. 'job 3', 'train_2.py') are kept,
+    as they usually name what the alert is about. Used to key
+    `AlertDeduper`.'''
+    text = str(msg).lower()
+    for pattern, token in _VOLATILE:
+        text = pattern.sub(token, text)
+    text = ' '.join(text.split())
+    return hashlib.blake2b(('%s|%s' % (channel, text)).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class AlertDeduper(object):
+    '''Suppresses repeated alerts. The first alert with a given
+    `fingerprint` is sent; repeats within `ttl` secs are suppressed and
+    counted, and `digests` returns one "N repeats suppressed" message per
+    fingerprint once its window closes (or it is evicted).
+
+    State lives in sqlite: in memory by default, or in a file at store_path
+    so that several processes on the same host share it.
+
+    # Arguments
+    ttl: [float] secs after the first alert during which repeats are
+        suppressed
+
+    max_entries: [int] max fingerprints kept; least recently seen are evicted
+
+    store_path: [str] sqlite file to share state across processes. If None,
+        state is per-process.
+    '''
+    def __init__(self, ttl=600.0, max_entries=1024, store_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(store_path or ':memory:', timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS alerts (fp TEXT PRIMARY KEY, channel TEXT, msg TEXT, '
+                         'first_seen REAL, last_seen REAL, suppressed INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS alerts_last_seen ON alerts (last_seen)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS digests (channel TEXT, msg TEXT)')
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                ret = fn(self._db)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return ret
+
+    def _close_entry(self, db, row):
+        fp, channel, msg, suppressed = row
+        db.execute('DELETE FROM alerts WHERE fp = ?', (fp,))
+        if suppressed:
+            db.execute('INSERT INTO digests VALUES (?, ?)',
+                       (channel, '[%i repeats suppressed] %s' % (suppressed, msg)))
+
+    def should_send(self, msg, channel='', now=None):
+        '''Returns True if msg should be sent, False if it is a repeat'''
+        now = time.time() if now is None else now
+        fp = fingerprint(msg, channel)
+
+        def fn(db):
+            row = db.execute('SELECT fp, channel, msg, suppressed, first_seen FROM alerts WHERE fp = ?', (fp,)).fetchone()
+            if row is not None and now - row[4] < self.ttl:
+                db.execute('UPDATE alerts SET suppressed = suppressed + 1, last_seen = ? WHERE fp = ?', (now, fp))
+                return False
+            if row is not None:
+                self._close_entry(db, row[:4])
+            db.execute('INSERT INTO alerts VALUES (?, ?, ?, ?, ?, 0)', (fp, channel, str(msg), now, now))
+
+            # lru eviction
+            n = db.execute('SELECT COUNT(*) FROM alerts').fetchone()[0]
+            if n > self.max_entries:
+                for evicted in db.execute('SELECT fp, channel, msg, suppressed FROM alerts ORDER BY last_seen LIMIT ?',
+                                          (n - self.max_entries,)).fetchall():
+                    self._close_entry(db, evicted)
+            return True
+        return self._transaction(fn)
+
+    def digests(self, now=None):
+        '''Returns list of (channel, msg) digests for every fingerprint whose
+        suppression window has closed, and forgets those fingerprints'''
+        now = time.time() if now is None else now
+
+        def fn(db):
+            for row in db.execute('SELECT fp, channel, msg, suppressed FROM alerts WHERE first_seen <= ?',
+                                  (now - self.ttl,)).fetchall():
+                self._close_entry(db, row)
+            ret = db.execute('SELECT channel, msg FROM digests').fetchall()
+            db.execute('DELETE FROM digests')
+            return ret
+        return self._transaction(fn)
+
+
+class TokenBucket(object):
+    '''Token bucket rate limiter: allows bursts of up to `capacity` and a
+    sustained `rate` per sec.'''
+    def __init__(self, rate=1.0, capacity=5):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def consume(self, n=1):
+        '''Takes n tokens if available. Returns True if they were taken'''
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= n:
+                self.tokens -= n
+                return True
+            return False
+
+    def wait(self, n=1):
+        '''Blocks until n tokens are available, then takes them'''
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                delay = (n - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class ChannelRateLimiter(object):
+    '''One `TokenBucket` per channel. Slack allows about 1 post per sec per
+    channel, with short bursts.'''
+    def __init__(self, rate=1.0, capacity=5):
+        self.rate = rate
+        self.capacity = capacity
+        self.buckets = {}
+
+    def bucket(self, channel):
+        if channel not in self.buckets:
+            self.buckets.setdefault(channel, TokenBucket(self.rate, self.capacity))
+        return self.buckets[channel]
+
+    def consume(self, channel, n=1):
+        return self.bucket(channel).consume(n)
+
+    def wait(self, channel, n=1):
+        self.bucket(channel).wait(n)
+
+
+def _resolve(future, result=None, error=None):
+    '''Sets the result (or error) of future unless it is already done, e.g.
+    cancelled by the caller'''
+    if future.done():
+        return
+    try:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+    except concurrent.futures.InvalidStateError:
+        pass
+
+
+class AlertDispatcher(object):
+    '''Background alert sender. `send` queues a message and returns a
+    `concurrent.futures.Future` right away; a sender thread coalesces
+    messages to the same channel that arrive within `window` secs into one
+    post and retries failed posts with exponential backoff.
+
+    # Arguments
+    post: callable(msg, channel) that delivers one message. Defaults to
+        `SlackWebClient(token).post`, which reuses one connection.
+
+    token: [str] Slack token for the default post. If None, ButterBot.
+
+    window: [float] secs to wait for more messages before posting a batch
+
+    max_retries: [int] retries per batch before its futures fail
+
+    backoff: [float] initial retry delay in secs, doubled on every retry
+
+    max_backoff: [float] cap on the retry delay in secs
+
+    deduper: [AlertDeduper] If given, repeated messages are dropped by the
+        sender thread (their future resolves to None) and "N repeats
+        suppressed" digests are posted when each suppression window closes.
+
+    rate_limiter: [ChannelRateLimiter] If given, posts wait for a token from
+        their channel's bucket.
+
+    exit_timeout: [float] max secs to wait at interpreter exit for queued
+        messages to be posted
+
+    # Example
+    dispatcher = AlertDispatcher(window=5)
+    dispatcher.send('[Starting] run 1')
+    await dispatcher.asend('[Done] run 1')
+    '''
+    def __init__(self, post=None, token=None, window=1.0, max_retries=5,
+                 backoff=1.0, max_backoff=60.0, deduper=None, rate_limiter=None,
+                 exit_timeout=10.0):
+        if post is None:
+            post = SlackWebClient(token).post
+        self.post = post
+        self.window = window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deduper = deduper
+        self.rate_limiter = rate_limiter
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='AlertDispatcher', daemon=True)
+        self._thread.start()
+        atexit.register(self.close, exit_timeout)
+
+    def send(self, msg, channel='#vpicu-gpu', dedup=True):
+        '''Queues msg for channel. Returns Future resolved once it is posted.
+        If dedup is False, msg skips the deduper.'''
+        if self._closed:
+            raise AlertError('AlertDispatcher is closed')
+        future = concurrent.futures.Future()
+        self._queue.put((channel, msg, future, dedup))
+        return future
+
+    async def asend(self, msg, channel='#vpicu-gpu', dedup=True):
+        '''asyncio version of `send`; awaits until msg is posted'''
+        return await asyncio.wrap_future(self.send(msg, channel=channel, dedup=dedup))
+
+    def flush(self, timeout=None):
+        '''Blocks until every message sent so far has been posted (or failed)'''
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=None):
+        '''Posts remaining messages and stops the sender thread'''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            items = []
+            try:
+                self._step(items)
+            except Exception as e:
+                # fail what this iteration was handling, keep the thread alive
+                for item in items:
+                    if isinstance(item, tuple):
+                        _resolve(item[2], error=e)
+            if not items:
+                continue
+            if isinstance(items[-1], threading.Event):
+                items[-1].set()
+            elif items[-1] is None:
+                return
+
+    def _step(self, items):
+        '''Collects the next window of queued items into items and posts them'''
+        try:
+            # wake up periodically to post dedup digests
+            items.append(self._queue.get(timeout=None if self.deduper is None else max(self.window, 1.0)))
+        except queue.Empty:
+            pass
+        if self.deduper is not None:
+            for channel, msg in self.deduper.digests():
+                self._queue.put((channel, msg, concurrent.futures.Future(), False))
+        if not items:
+            return
+
+        deadline = time.monotonic() + self.window
+        while items[-1] is not None and not isinstance(items[-1], threading.Event):
+            try:
+                items.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+
+        # coalesce by channel, keeping order of first appearance. The dedup
+        # check can wait on the shared store, so it runs here, not in send
+        batches = {}
+        for item in items:
+            if not isinstance(item, tuple):
+                continue
+            channel, msg, future, dedup = item
+            if dedup and self.deduper is not None and not self.deduper.should_send(msg, channel):
+                _resolve(future, None)
+                continue
+            batches.setdefault(channel, []).append(item)
+        for channel, batch in batches.items():
+            self._post_batch(channel, batch)
+
+    def _post_batch(self, channel, batch):
+        msg = '\n'.join(str(item[1]) for item in batch)
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(channel)
+            try:
+                ret = self.post(msg, channel)
+                for item in batch:
+                    _resolve(item[2], ret)
+                return
+            except Exception as e:
+                error = e
+                if attempt == self.max_retries:
+                    break
+                delay = getattr(e, 'retry_after', None)
+                if delay is None:
+                    delay = min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+                time.sleep(delay)
+
+        for item in batch:
+            _resolve(item[2], error=error)
+
+
+def get_dispatcher(token=None, **kwargs):
+    '''Returns a shared `AlertDispatcher` for token (created on first use).
+    kwargs are passed to `AlertDispatcher` on creation. Unless given there,
+    the deduper and rate limiter are built from the module settings
+    ALERT_STORE, ALERT_DEDUP_TTL, ALERT_RATE and ALERT_BURST.'''
+    if token is None:
+        token = _butterbot_token()
+
+    def factory():
+        if 'deduper' not in kwargs and ALERT_DEDUP_TTL > 0:
+            kwargs['deduper'] = AlertDeduper(ttl=ALERT_DEDUP_TTL, store_path=ALERT_STORE)
+        if 'rate_limiter' not in kwargs:
+            kwargs['rate_limiter'] = ChannelRateLimiter(ALERT_RATE, ALERT_BURST)
+        return AlertDispatcher(token=token, **kwargs)
+    return _get_client(('dispatcher', token), factory)
@@ -1,2 +1,15 @@
-from . import barplot
-from . import boxplot
\ No newline at end of file
+import importlib
+
+__all__ = ['barplot', 'batch', 'boxplot', 'cache', 'live', 'report', 'sketch', 'timeline']
+
+
+def __getattr__(name):
+    if name in __all__:
+        module = importlib.import_module('.' + name, __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
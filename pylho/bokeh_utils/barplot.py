@@ -15,90 +15,232 @@ What kind of generality am I trying to give it?
 # Notes
 - modified to not overwrite color when group is specified
 '''
+import hashlib
+import json
 import pandas as pd
 import numpy as np
 import os
-import pandas as pd
+from collections import OrderedDict
 import bokeh.io as bki
 import bokeh.models as bkm
 import bokeh.plotting as bkp
 import bokeh.transform as bkt
 from pylho import colors as pycolor
 
+# aggregates computed by `aggregate`, keyed by content hash; newest last
+_AGG_CACHE = OrderedDict()
+AGG_CACHE_SIZE = 32
 
-def _plot_bar(p, x, y, x_map, x_offset=0, width=0.9, error=None, c=None, quad_kwargs=None, error_lw_kwargs=None, legend=None, group_name=None):
-    '''boloblaw. not going to be documented. internal use only'''
-    # argument checks
-    if quad_kwargs is None:
-        quad_kwargs = {}
 
-    if error_lw_kwargs is None:
-        error_lw_kwargs = {}
+def find_unique_keep_order(seq):
+    '''Finds unique values of a sequence, keeping order'''
+    seen = set()
+    seen_add = seen.add
+    return [x for x in seq if not (x in seen or seen_add(x))]
 
-    # automatically get color if not specified
-    if c is None:
-        colour_wheel = pycolor.colour_wheel(pycolor.palettes.category20_alt)
-        c = []
-        for i in range(len(x)):
-            c.append(colour_wheel.next())
 
-    # get categorical name per x
-    x_cat = [x_map[_x] for _x in x]
+def hash_frame(df):
+    '''Fast content hash of a DataFrame: values (via
+    pd.util.hash_pandas_object), column names and dtypes'''
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    h.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _bootstrap_ci(codes, values, ngroups, agg, ci, n_boot, seed, max_block=10000000):
+    '''Half width of the bootstrap ci% interval of agg, per group'''
+    rng = np.random.RandomState(seed)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(ngroups + 1))
+    values = values[order]
+    fn = {'mean': np.mean, 'sum': np.sum, 'median': np.median, 'count': lambda a, axis: np.full(len(a), a.shape[1])}[agg]
+    ret = np.full(ngroups, np.nan)
+    for i in range(ngroups):
+        v = values[bounds[i]:bounds[i + 1]]
+        if not len(v):
+            continue
+        # resample in blocks of replicates to bound memory
+        block = max(1, min(n_boot, max_block // len(v)))
+        stats = np.concatenate([fn(v[rng.randint(0, len(v), size=(min(block, n_boot - b), len(v)))], axis=1)
+                                for b in range(0, n_boot, block)])
+        lo, hi = np.percentile(stats, [(100 - ci) / 2., 100 - (100 - ci) / 2.])
+        ret[i] = (hi - lo) / 2.
+    return ret
+
+
+def aggregate(df, x_col, y_col, group_col=None, agg='mean', error=None,
+              ci=95, n_boot=1000, seed=0, cache=True):
+    '''Aggregates raw rows into one row per (x, group) with a vectorized
+    groupby, for plotting with `barplot`. Results are cached in memory keyed
+    by a content hash of the input columns and the aggregation spec, so
+    re-plotting the same data with different styling skips recomputation.
 
-    # fix data up for bokeh quads
-    left = np.array(x) - x_offset - width
-    right = np.array(x) - x_offset + width
-    top = [_y if _y >= 0 else 0 for _y in y]
-    bottom = [_y if _y < 0 else 0 for _y in y]
-    src = bkm.ColumnDataSource(data={'left': left, 'right': right, 'top': top, 'bottom': bottom, 'c': c, 'x_cat': x_cat, 'y': y, 'group': [group_name] * len(left)})
+    # Arguments
+    df: pd.DataFrame of raw rows
 
-    # plot vertical bars
-    p.quad(left='left', right='right', top='top', bottom='bottom', source=src, fill_color='c', legend=legend, line_alpha=0.0, **quad_kwargs)
+    x_col, y_col, group_col: see `barplot`
 
-    # plot error bars
-    if error is not None:
-        if len(error) != len(x):
-            raise RuntimeError('Error vector needs to be equal length')
+    agg: [str] aggregation of y_col: 'mean', 'sum', 'count' or 'median'
 
-        xs = [[_x - x_offset, _x - x_offset] for _x in x]
-        ys = [[_y - _e, _y + _e] for _y, _e in zip(y, error)]
-        err_src = bkm.ColumnDataSource(data={'xs': xs, 'ys': ys, 'y': y, 'x_cat': x_cat})
-        p.multi_line(xs='xs', ys='ys', source=err_src, **error_lw_kwargs)
+    error: [str] error bar size: 'std', 'sem', 'ci' (half width of the
+        bootstrap ci% interval of agg), or None for no error bars
 
+    ci: [float] confidence level in percent for error='ci'
 
-def find_unique_keep_order(seq):
-    '''Finds unique values of a sequence, keeping order'''
-    seen = set()
-    seen_add = seen.add
-    return [x for x in seq if not (x in seen or seen_add(x))]
+    n_boot: [int] bootstrap replicates for error='ci'
+
+    seed: [int] seed for the bootstrap
 
+    cache: [bool] If False, always recompute
+
+    # Returns
+    agg_df: pd.DataFrame with x_col, group_col (if given), y_col and 'error'
+        (if error), in order of first appearance of x
+    '''
+    if agg not in ('mean', 'sum', 'count', 'median'):
+        raise RuntimeError('Do not understand agg: %s' % agg)
+    if error not in (None, 'std', 'sem', 'ci'):
+        raise RuntimeError('Do not understand error: %s' % error)
+
+    keys = [x_col] if group_col is None else [x_col, group_col]
+    key = None
+    if cache:
+        key = (hash_frame(df[keys + [y_col]]), x_col, y_col, group_col, agg, error, ci, n_boot, seed)
+        if key in _AGG_CACHE:
+            _AGG_CACHE.move_to_end(key)
+            return _AGG_CACHE[key].copy()
+
+    gb = df.groupby(keys, sort=False)[y_col]
+    ret = gb.agg(agg).to_frame(y_col)
+    if error == 'std':
+        ret['error'] = gb.std()
+    elif error == 'sem':
+        ret['error'] = gb.sem()
+    elif error == 'ci':
+        codes = gb.ngroup().to_numpy()
+        values = df[y_col].to_numpy(dtype=float)
+        # agg skips nan y, so the bootstrap must not resample them
+        valid = (codes >= 0) & ~np.isnan(values)
+        ret['error'] = _bootstrap_ci(codes[valid], values[valid], gb.ngroups,
+                                     agg, ci, n_boot, seed)
+    ret = ret.reset_index()
+
+    if cache:
+        _AGG_CACHE[key] = ret.copy()
+        while len(_AGG_CACHE) > AGG_CACHE_SIZE:
+            _AGG_CACHE.popitem(last=False)
+    return ret
+
+
+def bar_offsets(ngroups):
+    '''Returns (x_offsets, x_width): offset of each group's bar from its
+    x position, and the bar width'''
+    if ngroups > 1:
+        x_offsets, x_width = np.linspace(0, 1.0, num=ngroups + 1, endpoint=False, retstep=True)
+        x_offsets = (x_offsets - x_width)[:ngroups]
+    else:
+        x_offsets = np.zeros(1)
+        x_width = 0.9
+    return x_offsets, x_width
+
+
+def bar_data(df, x_col, y_col, group_col=None, error_col=None, color_col=None):
+    '''Computes bar quads and error segments for all groups in one
+    vectorized pass. df is not modified. Every group gets a bar for every
+    unique x; missing (x, group) pairs are plotted as 0 with no error bar.
+    Rows with a missing x or group are dropped.
+
+    # Arguments
+    see `barplot`
+
+    # Returns
+    data: dict of columns for a single bar ColumnDataSource (left, right,
+        top, bottom, c, x_cat, y, group), ordered group by group
+
+    err_data: dict of columns for the error segments (x0, y0, x1, y1, y,
+        x_cat), or None if no error_col
+
+    layout: dict with 'x_labels' (unique x in order of appearance),
+        'groups' (sorted), 'x_offsets' and 'x_width'
+    '''
+    x_codes, x_labels = pd.factorize(df[x_col])
+    nx = len(x_labels)
+    if group_col is None:
+        g_codes, groups = np.zeros(len(df), dtype=int), np.array(['_'], dtype=object)
+    else:
+        g_codes, groups = pd.factorize(df[group_col], sort=True)
+    ngroups = len(groups)
+
+    x_offsets, x_width = bar_offsets(ngroups)
+
+    # rows with a missing x or group (code -1) are not plotted
+    valid = (x_codes >= 0) & (g_codes >= 0)
+    if not valid.all():
+        x_codes, g_codes = x_codes[valid], g_codes[valid]
+
+    # (group, x) grids, filled in one scatter each
+    def grid(values, fill, dtype):
+        ret = np.full((ngroups, nx), fill, dtype=dtype)
+        ret[g_codes, x_codes] = values if valid.all() else values[valid]
+        return ret.ravel()
+
+    y = np.nan_to_num(grid(df[y_col].to_numpy(dtype=float), 0., float))
+    if color_col is not None:
+        c = grid(df[color_col].to_numpy(dtype=object), 'black', object)
+    elif group_col is not None:
+        colour_wheel = pycolor.colour_wheel(color_palette=pycolor.palettes.category20_alt, n=ngroups)
+        c = np.repeat(np.array([next(colour_wheel) for _ in groups], dtype=object), nx)
+    else:
+        c = np.full(nx, 'black', dtype=object)
+
+    center = (np.arange(nx)[None, :] - x_offsets[:, None]).ravel()
+    width = x_width / 2.0
+    x_cat = np.tile(np.asarray(x_labels, dtype=object), ngroups)
+    data = {'left': center - width, 'right': center + width,
+            'top': np.maximum(y, 0), 'bottom': np.minimum(y, 0),
+            'c': c, 'x_cat': x_cat, 'y': y,
+            'group': np.repeat(np.asarray(groups, dtype=str).astype(object), nx)}
+
+    err_data = None
+    if error_col is not None:
+        error = grid(df[error_col].to_numpy(dtype=float), np.nan, float)
+        has_err = ~np.isnan(error)
+        err_data = {'x0': center[has_err], 'x1': center[has_err],
+                    'y0': (y - error)[has_err], 'y1': (y + error)[has_err],
+                    'y': y[has_err], 'x_cat': x_cat[has_err]}
+
+    layout = {'x_labels': list(x_labels), 'groups': list(groups),
+              'x_offsets': x_offsets, 'x_width': x_width}
+    return data, err_data, layout
 
 
 def barplot(df, x_col, y_col, output_path,
             group_col=None, error_col=None, color_col=None,
             fig_kwargs=None, y_tick_fontsize='14pt', x_tick_fontsize='16pt',
-            x_tick_orientation=np.pi/2.0, fa=0.85, err_lw=2):
+            x_tick_orientation=np.pi/2.0, fa=0.85, err_lw=2,
+            agg=None, error_agg=None, ci=95, n_boot=1000):
     '''Plots vertical bar plots using bokeh. Strictly uses pd.DataFrame
 
     # Assumptions
     - user can put data in correct format. note: this is not at "smart" as seaborn
     - x is categorical
-    - data isnt too big. not efficiently coded for large data
 
     # Arguments
-    df: pd.DataFrame
+    df: pd.DataFrame. Not modified.
 
     x_col: name of column in df to use as x-axis. assumes categorical
 
     y_col: name of column in df to use as y-axis. bar plot values.
 
-    output_path: path to output html file
+    output_path: path to output html file. None skips saving (e.g. to add
+        the figure to a `Report`)
 
     group_col: name of column to groupby df to plot nested groupings
 
     error_col: col to use for plotting error bars. plots error symmetrically, aka  y +/- error
 
-    color_col: col to use for coloring bars. if group_col is specified, color is chosen to override this column.
+    color_col: col to use for coloring bars. if None and group_col is specified, each group gets a color.
 
     fig_kwargs: dictionary argument to send to p.figure(). height, width, title etc
 
@@ -111,16 +253,31 @@ def barplot(df, x_col, y_col, output_path,
     fa: fill_alpha of the bars. Globally applied to all bars
 
     err_lw: line width of the error bars. Globally applied to all bars
+
+    agg: If given, df holds raw rows, which are aggregated per (x, group)
+        with `aggregate` (cached) before plotting: 'mean', 'sum', 'count' or
+        'median'. If None, df must already have one row per (x, group).
+
+    error_agg: error bars when agg is given: 'std', 'sem', 'ci' or None
+
+    ci: confidence level in percent for error_agg='ci'
+
+    n_boot: bootstrap replicates for error_agg='ci'
     '''
     if fig_kwargs is None:
         fig_kwargs = {'height': 600, 'width': 1300}
 
-    # TODO: reevaluate me.
-    # make a copy of df as to not edit the original data
-    df = df.copy()
+    if agg is not None:
+        if color_col is not None or error_col is not None:
+            raise RuntimeError('color_col and error_col are not supported with agg; use error_agg')
+        df = aggregate(df, x_col, y_col, group_col=group_col, agg=agg, error=error_agg, ci=ci, n_boot=n_boot)
+        error_col = None if error_agg is None else 'error'
+
+    data, err_data, layout = bar_data(df, x_col, y_col, group_col=group_col,
+                                      error_col=error_col, color_col=color_col)
+    x_labels, x_offsets, x_width = layout['x_labels'], layout['x_offsets'], layout['x_width']
 
     # --- construct figure --- #
-    bki.output_file(output_path)
     p = bkp.figure(**fig_kwargs)
     p.yaxis.major_label_text_font_size = y_tick_fontsize
     p.xaxis.major_label_text_font_size = x_tick_fontsize
@@ -130,73 +287,39 @@ def barplot(df, x_col, y_col, output_path,
     p.y_range.range_padding = 0.1
     p.xaxis.major_label_orientation = x_tick_orientation
     quad_kwargs = {'line_color': None, 'line_width': 1, 'fill_alpha': fa}
-    error_lw_kwargs = {'line_width': err_lw, 'color':'black'}
+    error_lw_kwargs = {'line_width': err_lw, 'color': 'black'}
 
     # hover
     hover = bkm.HoverTool(tooltips=[('x', '@x_cat'), ('y', '@y'), ('group', '@group')])
     p.add_tools(hover)
 
-    # find unique values of x and coordinate mapping to the categorical
-    unique_xs = find_unique_keep_order(df[x_col])
-#    x_plot = len(unique_xs)
-    x_map = {i: x_name for i, x_name in enumerate(unique_xs)}
-    p.xaxis.ticker = bkm.FixedTicker(ticks=range(len(x_map)))
-    p.xaxis.formatter = bkm.FuncTickFormatter(code='''var labels = %s; return labels[tick];''' % x_map)
+    # categorical tick labels
+    p.xaxis.ticker = bkm.FixedTicker(ticks=list(range(len(x_labels))))
+    p.xaxis.formatter = bkm.FuncTickFormatter(code='''var labels = %s; return labels[tick];''' % json.dumps([str(x) for x in x_labels]))
 
+    # one source drives all bars. with groups, each group gets a renderer
+    # viewing its rows so the legend can hide groups individually
+    src = bkm.ColumnDataSource(data=data)
     if group_col is None:
-        df['_groups'] = '_'
-        group_col = '_groups'
-
-    if color_col is None:
-        color_col = '_color'
-        df[color_col] = 'black'
-
-        # if group is given, give a color
-        if group_col != '_groups':
-            colour_wheel = pycolor.colour_wheel(color_palette=pycolor.palettes.category20_alt)
-            for k, indices in df.groupby(group_col).indices.iteritems():
-                df[color_col].iloc[indices]  = next(colour_wheel)
-        else:
-            df[color_col] = 'black'
-
-    gb = df.groupby(group_col)
-    ngroups = gb.ngroups
-
-    if ngroups > 1:
-        x_offsets, x_width = np.linspace(0, 1.0, num=ngroups + 1, endpoint=False, retstep=True)
-        x_offsets = (x_offsets - x_width)[:ngroups]
+        p.quad(left='left', right='right', top='top', bottom='bottom', source=src, fill_color='c', **quad_kwargs)
     else:
-        x_offsets = [0]
-        x_width = 0.9
-
-    for i, (group_name, sub_df) in enumerate(gb):
-        sub_df = sub_df.set_index(x_col)
-        x_offset = x_offsets[i]
-        y = list(sub_df.loc[unique_xs, y_col].fillna(value=0).values)
-        x = range(len(y))
-
-        if error_col is None:
-            error = None
-        else:
-            error = sub_df[error_col].values
-
-        if color_col is None:
-            c = None
-        else:
-            c = sub_df[color_col].values
-
-        if group_col == '_groups':
-            leg = None
-        else:
-            leg = group_name
+        for group in layout['groups']:
+            view = bkm.CDSView(source=src, filters=[bkm.GroupFilter(column_name='group', group=str(group))])
+            p.quad(left='left', right='right', top='top', bottom='bottom', source=src, view=view,
+                   fill_color='c', legend=str(group), **quad_kwargs)
 
-        _plot_bar(p, x, y, x_map, x_offset=x_offset, width=x_width/2.0, error=error, c=c,
-                  quad_kwargs=quad_kwargs, error_lw_kwargs=error_lw_kwargs, legend=leg, group_name=group_name)
+    # error bars
+    if err_data is not None:
+        err_src = bkm.ColumnDataSource(data=err_data)
+        p.segment(x0='x0', y0='y0', x1='x1', y1='y1', source=err_src, **error_lw_kwargs)
 
     p.x_range.start = x_offsets[0] - x_width
-    p.x_range.end = len(x_map) - 1 + x_offsets[-1] + x_width
-    p.legend.click_policy = 'hide'
-    bki.save(p)
+    p.x_range.end = len(x_labels) - 1 + x_offsets[-1] + x_width
+    if group_col is not None:
+        p.legend.click_policy = 'hide'
+    if output_path is not None:
+        bki.output_file(output_path)
+        bki.save(p)
     return p
 
 
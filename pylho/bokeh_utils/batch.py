@@ -0,0 +1,181 @@
+'''
+Render many `barplot`/`boxplot` html files from one DataFrame across a
+process pool.
+
+The DataFrame is placed in shared memory once: numeric, bool and datetime
+columns are shared zero-copy, other columns are shared as integer codes
+(pd.factorize) and decoded in each worker. Only the small plot specs are
+pickled per task. A failing spec does not stop the batch; its traceback is
+returned in its result. If a worker process dies (e.g. OOM killed), the
+specs that had not finished are returned as failed instead of hanging.
+
+# Example
+    specs = [{'plot': 'barplot', 'output_path': 'bars_%s.html' % c,
+              'query': 'cohort == %r' % c, 'x_col': 'site', 'y_col': 'auc'}
+             for c in cohorts]
+    results = render_batch(df, specs, processes=8)
+'''
+import concurrent.futures
+import sys
+import time
+import traceback
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+PLOTS = ('barplot', 'boxplot', 'boxplot_streaming')
+
+# set in each worker by _init_worker
+_worker_df = None
+_worker_shms = []
+
+
+def _is_shareable(values):
+    return values.dtype.kind in 'biufcmM'
+
+
+def share_frame(df):
+    '''Copies the columns of df into shared memory blocks.
+
+    # Returns
+    manifest: list of (column, shm name, dtype str, length, uniques) used by
+        `attach_frame`. uniques is None for columns shared as is, else the
+        values that the shared integer codes index into.
+
+    shms: list of SharedMemory blocks. The caller must close() and unlink()
+        them when done.
+    '''
+    manifest, shms = [], []
+    try:
+        for col in df.columns:
+            values = df[col].to_numpy()
+            uniques = None
+            if not _is_shareable(values):
+                codes, uniques = pd.factorize(df[col])
+                # code -1 (missing) indexes the trailing nan
+                uniques = np.append(np.asarray(uniques, dtype=object), np.nan)
+                values = codes.astype(np.int32)
+            shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            shms.append(shm)
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            manifest.append((col, shm.name, values.dtype.str, len(values), uniques))
+    except BaseException:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+        raise
+    return manifest, shms
+
+
+def attach_frame(manifest):
+    '''Rebuilds the DataFrame from a `share_frame` manifest without copying
+    the shared columns. The index is a RangeIndex.
+
+    # Returns
+    df, shms: keep shms referenced for as long as df is used
+    '''
+    data, shms = {}, []
+    for col, name, dtype, n, uniques in manifest:
+        shm = shared_memory.SharedMemory(name=name)
+        shms.append(shm)
+        values = np.ndarray((n,), dtype=np.dtype(dtype), buffer=shm.buf)
+        data[col] = values if uniques is None else uniques[values]
+    return pd.DataFrame(data, copy=False), shms
+
+
+def _init_worker(manifest):
+    global _worker_df, _worker_shms
+    _worker_df, _worker_shms = attach_frame(manifest)
+
+
+def render_spec(df, spec):
+    '''Renders one spec on df. See `render_batch` for the spec format.'''
+    spec = dict(spec)
+    plot = spec.pop('plot')
+    if plot not in PLOTS:
+        raise RuntimeError('Do not understand plot: %s' % plot)
+    query = spec.pop('query', None)
+    if query is not None:
+        df = df.query(query)
+    if plot == 'barplot':
+        from pylho.bokeh_utils import barplot
+        return barplot.barplot(df, **spec)
+    from pylho.bokeh_utils import boxplot
+    return getattr(boxplot, plot)(df, **spec)
+
+
+def _render(task):
+    i, spec = task
+    t = time.time()
+    try:
+        render_spec(_worker_df, spec)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return i, {'output_path': spec.get('output_path'), 'error': error, 'seconds': time.time() - t}
+
+
+def render_batch(df, specs, processes=None, progress=True):
+    '''Renders plot specs over df across a process pool.
+
+    # Arguments
+    df: pd.DataFrame shared by all specs (see `share_frame`)
+
+    specs: list of dicts with
+        - 'plot': 'barplot', 'boxplot' or 'boxplot_streaming'
+        - 'output_path': html path
+        - 'query': [optional] pd.DataFrame.query string selecting the rows
+          to plot
+        - any other keyword arguments of the plot function
+
+    processes: [int] pool size. Defaults to the number of cpus.
+
+    progress: True to print a progress line, False for none, or a function
+        called as progress(n_done, n_total, result) after each spec
+
+    # Returns
+    results: list of dicts, in the order of specs, with 'output_path',
+        'error' (None, or the traceback of the failure) and 'seconds' (None
+        if its worker died)
+    '''
+    specs = list(specs)
+    results = [None] * len(specs)
+    manifest, shms = share_frame(df)
+    n_done, n_failed = 0, 0
+    try:
+        pool = concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(manifest,))
+        try:
+            futures = [pool.submit(_render, (i, spec)) for i, spec in enumerate(specs)]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    i, result = future.result()
+                except BrokenProcessPool:
+                    # a worker died and took the pool with it: keep what
+                    # finished, fail the rest
+                    error = traceback.format_exc()
+                    for j, f in enumerate(futures):
+                        if results[j] is not None:
+                            continue
+                        if f.done() and not f.cancelled() and f.exception() is None:
+                            results[j] = f.result()[1]
+                        else:
+                            results[j] = {'output_path': specs[j].get('output_path'), 'error': error, 'seconds': None}
+                    break
+                results[i] = result
+                n_done += 1
+                n_failed += result['error'] is not None
+                if callable(progress):
+                    progress(n_done, len(specs), result)
+                elif progress:
+                    sys.stdout.write('\rrendered %i/%i (%i failed)' % (n_done, len(specs), n_failed))
+                    sys.stdout.flush()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    if progress is True:
+        sys.stdout.write('\n')
+    return results
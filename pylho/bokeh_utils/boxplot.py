@@ -11,9 +11,14 @@ import bokeh.plotting as bkp
 import bokeh.transform as bkt
 import bokeh.layouts as bkl
 from pylho import colors as pycolor
-import copy
+from pylho.bokeh_utils.sketch import QuantileSketch, Reservoir
 import bokeh
 
+# max outliers kept per (group, column) box where a cap is needed: by the
+# streaming functions, which must bound memory, and by `downsample_outliers`.
+# `boxplot` and `plot_box_stats` draw every outlier unless max_outliers is given.
+MAX_OUTLIERS = 1000
+
 
 def find_unique_keep_order(seq):
     '''Finds unique values of a sequence, keeping order'''
@@ -22,116 +27,382 @@ def find_unique_keep_order(seq):
     return [x for x in seq if not (x in seen or seen_add(x))]
 
 
+def box_stats(df, x_cols, group_col=None, groups=None):
+    '''Computes boxplot statistics for every (group, column) pair in one
+    grouped, vectorized pass.
+
+    # Arguments
+    df: pd.DataFrame in long format
+
+    x_cols: list of columns to compute statistics for
+
+    group_col: column to group rows by. If None, all rows are one group
+
+    groups: order of groups. Defaults to order of first appearance
+
+    # Returns
+    stats: dict with
+        - 'groups', 'x_cols': row/column labels of the arrays below
+        - 'q1', 'q2', 'q3', 'upper', 'lower', 'n_outliers': (ngroups, ncols)
+          arrays; whiskers are at most 1.5 IQR past the box, clipped to the
+          data range
+        - 'counts': (ngroups,) number of rows per group
+        - 'outlier_group', 'outlier_col', 'outlier_y': one entry per outlier
+    '''
+    x_cols = list(x_cols)
+    if group_col is None:
+        keys = np.zeros(len(df), dtype=int)
+        groups = [0] if groups is None else groups
+    else:
+        keys = df[group_col]
+        if groups is None:
+            groups = [g for g in pd.unique(keys) if not pd.isnull(g)]
+    groups = list(groups)
+    ngroups, ncols = len(groups), len(x_cols)
+
+    # quantiles 0 and 1 are the min and max, so this is the only grouped pass
+    probs = [0., 0.25, 0.5, 0.75, 1.]
+    qs = df[x_cols].groupby(keys).quantile(probs)
+    qs = qs.reindex(pd.MultiIndex.from_product([groups, probs])).to_numpy(dtype=float)
+    mins, q1, q2, q3, maxs = np.moveaxis(qs.reshape(ngroups, len(probs), ncols), 1, 0)
+    iqr = q3 - q1
+    upper = np.minimum(q3 + 1.5 * iqr, maxs)
+    lower = np.maximum(q1 - 1.5 * iqr, mins)
+
+    # outliers: one vectorized comparison per column against each row's group
+    codes = pd.Categorical(keys, categories=groups).codes
+    valid = codes >= 0
+    counts = np.bincount(codes[valid], minlength=ngroups)
+    n_outliers = np.zeros((ngroups, ncols), dtype=int)
+    outlier_group, outlier_col, outlier_y = [], [], []
+    for i_col, col in enumerate(x_cols):
+        v = df[col].to_numpy(dtype=float)
+        g = np.where(valid, codes, 0)
+        rows = np.flatnonzero(valid & ((v > upper[g, i_col]) | (v < lower[g, i_col])))
+        n_outliers[:, i_col] = np.bincount(codes[rows], minlength=ngroups)
+        outlier_group.append(codes[rows])
+        outlier_col.append(np.full(len(rows), i_col))
+        outlier_y.append(v[rows])
+
+    return {'groups': groups, 'x_cols': x_cols, 'counts': counts,
+            'q1': q1, 'q2': q2, 'q3': q3, 'upper': upper, 'lower': lower,
+            'n_outliers': n_outliers,
+            'outlier_group': np.concatenate(outlier_group).astype(int),
+            'outlier_col': np.concatenate(outlier_col).astype(int),
+            'outlier_y': np.concatenate(outlier_y)}
+
+
+def read_chunks(data, chunksize=1000000, columns=None):
+    '''Yields pd.DataFrame chunks from data.
+
+    # Arguments
+    data: path to a CSV or Parquet (.parquet/.pq) file, a pd.DataFrame, or an
+        iterable of pd.DataFrame chunks (returned as is)
+
+    chunksize: [int] rows per chunk when reading files
+
+    columns: [list] columns to read from files. None reads all columns.
+    '''
+    if isinstance(data, pd.DataFrame):
+        yield data
+    elif isinstance(data, str) and os.path.splitext(data)[1] in ('.parquet', '.pq'):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(data).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif isinstance(data, str):
+        for chunk in pd.read_csv(data, chunksize=chunksize, usecols=columns):
+            yield chunk
+    else:
+        for chunk in data:
+            yield chunk
+
+
+class BoxStatsAccumulator(object):
+    '''Incremental, bounded-memory `box_stats`. Keeps a mergeable
+    `QuantileSketch` and a fixed-size `Reservoir` of outlier candidates per
+    (group, column); rows can be added at any time with `update` and
+    statistics of everything seen so far read with `stats`.
+
+    Quantiles are approximate (rank error ~1.7/k). Outlier candidates are
+    values outside the whiskers estimated from the data seen so far; `stats`
+    re-filters the reservoir with the current whiskers and estimates
+    `n_outliers` from the fraction that passes.
+
+    # Arguments
+    x_cols: list of columns to compute statistics for
+
+    group_col: column to group rows by. If None, all rows are one group
+
+    k: [int] sketch accuracy parameter
+
+    max_outliers: [int] max outliers kept per (group, column)
+
+    seed: [int] seed for the sketches and reservoirs
+    '''
+    def __init__(self, x_cols, group_col=None, k=400, max_outliers=MAX_OUTLIERS, seed=None):
+        self.x_cols = list(x_cols)
+        self.group_col = group_col
+        self.k = k
+        self.max_outliers = max_outliers
+        self.sketches, self.reservoirs, self.counts = {}, {}, {}
+        self._rng = np.random.RandomState(seed)
+
+    @property
+    def columns(self):
+        '''Columns read from each chunk'''
+        return self.x_cols if self.group_col is None else self.x_cols + [self.group_col]
+
+    def update(self, chunk):
+        '''Adds the rows of a pd.DataFrame chunk'''
+        if self.group_col is None:
+            codes, uniques = np.zeros(len(chunk), dtype=int), [0]
+        else:
+            codes, uniques = pd.factorize(chunk[self.group_col])
+        values = chunk[self.x_cols].to_numpy(dtype=float)
+
+        # sort rows by group once, then every group is a contiguous slice
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        values = values[order]
+        for i_group, group in enumerate(uniques):
+            rows = slice(bounds[i_group], bounds[i_group + 1])
+            if rows.stop == rows.start:
+                continue
+            self.counts[group] = self.counts.get(group, 0) + rows.stop - rows.start
+            for i_col in range(len(self.x_cols)):
+                key = (group, i_col)
+                if key not in self.sketches:
+                    self.sketches[key] = QuantileSketch(k=self.k, seed=self._rng.randint(2 ** 31))
+                    self.reservoirs[key] = Reservoir(size=self.max_outliers, seed=self._rng.randint(2 ** 31))
+                v = values[rows, i_col]
+                sketch = self.sketches[key].update(v)
+                q1, q3 = sketch.quantile([0.25, 0.75])
+                iqr = q3 - q1
+                self.reservoirs[key].update(v[(v > q3 + 1.5 * iqr) | (v < q1 - 1.5 * iqr)])
+        return self
+
+    def stats(self):
+        '''Returns statistics of all rows seen so far, in the same format as
+        `box_stats`. Groups are in order of first appearance.'''
+        x_cols = self.x_cols
+        groups = list(self.counts)
+        ngroups, ncols = len(groups), len(x_cols)
+        stats = {'groups': groups, 'x_cols': x_cols,
+                 'counts': np.array([self.counts[g] for g in groups], dtype=int)}
+        mins, q1, q2, q3, maxs = np.full((5, ngroups, ncols), np.nan)
+        n_outliers = np.zeros((ngroups, ncols), dtype=int)
+        outlier_group, outlier_col, outlier_y = [np.empty(0)], [np.empty(0)], [np.empty(0)]
+        for i_group, group in enumerate(groups):
+            for i_col in range(ncols):
+                sketch = self.sketches[(group, i_col)]
+                mins[i_group, i_col], q1[i_group, i_col], q2[i_group, i_col], q3[i_group, i_col], \
+                    maxs[i_group, i_col] = sketch.quantile([0., 0.25, 0.5, 0.75, 1.])
+
+        iqr = q3 - q1
+        upper = np.minimum(q3 + 1.5 * iqr, maxs)
+        lower = np.maximum(q1 - 1.5 * iqr, mins)
+        for i_group, group in enumerate(groups):
+            for i_col in range(ncols):
+                reservoir = self.reservoirs[(group, i_col)]
+                y = reservoir.sample()
+                y = y[(y > upper[i_group, i_col]) | (y < lower[i_group, i_col])]
+                if len(reservoir):
+                    n_outliers[i_group, i_col] = int(round(reservoir.seen * len(y) / float(len(reservoir))))
+                outlier_group.append(np.full(len(y), i_group))
+                outlier_col.append(np.full(len(y), i_col))
+                outlier_y.append(y)
+
+        stats.update({'q1': q1, 'q2': q2, 'q3': q3, 'upper': upper, 'lower': lower,
+                      'n_outliers': n_outliers,
+                      'outlier_group': np.concatenate(outlier_group).astype(int),
+                      'outlier_col': np.concatenate(outlier_col).astype(int),
+                      'outlier_y': np.concatenate(outlier_y)})
+        return stats
+
+
+def stream_box_stats(data, x_cols, group_col=None, chunksize=1000000, k=400,
+                     max_outliers=MAX_OUTLIERS, seed=None):
+    '''Single-pass, bounded-memory version of `box_stats` for data that does
+    not fit in memory, using a `BoxStatsAccumulator` (see it for the
+    approximations made).
+
+    # Arguments
+    data: path to CSV/Parquet file, or iterable of pd.DataFrame chunks (see
+        `read_chunks`)
+
+    x_cols: list of columns to compute statistics for
+
+    group_col: column to group rows by. If None, all rows are one group
+
+    chunksize: [int] rows per chunk when reading files
+
+    k: [int] sketch accuracy parameter
+
+    max_outliers: [int] max outliers kept per (group, column)
+
+    seed: [int] seed for the sketches and reservoirs
+
+    # Returns
+    stats: dict in the same format as `box_stats`
+    '''
+    acc = BoxStatsAccumulator(x_cols, group_col=group_col, k=k, max_outliers=max_outliers, seed=seed)
+    for chunk in read_chunks(data, chunksize=chunksize, columns=acc.columns):
+        acc.update(chunk)
+    return acc.stats()
+
+
+def boxplot_streaming(data, x_cols, output_path, group_col=None,
+                      chunksize=1000000, k=400, max_outliers=MAX_OUTLIERS, seed=None, **plot_kwargs):
+    '''Same figure as `boxplot`, computed in a single pass with bounded
+    memory from a CSV/Parquet path or an iterator of DataFrame chunks. See
+    `stream_box_stats` for the approximations made. plot_kwargs are passed
+    to `plot_box_stats`.'''
+    stats = stream_box_stats(data, x_cols, group_col=group_col, chunksize=chunksize,
+                             k=k, max_outliers=max_outliers, seed=seed)
+    return plot_box_stats(stats, output_path, **plot_kwargs)
+
+
+def downsample_outliers(stats, max_outliers=MAX_OUTLIERS, method='extreme', seed=None):
+    '''Caps the number of outliers kept per box, for all boxes at once.
+
+    # Arguments
+    stats: dict from `box_stats` / `stream_box_stats`
+
+    max_outliers: [int] max outliers kept per (group, column) box
+
+    method: [str]
+        - 'extreme': keep the outliers farthest from the median
+        - 'stratified': keep evenly spaced ranks of the sorted outliers, so
+          the shape of the tail is preserved (always keeps min and max)
+        - 'random': uniform random sample
+
+    seed: [int] seed for method='random'
+
+    # Returns
+    stats: copy of stats with outlier arrays downsampled
+    '''
+    ncols = len(stats['x_cols'])
+    group, col, y = stats['outlier_group'], stats['outlier_col'], stats['outlier_y']
+    box = group * ncols + col
+
+    # order outliers box by box, then by the method's priority within a box
+    if method == 'extreme':
+        order = np.lexsort((-np.abs(y - stats['q2'][group, col]), box))
+    elif method == 'stratified':
+        order = np.lexsort((y, box))
+    elif method == 'random':
+        order = np.lexsort((np.random.RandomState(seed).random_sample(len(y)), box))
+    else:
+        raise RuntimeError('Do not understand outlier downsampling method: %s' % method)
+
+    counts = np.bincount(box, minlength=len(stats['groups']) * ncols)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    n_keep = np.minimum(counts, max_outliers)
+    box_ids = np.repeat(np.arange(len(counts)), n_keep)
+    j = np.arange(n_keep.sum()) - np.repeat(np.cumsum(n_keep) - n_keep, n_keep)
+    if method == 'stratified':
+        # evenly spaced ranks between first and last outlier of each box
+        c, m = counts[box_ids], n_keep[box_ids]
+        j = np.rint(j * (c - 1) / np.maximum(m - 1, 1).astype(float)).astype(int)
+    keep = order[starts[box_ids] + j]
+
+    ret = dict(stats)
+    ret.update({'outlier_group': group[keep], 'outlier_col': col[keep], 'outlier_y': y[keep]})
+    return ret
+
+
 def boxplot(df, x_cols, output_path,
             group_col=None, fig_kwargs=None,
             y_tick_fontsize='14pt', x_tick_fontsize='10pt',
-            x_tick_orientation=np.pi/4.0, fa=0.85):
-    '''Given long-format data, computes standard boxplot'''
-    if fig_kwargs is None:
-        fig_kwargs = {'height': 600, 'width': 1300, 'toolbar_location': 'above'}
-
-    if group_col is None:
-        df['_groups'] = '_'
-        group_col = '_groups'
-
-    # --- get data --- #
-    colour_wheel = pycolor.colour_wheel(color_palette=pycolor.palettes.category20_alt)
-    gb = df.groupby(group_col)
-    groups = find_unique_keep_order(df[group_col])
-    x_colors = {x: colour_wheel.next() for x in groups}
-    ngroups = len(groups)
+            x_tick_orientation=np.pi/4.0, fa=0.85,
+            max_outliers=None, outlier_sampling='extreme', output_backend='canvas'):
+    '''Given long-format data, computes standard boxplot. See
+    `plot_box_stats` for max_outliers, outlier_sampling and output_backend.'''
+    stats = box_stats(df, x_cols, group_col=group_col)
+    return plot_box_stats(stats, output_path, fig_kwargs=fig_kwargs,
+                          y_tick_fontsize=y_tick_fontsize, x_tick_fontsize=x_tick_fontsize,
+                          x_tick_orientation=x_tick_orientation, fa=fa,
+                          max_outliers=max_outliers, outlier_sampling=outlier_sampling,
+                          output_backend=output_backend)
+
+
+def box_offsets(ngroups):
+    '''Returns (x_offsets, x_width): left edge of each group's box relative
+    to its column position, and the box width'''
     x_width = 1 / float(ngroups + 1) - 0.02
     total_width = x_width * ngroups
-
-    # initialize variables to store data
-    invis_label_data = {'top': [], 'bottom': [], 'left': [], 'right': [], 'color': [], 'alpha': [], 'label': []}
-    bw_b_data = {'top': [], 'bottom': [], 'left': [], 'right': [], 'color': [], 'alpha': [], 'variable': [], 'fimp_str': [], 'group': []}
-    bw_m_data = {'xs': [], 'ys': [], 'color': [], 'alpha': []}
-    bw_w_data =  {'xs': [], 'ys': [], 'color': [], 'alpha': []}
-    bw_o_data = {'x': [], 'y': [], 'color': [], 'alpha': []}
-
-    # loop through each x and get data
-    for i_group, group in enumerate(groups):
-        group_df = df.iloc[gb.indices[group]]
-
-        # compute boxplot data
-        q1s = group_df.quantile(q=0.25)
-        q2s = group_df.quantile(q=0.50)
-        q3s = group_df.quantile(q=0.75)
-        iqrs = q3s - q1s
-        uppers = q3s + 1.5 * iqrs
-        lowers = q3s - 1.5 * iqrs
-        vcolor = x_colors[group]
-
-        # loop through each variable and add data
-        x_offset = float(i_group) / float(ngroups + 1) - total_width / 2.0
-        for i_col, col in enumerate(x_cols):
-            q1 = q1s.loc[col]
-            q1 = q1s.loc[col]
-            q2 = q2s.loc[col]
-            q3 = q3s.loc[col]
-            upper = np.min([uppers.loc[col], group_df[col].max()])
-            lower = np.max([lowers.loc[col], group_df[col].min()])
-
-            # fill box data
-            left = i_col + x_offset
-            right = i_col + x_offset + x_width
-            top = q3
-            bottom = q1
-            color = vcolor
-            alpha = 0.15
-            variable = col
-            fimp_str = '%0.2f [%0.2f, %0.2f]' % (q2, q1, q3)
-
-            bw_b_data['top'].append(top)
-            bw_b_data['bottom'].append(bottom)
-            bw_b_data['left'].append(left)
-            bw_b_data['right'].append(right)
-            bw_b_data['color'].append(color)
-            bw_b_data['alpha'].append(alpha)
-            bw_b_data['variable'].append(variable)
-            bw_b_data['fimp_str'].append(fimp_str)
-            bw_b_data['group'].append(group)
-
-            # fill median data
-            xs = [[i_col + x_offset, i_col + x_offset + x_width]]
-            ys = [[q2, q2]]
-            cs = [vcolor] * len(xs)
-            aa = [1.0] * len(xs)
-
-            bw_m_data['xs'].extend(xs)
-            bw_m_data['ys'].extend(ys)
-            bw_m_data['color'].extend(cs)
-            bw_m_data['alpha'].extend(aa)
-
-            # fill whisker data
-            xs = [[i_col + x_offset, i_col + x_offset + x_width],
-                  [i_col + x_offset, i_col + x_offset + x_width],
-                  [i_col + x_offset + x_width/2.0, i_col + x_offset + x_width/2.0],
-                  [i_col + x_offset + x_width/2.0, i_col + x_offset + x_width/2.0]]
-            ys = [[upper, upper], [lower, lower], [lower, q1], [upper, q3]]
-            cs = [vcolor] * len(xs)
-            aa = [0.5] * len(xs)
-
-            bw_w_data['xs'].extend(xs)
-            bw_w_data['ys'].extend(ys)
-            bw_w_data['color'].extend(cs)
-            bw_w_data['alpha'].extend(aa)
-
-            # fill outliers
-            outliers = (group_df[col] > upper) | (group_df[col] < lower)
-            y = list(group_df[col][outliers].values)
-            x = [i_col + x_offset + x_width/2.0] * len(y)
-            color = [vcolor] * len(y)
-            alpha = [0.15] * len(y)
-
-            bw_o_data['x'].extend(x)
-            bw_o_data['y'].extend(y)
-            bw_o_data['color'].extend(color)
-            bw_o_data['alpha'].extend(alpha)
+    x_offsets = np.arange(ngroups) / float(ngroups + 1) - total_width / 2.0
+    return x_offsets, x_width
+
+
+def plot_box_stats(stats, output_path, fig_kwargs=None,
+                   y_tick_fontsize='14pt', x_tick_fontsize='10pt',
+                   x_tick_orientation=np.pi/4.0, fa=0.85,
+                   max_outliers=None, outlier_sampling='extreme', output_backend='canvas'):
+    '''Plots boxplot from precomputed `box_stats`. ColumnDataSources are
+    built directly from the stat arrays.
+
+    If max_outliers is given, outliers drawn per box are capped at it (see
+    `downsample_outliers`), so the html size is bounded by the number of
+    boxes rather than the number of rows. None (default) draws all. Box hover shows the
+    total and drawn outlier counts. output_backend='webgl' renders with
+    WebGL, which keeps large scatter plots responsive in the browser.
+    output_path=None skips saving (e.g. to add the figure to a `Report`).'''
+    if fig_kwargs is None:
+        fig_kwargs = {'height': 600, 'width': 1300, 'toolbar_location': 'above'}
+    fig_kwargs = dict(fig_kwargs, output_backend=output_backend)
+
+    n_outliers = stats['n_outliers'].ravel()
+    if max_outliers is not None:
+        stats = downsample_outliers(stats, max_outliers=max_outliers, method=outlier_sampling)
+    n_drawn = np.bincount(stats['outlier_group'] * len(stats['x_cols']) + stats['outlier_col'],
+                          minlength=len(n_outliers))
+
+    groups, x_cols = stats['groups'], stats['x_cols']
+    q1, q2, q3 = stats['q1'], stats['q2'], stats['q3']
+    upper, lower = stats['upper'], stats['lower']
+    ngroups, ncols = q1.shape
+
+    # --- layout --- #
+    colour_wheel = pycolor.colour_wheel(color_palette=pycolor.palettes.category20_alt, n=ngroups)
+    group_colors = np.array([colour_wheel.next() for _ in groups])
+    x_offsets, x_width = box_offsets(ngroups)
+
+    # boxes are ordered group-major: box k is (group k // ncols, col k % ncols)
+    left = (np.arange(ncols)[None, :] + x_offsets[:, None]).ravel()
+    right = left + x_width
+    mid = left + x_width / 2.0
+    box_colors = np.repeat(group_colors, ncols)
+    q1, q2, q3, upper, lower = [a.ravel() for a in (q1, q2, q3, upper, lower)]
+
+    bw_b_data = {'top': q3, 'bottom': q1, 'left': left, 'right': right,
+                 'color': box_colors,
+                 'variable': np.tile(np.array(x_cols, dtype=object), ngroups),
+                 'fimp_str': ['%0.2f [%0.2f, %0.2f]' % x for x in zip(q2, q1, q3)],
+                 'group': np.repeat(np.array(groups, dtype=object), ncols),
+                 'outliers_str': ['%i [%i drawn]' % x for x in zip(n_outliers, n_drawn)]}
+    bw_m_data = {'x0': left, 'x1': right, 'y': q2,
+                 'color': box_colors}
+
+    # whiskers per box: upper cap, lower cap, lower stem, upper stem. flat
+    # numeric columns (segments rather than multi_line lists) serialize as
+    # typed arrays
+    bw_w_data = {'x0': np.stack([left, left, mid, mid], 1).ravel(),
+                 'x1': np.stack([right, right, mid, mid], 1).ravel(),
+                 'y0': np.stack([upper, lower, lower, upper], 1).ravel(),
+                 'y1': np.stack([upper, lower, q1, q3], 1).ravel(),
+                 'color': np.repeat(box_colors, 4)}
+
+    o_group, o_col = stats['outlier_group'], stats['outlier_col']
+    bw_o_data = {'x': o_col + x_offsets[o_group] + x_width / 2.0, 'y': stats['outlier_y'],
+                 'group': o_group.astype(np.int32)}
+
+    invis_label_data = {'top': np.full(ngroups, 0.1), 'bottom': np.full(ngroups, 0.1),
+                        'left': np.zeros(ngroups), 'right': np.zeros(ngroups),
+                        'color': group_colors,
+                        'label': ['%s [%i encounters]' % (g, n) for g, n in zip(groups, stats['counts'])]}
 
     # --- construct figure --- #
-    bki.output_file(output_path)
     p = bkp.figure(**fig_kwargs)
     p.yaxis.major_label_text_font_size = y_tick_fontsize
     p.xaxis.major_label_text_font_size = x_tick_fontsize
@@ -145,65 +416,51 @@ def boxplot(df, x_cols, output_path,
     legend_items = []
 
     # hover
-    hover = bkm.HoverTool(names=['box'], tooltips=[('variable', '@variable'), ('median [q1, q3]', '@fimp_str'), ('group', '@group')])
+    hover = bkm.HoverTool(names=['box'], tooltips=[('variable', '@variable'), ('median [q1, q3]', '@fimp_str'), ('group', '@group'), ('outliers', '@outliers_str')])
     p.add_tools(hover)
 
     # invisible line to label groups
     invis_label_src = bkm.ColumnDataSource(invis_label_data)
-    r = p.quad(top='top', bottom='bottom', left='left', right='right', color='color', fill_alpha='alpha', source=invis_label_src, name='box', legend='label', muted_alpha=0)
+    r = p.quad(top='top', bottom='bottom', left='left', right='right', color='color', fill_alpha=0.4, source=invis_label_src, name='box', legend='label', muted_alpha=0)
 
     # box and whiskers objects
     # - box: [upper to lower]
     bw_b_data_src = bkm.ColumnDataSource(bw_b_data)
-    r = p.quad(top='top', bottom='bottom', left='left', right='right', color='color', fill_alpha='alpha', source=bw_b_data_src, name='box', muted_alpha=0)
+    r = p.quad(top='top', bottom='bottom', left='left', right='right', color='color', fill_alpha=0.15, source=bw_b_data_src, name='box', muted_alpha=0)
     legend_items.append(bkm.LegendItem(label='box', renderers=[r]))
 
     # - median
     bw_m_data_src = bkm.ColumnDataSource(bw_m_data)
-    r = p.multi_line(xs='xs', ys='ys', color='color', alpha='alpha', source=bw_m_data_src, muted_alpha=0, line_width=2)
+    r = p.segment(x0='x0', y0='y', x1='x1', y1='y', color='color', alpha=1.0, source=bw_m_data_src, muted_alpha=0, line_width=2)
     legend_items.append(bkm.LegendItem(label='median', renderers=[r]))
 
     # - whiskers: [upper, lower]
     bw_w_data_src = bkm.ColumnDataSource(bw_w_data)
-    r = p.multi_line(xs='xs', ys='ys', color='color', alpha='alpha', source=bw_w_data_src, muted_alpha=0)
+    r = p.segment(x0='x0', y0='y0', x1='x1', y1='y1', color='color', alpha=0.5, source=bw_w_data_src, muted_alpha=0)
     legend_items.append(bkm.LegendItem(label='whiskers', renderers=[r]))
 
     # - circle scatter: outliers
     bw_o_data_src = bkm.ColumnDataSource(bw_o_data)
     outlier_jitter = bkt.Jitter(width=x_width)
-    r = p.circle(x={'field': 'x', 'transform': outlier_jitter}, y='y', color='color', alpha='alpha', source=bw_o_data_src, size=2, muted_alpha=0)
+    # outliers are colored from their integer group code, so no per-point color strings are written
+    outlier_cmap = bkm.LinearColorMapper(palette=list(group_colors), low=-0.5, high=ngroups - 0.5)
+    r = p.circle(x={'field': 'x', 'transform': outlier_jitter}, y='y', color={'field': 'group', 'transform': outlier_cmap}, alpha=0.15, source=bw_o_data_src, size=2, muted_alpha=0)
     legend_items.append(bkm.LegendItem(label='outliers', renderers=[r]))
 
     ## - plot 0 line
     #zero_line = bkm.Span(location=0, dimension='width', line_color='black', line_dash='solid', line_width=2)
     #p.add_layout(zero_line)
 
-    # set data
-    bw_b_data_src.data = bw_b_data
-    bw_m_data_src.data = bw_m_data
-    bw_w_data_src.data = bw_w_data
-    bw_o_data_src.data = bw_o_data
-
-    # fill invisible label data
-    invis_data = copy.deepcopy(invis_label_data)
-    for i_slice, pop_slice in enumerate(groups):
-        invis_data['top'].append(0.1)
-        invis_data['bottom'].append(0.1)
-        invis_data['left'].append(0)
-        invis_data['right'].append(0)
-        invis_data['color'].append(x_colors[pop_slice])
-        invis_data['alpha'].append(0.4)
-        invis_data['label'].append('%s [%i encounters]' % (pop_slice, len(gb.indices[pop_slice])))
-    invis_label_src.data = invis_data
-
     # legend
     legend = bkm.Legend(items=legend_items, location=(0, 0), click_policy='mute', background_fill_alpha=0.0, border_line_width=0.0)
     p.add_layout(legend, 'right')
 
     # set new p axis tick labels
-    p.xaxis.ticker = np.arange(len(bw_b_data['variable']))
-    p.xaxis.major_label_overrides = {i: x for i, x in enumerate(bw_b_data['variable'])}
+    p.xaxis.ticker = np.arange(ncols)
+    p.xaxis.major_label_overrides = {i: x for i, x in enumerate(x_cols)}
 
     # save & return
-    bki.save(p)
+    if output_path is not None:
+        bki.output_file(output_path)
+        bki.save(p)
     return p
@@ -0,0 +1,130 @@
+'''
+On-disk cache of rendered bokeh_utils plots, keyed by the contents of the
+DataFrame and the plot arguments.
+
+Re-running `barplot(df, ...)` or `boxplot(df, ...)` with identical inputs
+copies the saved html instead of recomputing and re-rendering it, and does
+not touch output_path at all if it already holds that html. The cache is
+bounded to max_bytes; least recently used entries are evicted first.
+
+# Example
+    cache = RenderCache('~/.cache/pylho/plots')
+    cache.barplot(df, 'site', 'auc', 'auc.html', group_col='cohort')
+'''
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pylho.bokeh_utils.barplot import hash_frame
+
+PLOTS = ('barplot', 'boxplot')
+
+
+class RenderCache(object):
+    '''Content-addressed, size-bounded html cache for barplot and boxplot.
+
+    # Arguments
+    cache_dir: [str] directory holding one <key>.html file per entry
+
+    max_bytes: [int] total size of the cache; the least recently used
+        entries are evicted past it
+    '''
+    def __init__(self, cache_dir='~/.cache/pylho/bokeh_utils', max_bytes=500 * 1024 ** 2):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key(self, plot, df, *args, **kwargs):
+        '''Key of a plot call: hash of plot name, df contents (see
+        `barplot.hash_frame`) and the remaining arguments except output_path'''
+        h = hashlib.blake2b(digest_size=16)
+        h.update(plot.encode('utf-8'))
+        h.update(hash_frame(df).encode('utf-8'))
+        h.update(json.dumps([args, kwargs], sort_keys=True, default=repr).encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.html')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def entries(self):
+        '''Returns [(key, bytes, last used time)], least recently used first'''
+        ret = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.html'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            ret.append((name[:-len('.html')], st.st_size, st.st_mtime))
+        return sorted(ret, key=lambda x: x[2])
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def invalidate(self, key=None):
+        '''Removes the entry for key, or every entry if key is None'''
+        keys = [k for k, _, _ in self.entries()] if key is None else [key]
+        for k in keys:
+            try:
+                os.remove(self.path(k))
+            except OSError:
+                pass
+
+    def evict(self):
+        '''Removes least recently used entries until the cache fits max_bytes'''
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
+
+    def render(self, plot, df, output_path, *args, **kwargs):
+        '''Writes the html of plot(df, *args, **kwargs) to output_path, from
+        the cache if possible.
+
+        # Returns
+        (output_path, hit): hit is True if nothing was rendered
+
+        args are the positional arguments of plot between df and
+        output_path, e.g. (x_col, y_col) for barplot
+        '''
+        if plot not in PLOTS:
+            raise RuntimeError('Do not understand plot: %s' % plot)
+        key = self.key(plot, df, *args, **kwargs)
+        entry = self.path(key)
+        if os.path.exists(entry):
+            os.utime(entry, None)
+            if not (os.path.exists(output_path) and filecmp.cmp(entry, output_path, shallow=False)):
+                shutil.copyfile(entry, output_path)
+            return output_path, True
+
+        if plot == 'barplot':
+            from pylho.bokeh_utils import barplot as module
+        else:
+            from pylho.bokeh_utils import boxplot as module
+        getattr(module, plot)(df, *args, output_path=output_path, **kwargs)
+
+        # copy in under a temporary name so readers never see partial files
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        shutil.copyfile(output_path, tmp)
+        os.replace(tmp, entry)
+        self.evict()
+        return output_path, False
+
+    def barplot(self, df, x_col, y_col, output_path, **kwargs):
+        '''Cached `barplot.barplot`. Returns output_path.'''
+        return self.render('barplot', df, output_path, x_col, y_col, **kwargs)[0]
+
+    def boxplot(self, df, x_cols, output_path, **kwargs):
+        '''Cached `boxplot.boxplot`. Returns output_path.'''
+        return self.render('boxplot', df, output_path, list(x_cols), **kwargs)[0]
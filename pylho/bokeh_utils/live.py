@@ -0,0 +1,493 @@
+'''
+Live-updating bar and box plots for `bokeh serve`.
+
+Instead of regenerating html files, the plots live in a bokeh server
+document and only send what changed: new bars/boxes are appended with
+ColumnDataSource.stream and changed ones are sent with
+ColumnDataSource.patch. `update` can be called from any thread at any
+rate; updates are buffered and flushed in one batch every `interval` ms
+from the document's own event loop.
+
+- LiveBarplot: bars updated from rows of (x, group, y[, error])
+- LiveBoxplot: boxes updated from raw rows (incremental, approximate; see
+  `boxplot.BoxStatsAccumulator`) or from precomputed `box_stats`
+- serve: runs a bokeh server in-process
+
+# Example
+    def make_doc(doc):
+        live = LiveBarplot('epoch', 'loss', group_col='run')
+        live.attach(doc)
+        feeds.append(live)  # call live.update(df) from the training loop
+
+    serve(make_doc, port=5006)
+'''
+import abc
+import threading
+import numpy as np
+import pandas as pd
+import bokeh.io as bki
+import bokeh.models as bkm
+import bokeh.plotting as bkp
+from pylho import colors as pycolor
+from pylho.bokeh_utils.barplot import bar_offsets
+from pylho.bokeh_utils.boxplot import MAX_OUTLIERS, BoxStatsAccumulator, box_offsets, downsample_outliers
+
+
+def _changed(new, old):
+    '''Elementwise new != old, treating nan == nan as unchanged'''
+    return (new != old) & ~(pd.isnull(new) & pd.isnull(old))
+
+
+def _row_patches(data, rows):
+    '''ColumnDataSource.patch dict setting the given rows to the values of
+    every column in data (one value per row)'''
+    return dict((col, [(int(i), x) for i, x in zip(rows, v)]) for col, v in data.items())
+
+
+def _take(data, rows):
+    '''Selects rows of every column in data'''
+    return dict((col, np.asarray(v)[rows]) for col, v in data.items())
+
+
+def _pad(a, shape, fill):
+    '''Grows array a to shape, filling new entries with fill'''
+    ret = np.full(shape, fill, dtype=a.dtype)
+    ret[tuple(slice(0, n) for n in a.shape)] = a
+    return ret
+
+
+class _LivePlot(abc.ABC):
+    '''Buffers updates from any thread and flushes them every interval ms
+    from the document's event loop'''
+    def __init__(self, interval=1000):
+        self.interval = interval
+        self.figure = None
+        self.doc = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def attach(self, doc=None):
+        '''Adds the figure to doc (default: curdoc()) and starts flushing'''
+        self.doc = bki.curdoc() if doc is None else doc
+        self.doc.add_root(self.figure)
+        self.doc.add_periodic_callback(self.flush, self.interval)
+        return self
+
+    def _put(self, item):
+        with self._lock:
+            self._pending.append(item)
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    @abc.abstractmethod
+    def flush(self):
+        '''Sends all buffered updates. Called periodically once attached;
+        must run with the document lock held (i.e. from a callback).'''
+
+
+class LiveBarplot(_LivePlot):
+    '''Bar plot in a bokeh server document, updated incrementally.
+
+    Each (x, group) pair is one bar. Bars for new pairs are streamed; bars
+    whose y or error changed are patched; all others are not sent. A new
+    group changes the layout of every bar, so it resends the full source.
+
+    # Arguments
+    x_col, y_col, group_col, error_col: see `barplot.barplot`
+
+    interval: [int] ms between flushes of buffered updates
+
+    fig_kwargs, y_tick_fontsize, x_tick_fontsize, x_tick_orientation, fa,
+    err_lw: see `barplot.barplot`
+    '''
+    def __init__(self, x_col, y_col, group_col=None, error_col=None, interval=1000,
+                 fig_kwargs=None, y_tick_fontsize='14pt', x_tick_fontsize='16pt',
+                 x_tick_orientation=np.pi/2.0, fa=0.85, err_lw=2):
+        super(LiveBarplot, self).__init__(interval=interval)
+        self.x_col, self.y_col = x_col, y_col
+        self.group_col, self.error_col = group_col, error_col
+        self.fa = fa
+        if fig_kwargs is None:
+            fig_kwargs = {'height': 600, 'width': 1300}
+
+        # bar k is (x_labels[slot_x[k]], groups[slot_g[k]]); slots[g, x] -> k
+        self.x_labels, self.groups = [], []
+        self.slot_x, self.slot_g = np.empty(0, dtype=int), np.empty(0, dtype=int)
+        self.slots = np.full((0, 0), -1, dtype=int)
+        self.y, self.error = np.empty(0), np.empty(0)
+
+        p = bkp.figure(**fig_kwargs)
+        p.yaxis.major_label_text_font_size = y_tick_fontsize
+        p.xaxis.major_label_text_font_size = x_tick_fontsize
+        p.xaxis.axis_line_width = 2
+        p.xgrid.grid_line_alpha = 0.0
+        p.x_range.range_padding = 0.15
+        p.y_range.range_padding = 0.1
+        p.xaxis.major_label_orientation = x_tick_orientation
+        p.add_tools(bkm.HoverTool(tooltips=[('x', '@x_cat'), ('y', '@y'), ('group', '@group')]))
+        p.xaxis.ticker = bkm.FixedTicker(ticks=[])
+        self.figure = p
+
+        self.source = bkm.ColumnDataSource(data=self._bar_columns(np.empty(0, dtype=int)))
+        self.err_source = None
+        if error_col is not None:
+            self.err_source = bkm.ColumnDataSource(data=self._err_columns(np.empty(0, dtype=int)))
+            p.segment(x0='x0', y0='y0', x1='x1', y1='y1', source=self.err_source,
+                      line_width=err_lw, color='black')
+        self._renderers = {}
+
+    def update(self, df):
+        '''Queues rows of df (one per (x, group)) to be sent on the next
+        flush. Later rows for the same bar replace earlier ones.'''
+        cols = [c for c in (self.x_col, self.group_col, self.y_col, self.error_col) if c is not None]
+        self._put(df[cols].copy())
+
+    def _bar_columns(self, rows):
+        x_offsets, x_width = bar_offsets(max(len(self.groups), 1))
+        center = self.slot_x[rows] - x_offsets[self.slot_g[rows]]
+        y = self.y[rows]
+        if self.group_col is None:
+            c = np.full(len(rows), 'black', dtype=object)
+        else:
+            colour_wheel = pycolor.colour_wheel(color_palette=pycolor.palettes.category20_alt, n=len(self.groups))
+            c = np.array([next(colour_wheel) for _ in self.groups] or ['black'], dtype=object)[self.slot_g[rows]]
+        groups = np.array([str(g) for g in self.groups] or ['_'], dtype=object)
+        labels = np.array([str(x) for x in self.x_labels] or [''], dtype=object)
+        return {'left': center - x_width / 2.0, 'right': center + x_width / 2.0,
+                'top': np.maximum(y, 0), 'bottom': np.minimum(y, 0),
+                'c': c, 'x_cat': labels[self.slot_x[rows]], 'y': y,
+                'group': groups[self.slot_g[rows]]}
+
+    def _err_columns(self, rows):
+        x_offsets, x_width = bar_offsets(max(len(self.groups), 1))
+        center = (self.slot_x[rows] - x_offsets[self.slot_g[rows]]).astype(float)
+        y, error = self.y[rows], self.error[rows]
+        return {'x0': center, 'x1': center, 'y0': y - error, 'y1': y + error}
+
+    def _add_renderer(self, group):
+        quad_kwargs = {'line_color': None, 'line_width': 1, 'fill_alpha': self.fa}
+        if self.group_col is None:
+            self._renderers[group] = self.figure.quad(left='left', right='right', top='top', bottom='bottom',
+                                                      source=self.source, fill_color='c', **quad_kwargs)
+        else:
+            view = bkm.CDSView(source=self.source, filters=[bkm.GroupFilter(column_name='group', group=str(group))])
+            self._renderers[group] = self.figure.quad(left='left', right='right', top='top', bottom='bottom',
+                                                      source=self.source, view=view, fill_color='c',
+                                                      legend=str(group), **quad_kwargs)
+            self.figure.legend.click_policy = 'hide'
+
+    def flush(self):
+        pending = self._take()
+        if not pending:
+            return
+        keys = [self.x_col] if self.group_col is None else [self.x_col, self.group_col]
+        df = pd.concat(pending).drop_duplicates(subset=keys, keep='last')
+
+        # new x labels are appended, so existing bars keep their position;
+        # new groups are inserted in sorted order and move every bar
+        new_x = [x for x in pd.unique(df[self.x_col]) if x not in set(self.x_labels)]
+        self.x_labels.extend(new_x)
+        relayout = False
+        if self.group_col is None:
+            g_values = np.zeros(len(df), dtype=int)
+            if not self.groups:
+                self.groups = [0]
+        else:
+            g_values = df[self.group_col].to_numpy(dtype=object)
+            new_groups = set(pd.unique(g_values)) - set(self.groups)
+            if new_groups:
+                old_groups = self.groups
+                self.groups = sorted(set(self.groups) | new_groups)
+                remap = np.array([self.groups.index(g) for g in old_groups], dtype=int)
+                self.slot_g = remap[self.slot_g] if len(self.slot_g) else self.slot_g
+                slots = np.full((len(self.groups), self.slots.shape[1]), -1, dtype=int)
+                slots[remap] = self.slots
+                self.slots = slots
+                relayout = len(self.slot_g) > 0
+        self.slots = _pad(self.slots, (len(self.groups), len(self.x_labels)), -1)
+
+        xi = pd.Index(self.x_labels).get_indexer(df[self.x_col])
+        gi = pd.Index(self.groups).get_indexer(g_values)
+        y = df[self.y_col].to_numpy(dtype=float)
+        error = np.full(len(df), np.nan) if self.error_col is None else df[self.error_col].to_numpy(dtype=float)
+
+        # existing bars: patch only those whose values changed
+        k = self.slots[gi, xi]
+        old = k >= 0
+        changed = np.zeros(len(df), dtype=bool)
+        changed[old] = _changed(y[old], self.y[k[old]]) | _changed(error[old], self.error[k[old]])
+        rows = k[changed]
+        self.y[rows], self.error[rows] = y[changed], error[changed]
+
+        # new bars get the next slots and are streamed
+        n_new = int((~old).sum())
+        new_rows = np.arange(len(self.y), len(self.y) + n_new)
+        self.slots[gi[~old], xi[~old]] = new_rows
+        self.slot_x = np.concatenate([self.slot_x, xi[~old]])
+        self.slot_g = np.concatenate([self.slot_g, gi[~old]])
+        self.y = np.concatenate([self.y, y[~old]])
+        self.error = np.concatenate([self.error, error[~old]])
+
+        if relayout:
+            all_rows = np.arange(len(self.y))
+            self.source.data = self._bar_columns(all_rows)
+            if self.err_source is not None:
+                self.err_source.data = self._err_columns(all_rows)
+        else:
+            if len(rows):
+                self.source.patch(_row_patches(self._bar_columns(rows), rows))
+                if self.err_source is not None:
+                    self.err_source.patch(_row_patches(self._err_columns(rows), rows))
+            if n_new:
+                self.source.stream(self._bar_columns(new_rows))
+                if self.err_source is not None:
+                    self.err_source.stream(self._err_columns(new_rows))
+
+        for group in self.groups:
+            if group not in self._renderers:
+                self._add_renderer(group)
+        if new_x:
+            self.figure.xaxis.ticker.ticks = list(range(len(self.x_labels)))
+            self.figure.xaxis.major_label_overrides = dict((i, str(x)) for i, x in enumerate(self.x_labels))
+
+
+class LiveBoxplot(_LivePlot):
+    '''Box plot in a bokeh server document, updated incrementally.
+
+    Each (group, column) pair is one box with a fixed block of max_outliers
+    outlier slots. Only boxes whose statistics or outliers changed since the
+    last flush are patched. A new group changes the layout of every box, so
+    it resends the full sources.
+
+    # Arguments
+    x_cols: list of columns to plot
+
+    group_col: column to group rows by. If None, all rows are one group
+
+    interval: [int] ms between flushes of buffered updates
+
+    max_outliers: [int] outliers drawn per box (see `downsample_outliers`)
+
+    outlier_sampling: [str] method for `downsample_outliers`
+
+    k, seed: see `boxplot.BoxStatsAccumulator`, used by `update`
+
+    fig_kwargs, y_tick_fontsize, x_tick_fontsize, x_tick_orientation,
+    output_backend: see `boxplot.plot_box_stats`
+    '''
+    def __init__(self, x_cols, group_col=None, interval=1000, max_outliers=200,
+                 outlier_sampling='extreme', k=400, seed=None, fig_kwargs=None,
+                 y_tick_fontsize='14pt', x_tick_fontsize='10pt',
+                 x_tick_orientation=np.pi/4.0, output_backend='canvas'):
+        super(LiveBoxplot, self).__init__(interval=interval)
+        self.x_cols = list(x_cols)
+        self.max_outliers = max_outliers
+        self.outlier_sampling = outlier_sampling
+        self.accumulator = BoxStatsAccumulator(x_cols, group_col=group_col, k=k,
+                                               max_outliers=max(max_outliers, MAX_OUTLIERS), seed=seed)
+        self._stats = None
+        self.groups = []
+        self._sent = None
+        if fig_kwargs is None:
+            fig_kwargs = {'height': 600, 'width': 1300, 'toolbar_location': 'above'}
+        fig_kwargs = dict(fig_kwargs, output_backend=output_backend)
+
+        p = bkp.figure(**fig_kwargs)
+        p.yaxis.major_label_text_font_size = y_tick_fontsize
+        p.xaxis.major_label_text_font_size = x_tick_fontsize
+        p.xaxis.axis_line_width = 2
+        p.xgrid.grid_line_alpha = 0.0
+        p.x_range.range_padding = 0.05
+        p.y_range.range_padding = 0.05
+        p.xaxis.major_label_orientation = x_tick_orientation
+        p.add_tools(bkm.HoverTool(names=['box'], tooltips=[('variable', '@variable'), ('median [q1, q3]', '@fimp_str'), ('group', '@group'), ('outliers', '@outliers_str')]))
+        p.xaxis.ticker = list(range(len(self.x_cols)))
+        p.xaxis.major_label_overrides = dict((i, x) for i, x in enumerate(self.x_cols))
+
+        empty = self._columns(np.zeros((0, len(self.x_cols))), None)
+        self.label_source = bkm.ColumnDataSource(empty['label'])
+        self.box_source = bkm.ColumnDataSource(empty['box'])
+        self.median_source = bkm.ColumnDataSource(empty['median'])
+        self.whisker_source = bkm.ColumnDataSource(empty['whisker'])
+        self.outlier_source = bkm.ColumnDataSource(empty['outlier'])
+
+        legend_items = []
+        p.quad(top='top', bottom='bottom', left='left', right='right', color='color', fill_alpha=0.4, source=self.label_source, name='box', legend='label', muted_alpha=0)
+        r = p.quad(top='top', bottom='bottom', left='left', right='right', color='color', fill_alpha=0.15, source=self.box_source, name='box', muted_alpha=0)
+        legend_items.append(bkm.LegendItem(label='box', renderers=[r]))
+        r = p.segment(x0='x0', y0='y', x1='x1', y1='y', color='color', source=self.median_source, muted_alpha=0, line_width=2)
+        legend_items.append(bkm.LegendItem(label='median', renderers=[r]))
+        r = p.segment(x0='x0', y0='y0', x1='x1', y1='y1', color='color', alpha=0.5, source=self.whisker_source, muted_alpha=0)
+        legend_items.append(bkm.LegendItem(label='whiskers', renderers=[r]))
+        r = p.circle(x='x', y='y', color='color', alpha=0.15, source=self.outlier_source, size=2, muted_alpha=0)
+        legend_items.append(bkm.LegendItem(label='outliers', renderers=[r]))
+        p.add_layout(bkm.Legend(items=legend_items, location=(0, 0), click_policy='mute', background_fill_alpha=0.0, border_line_width=0.0), 'right')
+        self.figure = p
+
+    def update(self, df):
+        '''Queues raw rows of df to be added to the running statistics'''
+        self._put(df[self.accumulator.columns].copy())
+
+    def update_stats(self, stats):
+        '''Replaces the plotted statistics with precomputed `box_stats` (e.g.
+        over a sliding window) on the next flush'''
+        self._put(stats)
+
+    def _columns(self, shape_like, stats):
+        '''Full column dicts for every source, from stats (None: empty)'''
+        ngroups, ncols = shape_like.shape
+        nbox, m = ngroups * ncols, self.max_outliers
+        x_offsets, x_width = box_offsets(max(ngroups, 1))
+        colour_wheel = pycolor.colour_wheel(color_palette=pycolor.palettes.category20_alt, n=max(ngroups, 1))
+        group_colors = np.array([next(colour_wheel) for _ in range(ngroups)], dtype=object)
+        left = (np.arange(ncols)[None, :] + x_offsets[:ngroups, None]).ravel()
+        mid = left + x_width / 2.0
+        colors = np.repeat(group_colors, ncols)
+        values = self._box_values(stats, nbox)
+        groups = [] if stats is None else stats['groups']
+        counts = [] if stats is None else stats['counts']
+        return {
+            'label': {'top': np.full(ngroups, 0.1), 'bottom': np.full(ngroups, 0.1),
+                      'left': np.zeros(ngroups), 'right': np.zeros(ngroups), 'color': group_colors,
+                      'label': ['%s [%i encounters]' % (g, n) for g, n in zip(groups, counts)]},
+            'box': dict(values['box'], left=left, right=left + x_width, color=colors,
+                        variable=np.tile(np.array(self.x_cols, dtype=object), ngroups),
+                        group=np.repeat(np.array([str(g) for g in groups], dtype=object), ncols)),
+            'median': dict(values['median'], x0=left, x1=left + x_width, color=colors),
+            # whiskers per box: upper cap, lower cap, lower stem, upper stem
+            'whisker': dict(values['whisker'],
+                            x0=np.stack([left, left, mid, mid], 1).ravel(),
+                            x1=np.stack([left + x_width, left + x_width, mid, mid], 1).ravel(),
+                            color=np.repeat(colors, 4)),
+            'outlier': dict(values['outlier'], x=np.repeat(mid, m), color=np.repeat(colors, m)),
+        }
+
+    def _box_values(self, stats, nbox):
+        '''Columns that depend on the statistics, with a fixed number of rows
+        per box (1 box/median, 4 whisker, max_outliers outlier rows)'''
+        m = self.max_outliers
+        if stats is None:
+            q1 = q2 = q3 = upper = lower = np.empty(0)
+            n_outliers = np.empty(0, dtype=int)
+            y = np.empty(0)
+        else:
+            q1, q2, q3, upper, lower = [stats[k].ravel() for k in ('q1', 'q2', 'q3', 'upper', 'lower')]
+            n_outliers = stats['n_outliers'].ravel()
+            ds = downsample_outliers(stats, max_outliers=m, method=self.outlier_sampling)
+            box = ds['outlier_group'] * len(self.x_cols) + ds['outlier_col']
+            order = np.argsort(box, kind='stable')
+            box = box[order]
+            counts = np.bincount(box, minlength=nbox)
+            j = np.arange(len(box)) - np.repeat(np.cumsum(counts) - counts, counts)
+            y = np.full(nbox * m, np.nan)
+            y[box * m + j] = ds['outlier_y'][order]
+        n_drawn = np.isfinite(y.reshape(-1, m)).sum(1) if m else np.zeros(nbox, dtype=int)
+        return {
+            'box': {'top': q3, 'bottom': q1,
+                    'fimp_str': ['%0.2f [%0.2f, %0.2f]' % x for x in zip(q2, q1, q3)],
+                    'outliers_str': ['%i [%i drawn]' % x for x in zip(n_outliers, n_drawn)]},
+            'median': {'y': q2},
+            'whisker': {'y0': np.stack([upper, lower, lower, upper], 1).ravel(),
+                        'y1': np.stack([upper, lower, q1, q3], 1).ravel()},
+            'outlier': {'y': y},
+        }
+
+    def flush(self):
+        pending = self._take()
+        if not pending:
+            return
+        # fold in every pending frame, then compute the stats once
+        updated = False
+        for item in pending:
+            if isinstance(item, dict):
+                self._stats = item
+                updated = False
+            else:
+                self.accumulator.update(item)
+                updated = True
+        if updated:
+            self._stats = self.accumulator.stats()
+        stats = self._stats
+        ngroups, ncols = stats['q1'].shape
+        nbox = ngroups * ncols
+
+        if list(stats['groups']) != self.groups:
+            # layout changed: resend everything
+            self.groups = list(stats['groups'])
+            cols = self._columns(stats['q1'], stats)
+            self.label_source.data = cols['label']
+            self.box_source.data = cols['box']
+            self.median_source.data = cols['median']
+            self.whisker_source.data = cols['whisker']
+            self.outlier_source.data = cols['outlier']
+            self._sent = self._box_values(stats, nbox)
+            return
+
+        values = self._box_values(stats, nbox)
+        changed = np.zeros(nbox, dtype=bool)
+        for name, cols in values.items():
+            for col, v in cols.items():
+                v, old = np.asarray(v), np.asarray(self._sent[name][col])
+                changed |= _changed(v, old).reshape(nbox, -1).any(1)
+        self._sent = values
+        rows = np.flatnonzero(changed)
+        if not len(rows):
+            return
+        m = self.max_outliers
+        w_rows = (4 * rows[:, None] + np.arange(4)).ravel()
+        self.box_source.patch(_row_patches(_take(values['box'], rows), rows))
+        self.median_source.patch(_row_patches(_take(values['median'], rows), rows))
+        self.whisker_source.patch(_row_patches(_take(values['whisker'], w_rows), w_rows))
+        self.outlier_source.patch({'y': [(slice(int(b) * m, (int(b) + 1) * m), values['outlier']['y'][b * m:(b + 1) * m])
+                                         for b in rows]})
+        self.label_source.patch({'label': [(i, '%s [%i encounters]' % (g, n))
+                                           for i, (g, n) in enumerate(zip(stats['groups'], stats['counts']))]})
+
+
+def serve(make_doc, port=5006, show=False, allow_websocket_origin=None):
+    '''Runs a bokeh server in this process until interrupted.
+
+    # Arguments
+    make_doc: function(doc) called for each new session; typically creates
+        live plots and calls their `attach(doc)`
+
+    port: [int] port to listen on
+
+    show: [bool] open a browser tab
+
+    allow_websocket_origin: list of 'host:port' allowed to connect besides
+        localhost
+    '''
+    from bokeh.server.server import Server
+    origins = ['localhost:%i' % port] + list(allow_websocket_origin or [])
+    server = Server({'/': make_doc}, port=port, allow_websocket_origin=origins)
+    server.start()
+    if show:
+        server.io_loop.add_callback(server.show, '/')
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    import time
+
+    def make_doc(doc):
+        bars = LiveBarplot('x', 'y', group_col='g', error_col='e', interval=500).attach(doc)
+        boxes = LiveBoxplot(['a', 'b'], group_col='g', interval=500).attach(doc)
+
+        def feed():
+            rs = np.random.RandomState(0)
+            while True:
+                n = 4
+                bars.update(pd.DataFrame({'x': rs.choice(list('abcdef'), n), 'g': rs.choice(['g1', 'g2'], n),
+                                          'y': rs.randn(n), 'e': rs.rand(n) / 4}))
+                boxes.update(pd.DataFrame({'a': rs.randn(100), 'b': rs.exponential(size=100),
+                                           'g': rs.choice(['g1', 'g2'], 100)}))
+                time.sleep(0.1)
+        t = threading.Thread(target=feed)
+        t.daemon = True
+        t.start()
+
+    serve(make_doc, show=False)
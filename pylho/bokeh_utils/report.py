@@ -0,0 +1,95 @@
+'''
+Many figures in one html file.
+
+Saving each figure with `bki.save` writes a standalone file with its own
+BokehJS script tags and document. A `Report` puts all figures into one
+document with one set of resources (CDN links, inline BokehJS, or links to
+a local copy), and converts data columns to numpy arrays so bokeh writes
+them as base64 typed arrays instead of JSON lists.
+
+# Example
+    report = Report(title='cohort 7')
+    report.add(barplot.barplot(df, 'site', 'auc', None), title='AUC by site')
+    report.add(boxplot.boxplot(df, ['a', 'b'], None, group_col='site'))
+    report.save('cohort7.html')
+'''
+import numpy as np
+import bokeh.embed as bke
+import bokeh.layouts as bkl
+import bokeh.models as bkm
+import bokeh.resources as bkr
+
+
+def typed_columns(p):
+    '''Converts the list columns of every ColumnDataSource used by p to
+    numpy arrays where they are flat and numeric, so they serialize as
+    typed arrays. Nested lists (e.g. multi_line xs/ys) and strings are left
+    as is. Modifies the sources in place; returns p.'''
+    for source in p.select(type=bkm.ColumnDataSource):
+        data = {}
+        for col, values in source.data.items():
+            if isinstance(values, (list, tuple)) and len(values):
+                a = np.asarray(values)
+                if a.ndim == 1 and a.dtype.kind in 'biuf':
+                    values = a
+            data[col] = values
+        source.data = data
+    return p
+
+
+class Report(object):
+    '''Collects figures and writes them into a single html file.
+
+    # Arguments
+    title: [str] html page title
+
+    resources: 'cdn' (links to the BokehJS CDN), 'inline' (BokehJS embedded
+        once in the file), or a bokeh.resources.Resources, e.g.
+        Resources(mode='relative', root_dir=...) to use a local BokehJS copy
+
+    ncols: [int] figures per row
+    '''
+    def __init__(self, title='pylho report', resources='cdn', ncols=1):
+        self.title = title
+        self.resources = resources
+        self.ncols = ncols
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, p, title=None):
+        '''Adds a figure (or any bokeh layout), optionally under a heading.
+        Returns p.'''
+        item = typed_columns(p)
+        if title is not None:
+            item = bkl.column(bkm.Div(text='<h3>%s</h3>' % title), item)
+        self.items.append(item)
+        return p
+
+    def _resources(self):
+        if self.resources == 'cdn':
+            return bkr.CDN
+        if self.resources == 'inline':
+            return bkr.INLINE
+        if isinstance(self.resources, bkr.Resources):
+            return self.resources
+        raise RuntimeError('Do not understand resources: %s' % self.resources)
+
+    def layout(self):
+        '''Returns all figures as one bokeh layout'''
+        if self.ncols == 1:
+            return bkl.column(self.items)
+        rows = [self.items[i:i + self.ncols] for i in range(0, len(self.items), self.ncols)]
+        return bkl.layout(rows)
+
+    def to_html(self):
+        '''Returns the report as an html string'''
+        return bke.file_html(self.layout(), self._resources(), title=self.title)
+
+    def save(self, output_path):
+        '''Writes the report to output_path'''
+        html = self.to_html()
+        with open(output_path, 'w') as f:
+            f.write(html)
+        return output_path
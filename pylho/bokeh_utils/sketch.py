@@ -0,0 +1,126 @@
+'''
+Bounded-memory summaries of data streams, for plotting data that does not
+fit in memory.
+
+- QuantileSketch: mergeable KLL quantile sketch
+- Reservoir: fixed-size uniform sample (Algorithm R)
+'''
+import numpy as np
+
+
+class QuantileSketch(object):
+    '''Mergeable KLL quantile sketch. Keeps O(k log(n/k)) values; rank error
+    is roughly 1.7/k (about 1% for k=200). min and max are exact.
+
+    # Arguments
+    k: [int] accuracy parameter; size of the top compactor
+
+    seed: [int] seed for the random compaction offsets
+    '''
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, h):
+        depth = len(self.levels) - 1 - h
+        return max(2, int(np.ceil(self.k * (2 / 3.) ** depth)))
+
+    def update(self, values):
+        '''Adds an array of values (nan is ignored)'''
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        '''Merges another sketch into this one'''
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) <= self._capacity(h):
+                h += 1
+                continue
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            # sort, keep every other item (random offset) at double weight
+            items = np.sort(self.levels[h])
+            keep = items[len(items) - len(items) % 2:]
+            items = items[:len(items) - len(items) % 2]
+            promoted = items[self._rng.randint(2)::2]
+            self.levels[h] = keep
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            # capacities shrink as levels are added, so recheck from the bottom
+            h = 0
+
+    def quantile(self, q):
+        '''Returns estimated quantile(s) q in [0, 1]'''
+        q = np.asarray(q, dtype=float)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** h) for h, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cum = items[order], np.cumsum(weights[order])
+        idxs = np.searchsorted(cum, q * cum[-1], side='left')
+        ret = items[np.clip(idxs, 0, len(items) - 1)]
+        ret = np.where(q <= 0, self.min, np.where(q >= 1, self.max, ret))
+        return ret
+
+
+class Reservoir(object):
+    '''Fixed-size uniform random sample of a stream (Algorithm R), updated a
+    whole array at a time.
+
+    # Arguments
+    size: [int] max number of values kept
+
+    seed: [int] seed for sampling
+    '''
+    def __init__(self, size=1000, seed=None):
+        self.size = size
+        self.seen = 0
+        self.values = np.empty(size)
+        self._rng = np.random.RandomState(seed)
+
+    def __len__(self):
+        return min(self.seen, self.size)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        n_fill = max(min(self.size - self.seen, len(values)), 0)
+        self.values[self.seen:self.seen + n_fill] = values[:n_fill]
+        self.seen += n_fill
+        values = values[n_fill:]
+        if len(values):
+            # item i of the stream replaces a random slot with prob size / i
+            js = (self._rng.random_sample(len(values)) * (self.seen + np.arange(1, len(values) + 1))).astype(int)
+            take = js < self.size
+            self.values[js[take]] = values[take]
+            self.seen += len(values)
+        return self
+
+    def sample(self):
+        return self.values[:len(self)]
@@ -0,0 +1,89 @@
+'''
+Plot the resource usage timeline recorded by `debug.ResourceSampler`.
+'''
+import numpy as np
+import pandas as pd
+import bokeh.io as bki
+import bokeh.layouts as bkl
+import bokeh.models as bkm
+import bokeh.plotting as bkp
+
+
+def resource_frame(timeline):
+    '''Returns a DataFrame of the timeline with derived rates.
+
+    # Arguments
+    timeline: CSV path written by `ResourceSampler`, a pd.DataFrame with its
+        columns, a `ResourceSampler`, or its `timeline()` array
+
+    # Returns
+    df: pd.DataFrame with elapsed (secs since the first sample), cpu_percent,
+        rss_mb, read_mb_s, write_mb_s and open_fds
+    '''
+    from pylho.debug import ResourceSampler
+    if isinstance(timeline, str):
+        timeline = pd.read_csv(timeline)
+    elif isinstance(timeline, ResourceSampler):
+        timeline = timeline.timeline()
+    if not isinstance(timeline, pd.DataFrame):
+        timeline = pd.DataFrame(np.asarray(timeline, dtype=float), columns=ResourceSampler.FIELDS)
+
+    t = timeline['time'].to_numpy(dtype=float)
+    dt = np.diff(t, prepend=np.nan)
+    with np.errstate(all='ignore'):
+        def rate(col):
+            return np.diff(timeline[col].to_numpy(dtype=float), prepend=np.nan) / dt
+        return pd.DataFrame({'elapsed': t - t[0] if len(t) else t,
+                             'cpu_percent': 100.0 * rate('cpu_secs'),
+                             'rss_mb': timeline['rss_mb'].to_numpy(dtype=float),
+                             'read_mb_s': rate('read_mb'), 'write_mb_s': rate('write_mb'),
+                             'open_fds': timeline['open_fds'].to_numpy(dtype=float)})
+
+
+def plot_resources(timeline, output_path=None, fig_kwargs=None, title=None):
+    '''Plots CPU %, RSS, I/O rates and open fds over time as stacked figures
+    with a shared x axis.
+
+    # Arguments
+    timeline: see `resource_frame`
+
+    output_path: path to output html file. None skips saving
+
+    fig_kwargs: dictionary argument to send to each bkp.figure()
+
+    title: [str] title of the top figure
+
+    # Returns
+    layout: bokeh column of the figures
+    '''
+    if fig_kwargs is None:
+        fig_kwargs = {'height': 200, 'width': 1000}
+    df = resource_frame(timeline)
+    src = bkm.ColumnDataSource(data=dict((c, df[c].to_numpy()) for c in df.columns))
+
+    panels = [('cpu %', [('cpu_percent', 'black')]),
+              ('rss MB', [('rss_mb', 'blue')]),
+              ('io MB/s', [('read_mb_s', 'green'), ('write_mb_s', 'red')]),
+              ('open fds', [('open_fds', 'purple')])]
+    figures = []
+    for i, (label, lines) in enumerate(panels):
+        kwargs = dict(fig_kwargs)
+        if figures:
+            kwargs['x_range'] = figures[0].x_range
+        if i == 0 and title is not None:
+            kwargs['title'] = title
+        p = bkp.figure(**kwargs)
+        p.yaxis.axis_label = label
+        for col, color in lines:
+            p.line(x='elapsed', y=col, source=src, color=color, line_width=2, legend=col)
+        p.legend.location = 'top_left'
+        p.legend.click_policy = 'hide'
+        p.add_tools(bkm.HoverTool(tooltips=[('secs', '@elapsed{0.0}')] + [(col, '@%s{0.00}' % col) for col, _ in lines]))
+        figures.append(p)
+    figures[-1].xaxis.axis_label = 'secs'
+
+    layout = bkl.column(figures)
+    if output_path is not None:
+        bki.output_file(output_path)
+        bki.save(layout)
+    return layout
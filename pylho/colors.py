@@ -37,6 +37,7 @@ http://www.perceptualedge.com/articles/visual_business_intelligence/rules_for_us
        order = sequential
 '''
 import numpy as np
+from functools import lru_cache
 from itertools import cycle
 
 
@@ -75,10 +76,14 @@ class palettes:
 
 
 class colour_wheel(object):
-    '''infinite loop colour wheel, given a palette. use next(cw) for next color
+    '''infinite loop colour wheel, given a palette. use next(cw) for next color.
+    If n is given and the palette has fewer than n colors, the palette is
+    extended with `colors.distinct` so the first n colors never repeat.
     '''
-    def __init__(self, color_palette=None):
+    def __init__(self, color_palette=None, n=None):
         color_palette = _check_get_palette(color_palette)
+        if n is not None and len(color_palette) < n:
+            color_palette = distinct(n, color_palette=color_palette)
         self.color_palette = color_palette
         self.cycle_color_palette = cycle(color_palette)
 
@@ -166,7 +171,7 @@ def _check_get_palette(color_palette):
     return color_palette
 
 
-def random(n=1, color_palette=None):
+def random(n=1, color_palette=None, seed=None):
     '''Randomly select n colors from a chosen color_palette
     (from colors.palette bank).
 
@@ -177,18 +182,69 @@ def random(n=1, color_palette=None):
         If list or array-like, will assume a color palette list is
         already passed in and will randomly select from that list.
 
+    seed: [int] Seed for a local random state, so the selection is
+        reproducible. If None, uses the global `np.random` state.
+
     # Return
-    ret: [list] list of colors in HEX
+    ret: [list] list of colors in HEX. If the palette has fewer than n
+        colors, it is first extended with `colors.distinct`.
     '''
     color_palette = _check_get_palette(color_palette)
     if len(color_palette) < n:
-        raise RuntimeError('Not enough colors in palette (%s with %i colors) to choose %i.' % (color_palette, len(color_palette), n))
+        color_palette = distinct(n, color_palette=color_palette, seed=seed)
 
-    idxs = np.random.choice(np.arange(len(color_palette)), size=n, replace=False)
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    idxs = rng.choice(np.arange(len(color_palette)), size=n, replace=False)
     return list(np.array(color_palette)[idxs])
 
 
-def color_array(arr, color_palette=None):
+def encode_colors(arr, color_palette=None, seed=None):
+    '''Dictionary-encodes arr into color codes. Instead of materializing a
+    color per element, returns an index array into a small palette holding
+    one color per unique element of arr (sorted, as in `np.unique`).
+
+    # Example:
+    arr = [1, 1, 0, 0]
+    return = [1, 1, 0, 0], ['green', 'blue']
+
+    # Arguments
+    arr: ndarray, iterable, pd.Series, pd.Categorical
+        List of labels or distinguishing elements to assign colors to.
+        Categoricals are encoded directly from their codes.
+
+    color_palette: [str] Name of color palette in colors.palette to use.
+        If list or array-like, will assume a color palette list is
+        already passed in and will randomly select from that list.
+
+    seed: [int] Seed passed to `colors.random` for reproducible colors.
+
+    # Returns
+    codes: [ndarray] int array, same length as arr, indexing into palette
+
+    palette: [ndarray] HEX color for each unique element of arr
+    '''
+    import pandas as pd
+
+    if isinstance(arr, pd.Series):
+        arr = arr.values
+    if isinstance(arr, pd.Categorical):
+        codes, n = np.asarray(arr.codes, dtype=np.intp), len(arr.categories)
+    else:
+        # hash-based factorize is O(N); only the uniques get sorted
+        codes, uniques = pd.factorize(np.asarray(arr), sort=True)
+        n = len(uniques)
+
+    # missing values get their own color, after the sorted uniques
+    missing = codes < 0
+    if np.any(missing):
+        codes = np.where(missing, n, codes)
+        n += 1
+
+    palette = np.array(random(n=n, color_palette=color_palette, seed=seed))
+    return codes, palette
+
+
+def color_array(arr, color_palette=None, seed=None, as_bytes=False):
     '''
     Returns array containig color for each unique element in arr.
 
@@ -204,21 +260,20 @@ def color_array(arr, color_palette=None):
         If list or array-like, will assume a color palette list is
         already passed in and will randomly select from that list.
 
+    seed: [int] Seed passed to `colors.random` for reproducible colors.
+
+    as_bytes: [bool] If True, returns fixed-width bytes (S7 for HEX palettes)
+        instead of str, which is ~4x smaller for large arrays.
+
     # Returns
     color_arr: ndarray of HEX colors
         Returns an array where each element corresponds to a color within
         `arr`, mapped by unique elements of arr.
     '''
-    color_palette = _check_get_palette(color_palette)
-    uniques = np.unique(arr)
-    n = len(uniques)
-    if len(color_palette) < n:
-        raise RuntimeError('Not enough colors in palette (%s with %i colors) to choose %i.' % (color_palette, len(color_palette), n))
-
-    rng_colors = random(n=n, color_palette=color_palette)
-    colors = dict(zip(uniques, rng_colors))
-    color_arr = np.array([colors[x] for x in arr])
-    return color_arr
+    codes, palette = encode_colors(arr, color_palette=color_palette, seed=seed)
+    if as_bytes:
+        palette = palette.astype('S')
+    return palette.take(codes)
 
 
 def hex_to_rgb(value, normalize=False):
@@ -252,3 +307,296 @@ def rgb_to_hex(rgb):
         raise RuntimeError("Do not understand %s to convert to hex" % rgb)
 
     return ret
+
+
+# lookup tables for the vectorized hex <-> rgb conversions
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+_HEX_VALUES[_HEX_DIGITS] = np.arange(16, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16, dtype=np.uint8)
+
+
+def hex_to_rgb_batch(values, normalize=False, alpha=None):
+    '''Vectorized `hex_to_rgb`. Converts an array of hex strings to an
+    (N, 3) or (N, 4) array of RGB(A) values using numpy byte operations.
+
+    Accepts '#RGB', '#RGBA', '#RRGGBB' and '#RRGGBBAA' (leading '#' optional,
+    case insensitive). Missing alpha channels are filled as fully opaque.
+
+    # Arguments
+    values: [str, list, ndarray] hex string or array-like of hex strings
+
+    normalize: [bool] If True, returns floats in [0, 1] instead of uint8
+
+    alpha: [bool] If True, always return RGBA. If False, always drop alpha.
+        If None, returns RGBA only if any input has an alpha channel.
+
+    # Returns
+    rgb: ndarray of shape (N, 3) or (N, 4), or (3,)/(4,) if a single string
+        was passed in.
+    '''
+    arr = np.asarray(values)
+    scalar = arr.ndim == 0
+    arr = arr.ravel()
+    if arr.dtype.kind not in 'SU':
+        arr = arr.astype('U')
+
+    # work on the raw characters: (N, >=9) uint8 matrix, zero padded. unicode
+    # is read directly from its ucs4 buffer; non-ascii maps to an invalid byte
+    n = len(arr)
+    if arr.dtype.kind == 'U':
+        width = arr.itemsize // 4
+        codes = np.minimum(arr.view(np.uint32).reshape(n, width), 255)
+    else:
+        width = arr.itemsize
+        codes = arr.view(np.uint8).reshape(n, width)
+    b = np.zeros((n, max(width, 9)), dtype=np.uint8)
+    b[:, :width] = codes
+    length = (b != 0).sum(axis=1)
+    has_hash = b[:, 0] == ord('#')
+    digits = np.where(has_hash[:, None], b[:, 1:9], b[:, :8])
+    ndigits = length - has_hash
+
+    nibbles = _HEX_VALUES[digits]
+    invalid = ~np.isin(ndigits, (3, 4, 6, 8))
+    invalid |= np.any((nibbles == 255) & (np.arange(8) < ndigits[:, None]), axis=1)
+    if np.any(invalid):
+        raise RuntimeError('Do not understand %s to convert to rgb' % arr[invalid][:5].tolist())
+
+    short = ndigits <= 4
+    short_vals = nibbles[:, :4] * np.uint8(17)
+    long_vals = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    rgba = np.where(short[:, None], short_vals, long_vals)
+    rgba[(ndigits == 3) | (ndigits == 6), 3] = 255
+
+    if alpha is None:
+        alpha = bool(np.any((ndigits == 4) | (ndigits == 8)))
+    ret = rgba if alpha else rgba[:, :3]
+
+    if normalize:
+        ret = ret / 255.
+
+    if scalar:
+        ret = ret[0]
+    return ret
+
+
+def rgb_to_hex_batch(rgb, normalize=False, as_bytes=False):
+    '''Vectorized `rgb_to_hex`. Converts an (N, 3) or (N, 4) array of RGB(A)
+    values to an array of '#rrggbb' or '#rrggbbaa' strings.
+
+    # Arguments
+    rgb: [array-like] (N, 3)/(N, 4) array, or single (3,)/(4,) color. Integer
+        or float values in [0, 255], or floats in [0, 1] if `normalize`.
+
+    normalize: [bool] If True, assumes values are normalized to [0, 1]
+
+    as_bytes: [bool] If True, returns fixed-width bytes (S7/S9) instead of
+        str, which avoids the unicode conversion.
+
+    # Returns
+    hex_arr: ndarray of hex strings, or a single hex string if a single color
+        was passed in.
+    '''
+    rgb = np.asarray(rgb)
+    scalar = rgb.ndim == 1
+    rgb = np.atleast_2d(rgb)
+    if rgb.ndim != 2 or rgb.shape[1] not in (3, 4):
+        raise RuntimeError('Do not understand array of shape %s to convert to hex' % (rgb.shape,))
+
+    if normalize:
+        rgb = rgb * 255.
+    if rgb.dtype != np.uint8:
+        rgb = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+
+    n, nchannels = rgb.shape
+    width = 1 + 2 * nchannels
+    out = np.empty((n, width), dtype=np.uint8)
+    out[:, 0] = ord('#')
+    out[:, 1::2] = _HEX_DIGITS[rgb >> 4]
+    out[:, 2::2] = _HEX_DIGITS[rgb & 15]
+    ret = out.view('S%i' % width).ravel()
+    if not as_bytes:
+        ret = ret.astype('U%i' % width)
+
+    if scalar:
+        ret = ret[0]
+    return ret
+
+
+# --- continuous colormaps --- #
+# CIELAB conversion constants (sRGB, D65 white point)
+_RGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_D65 = np.array([0.95047, 1.0, 1.08883])
+_LUT_CACHE = {}
+
+
+def rgb_to_lab(rgb):
+    '''Converts (N, 3) sRGB floats in [0, 1] to CIELAB (D65).'''
+    rgb = np.asarray(rgb, dtype=float)
+    lin = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = lin.dot(_RGB_TO_XYZ.T) / _D65
+    f = np.where(xyz > (6. / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6. / 29) ** 2) + 4. / 29)
+    return np.stack([116 * f[..., 1] - 16,
+                     500 * (f[..., 0] - f[..., 1]),
+                     200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def lab_to_rgb(lab):
+    '''Converts (N, 3) CIELAB (D65) to sRGB floats, clipped to [0, 1].'''
+    lab = np.asarray(lab, dtype=float)
+    fy = (lab[..., 0] + 16) / 116.
+    f = np.stack([fy + lab[..., 1] / 500., fy, fy - lab[..., 2] / 200.], axis=-1)
+    xyz = np.where(f > 6. / 29, f ** 3, 3 * (6. / 29) ** 2 * (f - 4. / 29)) * _D65
+    lin = xyz.dot(_XYZ_TO_RGB.T)
+    rgb = np.where(lin <= 0.0031308, 12.92 * lin, 1.055 * np.abs(lin) ** (1 / 2.4) - 0.055)
+    return np.clip(rgb, 0, 1)
+
+
+def colormap_lut(color_palette='hot', n=256):
+    '''Returns an n-entry lookup table interpolating color_palette in CIELAB,
+    so steps between colors are perceptually even. Tables are computed once
+    per (palette, n) and cached, so they are returned read-only; copy them
+    before modifying.
+
+    # Arguments
+    color_palette: [str] Name of color palette in colors.palette to use, or
+        a list of HEX colors (ordered from low to high values).
+
+    n: [int] Number of entries in the lookup table (eg. 256 or 4096)
+
+    # Returns
+    rgb_lut: [ndarray] (n, 3) uint8 RGB lookup table
+
+    hex_lut: [ndarray] (n,) HEX lookup table
+    '''
+    color_palette = _check_get_palette(color_palette)
+    key = (tuple(color_palette), n)
+    if key not in _LUT_CACHE:
+        lab = rgb_to_lab(hex_to_rgb_batch(color_palette, normalize=True, alpha=False))
+        stops = np.linspace(0, 1, len(lab))
+        t = np.linspace(0, 1, n)
+        lab = np.stack([np.interp(t, stops, lab[:, i]) for i in range(3)], axis=-1)
+        rgb_lut = np.rint(lab_to_rgb(lab) * 255).astype(np.uint8)
+        hex_lut = rgb_to_hex_batch(rgb_lut)
+        rgb_lut.setflags(write=False)
+        hex_lut.setflags(write=False)
+        _LUT_CACHE[key] = (rgb_lut, hex_lut)
+
+    return _LUT_CACHE[key]
+
+
+def colormap(values, color_palette='hot', vmin=None, vmax=None, n=256,
+             nan_color='#d9d9d9', output='hex'):
+    '''Maps an array of floats to colors along a continuous colormap made by
+    interpolating color_palette (see `colormap_lut`). The mapping is a
+    single vectorized `take` from a precomputed lookup table.
+
+    # Arguments
+    values: [array-like] float values to color
+
+    color_palette: [str] Name of color palette in colors.palette to use
+        (sequential: 'hot', 'cold'; diverging: 'hot_cold'), or list of HEX.
+
+    vmin: [float] Value mapped to the first color. Defaults to nanmin(values)
+
+    vmax: [float] Value mapped to the last color. Defaults to nanmax(values)
+
+    n: [int] Number of entries in the lookup table
+
+    nan_color: [str] HEX color to use for NaN values
+
+    output: [str] 'hex' for HEX strings, 'bytes' for fixed-width S7 HEX, or
+        'rgb' for an (N, 3) uint8 array.
+
+    # Returns
+    color_arr: ndarray of colors, same length as values.
+    '''
+    values = np.asarray(values, dtype=float)
+    rgb_lut, hex_lut = colormap_lut(color_palette, n=n)
+    if output == 'rgb':
+        lut = np.vstack([rgb_lut, hex_to_rgb_batch(nan_color, alpha=False)])
+    elif output in ('hex', 'bytes'):
+        lut = np.append(hex_lut, nan_color)
+        if output == 'bytes':
+            lut = lut.astype('S')
+    else:
+        raise RuntimeError('Do not understand output: %s' % output)
+    if not values.size:
+        return lut[:0]
+    if vmin is None:
+        vmin = np.nanmin(values)
+    if vmax is None:
+        vmax = np.nanmax(values)
+
+    # scale to lut indices. nan gets the extra entry at the end of the lut
+    scale = (n - 1) / float(vmax - vmin) if vmax > vmin else 0.
+    idxs = np.clip((values - vmin) * scale + 0.5, 0, n - 1)
+    idxs = np.where(np.isnan(values), n, idxs).astype(np.intp)
+    return lut.take(idxs, axis=0)
+
+
+# --- maximally distinct palettes --- #
+def distinct(n, color_palette=None, seed=None, lightness=(25, 90)):
+    '''Generates n perceptually distinct colors. Starts from the colors of
+    color_palette, then greedily adds the candidate color farthest (in
+    CIELAB) from every color chosen so far (farthest-point sampling).
+    Results are cached by (palette, n, seed, lightness).
+
+    # Arguments
+    n: [int] Number of colors to generate. Supports n in the thousands.
+
+    color_palette: [str] Name of color palette in colors.palette to seed
+        from. If list, will assume a color palette list is already passed in.
+
+    seed: [int] If given, jitters the candidate colors with this seed to get
+        a different (but reproducible) set of colors.
+
+    lightness: [tuple] (min, max) CIELAB lightness of generated colors, to
+        avoid near-black/near-white colors.
+
+    # Returns
+    ret: [list] list of n colors in HEX. The first colors are the palette.
+    '''
+    color_palette = _check_get_palette(color_palette)
+    return list(_distinct(n, tuple(color_palette), seed, tuple(lightness)))
+
+
+@lru_cache(maxsize=64)
+def _distinct(n, color_palette, seed, lightness):
+    if n <= len(color_palette):
+        return color_palette[:n]
+
+    # candidate grid in rgb, with at least ~4 candidates per requested color
+    g = max(32, int(np.ceil((4 * n) ** (1 / 3.))))
+    grid = np.stack(np.meshgrid(*[np.arange(g)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+    grid = grid.astype(float)
+    if seed is not None:
+        grid += np.random.RandomState(seed).uniform(-0.5, 0.5, size=grid.shape)
+    rgb = np.clip(grid / (g - 1), 0, 1)
+    lab = rgb_to_lab(rgb)
+    keep = (lab[:, 0] >= lightness[0]) & (lab[:, 0] <= lightness[1])
+    rgb, lab = rgb[keep], lab[keep]
+    if len(lab) < n:
+        raise RuntimeError('Can not generate %i distinct colors within lightness %s' % (n, lightness))
+
+    # distance from every candidate to its nearest chosen color
+    chosen = rgb_to_lab(hex_to_rgb_batch(list(color_palette), normalize=True, alpha=False)) \
+        if len(color_palette) else np.empty((0, 3))
+    # squared distances expanded as |x|^2 - 2 x.c + |c|^2 so each update is a
+    # single matrix-vector product
+    sq = (lab ** 2).sum(axis=1)
+    min_dist = np.full(len(lab), np.inf)
+    for c in chosen:
+        np.minimum(min_dist, sq - 2 * lab.dot(c) + c.dot(c), out=min_dist)
+
+    idxs = np.empty(n - len(color_palette), dtype=np.intp)
+    for i in range(len(idxs)):
+        idx = np.argmax(min_dist)
+        idxs[i] = idx
+        np.minimum(min_dist, sq - 2 * lab.dot(lab[idx]) + sq[idx], out=min_dist)
+
+    return color_palette + tuple(rgb_to_hex_batch(rgb[idxs], normalize=True).tolist())
@@ -3,16 +3,29 @@
 import time
 from . import colors
 import numpy as np
+import asyncio
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
 from collections import OrderedDict
 
 
 class Logger(object):
     """ """
     def __init__(self, prefix, verbosity_level=1,
-                 level_colors=['green', 'blue', 'purple', 'cyan']):
+                 level_colors=['green', 'blue', 'purple', 'cyan'], writer=None):
         self.prefix = prefix + ' '
         self.colors = level_colors
         self.verbosity_level = verbosity_level
+        # optional `AsyncLogWriter`; if None, prints synchronously
+        self.writer = writer
 
     def __call__(self, text_str, verbose=0, color=None):
         # verbose: -1 => warning, verbose -2 => error
@@ -26,10 +39,211 @@ class Logger(object):
         if color is None:
             color = self.colors[v]
 
+        # hand off formatting and io to the background writer
+        if self.writer is not None:
+            self.writer.put((time.time(), self.prefix, verbose, color, text_str))
+            return
+
         prefix = colors.color_string(self.prefix, color) + '... ' * v
         print("%s %s" % (prefix, text_str))
 
 
+class AsyncLogWriter(object):
+    """Non-blocking, batched backend for `Logger`. Callers only push a record
+    onto a `queue.SimpleQueue`; a daemon thread drains it every
+    `flush_interval` secs and does the coloring and writing, with one
+    write + flush per stream per batch.
+
+    # Arguments
+    stream: file-like to write colored terminal output to. Defaults to
+        sys.stdout. If False, no terminal output.
+
+    json_path: [str] If given, also appends each record as a JSON line to this
+        file (keys: time, name, verbose, msg).
+
+    flush_interval: [float] secs between batched writes
+
+    rate_limit: [float] If given, identical messages (same prefix and text)
+        within this many secs are suppressed; the next emitted copy is
+        suffixed with the number of repeats suppressed.
+
+    exit_timeout: [float] max secs to wait at interpreter exit for queued
+        records to be written
+
+    A batch that fails to write (e.g. the stream was closed) is reported on
+    stderr and dropped; the writer keeps running.
+
+    # Example
+    writer = AsyncLogWriter(json_path='train.jsonl', rate_limit=10)
+    log = Logger('[train]', verbosity_level=3, writer=writer)
+    logging.getLogger().addHandler(LogHandler(writer))
+    """
+    def __init__(self, stream=None, json_path=None, flush_interval=0.5, rate_limit=None,
+                 exit_timeout=10.0):
+        self.stream = sys.stdout if stream is None else stream
+        self.json_file = open(json_path, 'a') if json_path is not None else None
+        self.flush_interval = flush_interval
+        self.rate_limit = rate_limit
+        self._last_emitted = {}
+        self._queue = queue.SimpleQueue()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='AsyncLogWriter', daemon=True)
+        self._thread.start()
+        # the thread is a daemon, so write what is still queued at exit
+        atexit.register(self.close, exit_timeout)
+
+    def put(self, record):
+        """Enqueues record: (time, name, verbose, color, msg), where verbose
+        follows `Logger` (1, 2, .. for levels, -1 warning, -2 error). Raises
+        RuntimeError for an unknown color, as the synchronous path does."""
+        colors.color_string('', record[3])
+        self._queue.put(record)
+
+    def flush(self, timeout=None):
+        """Blocks until every record put so far has been written"""
+        if self._closed.is_set() or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self, timeout=None):
+        """Writes remaining records and stops the background thread, waiting
+        at most timeout secs (None waits until done)"""
+        if self._closed.is_set():
+            return
+        self.flush(timeout)
+        self._closed.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self.json_file is not None and not self._thread.is_alive():
+            self.json_file.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            time.sleep(self.flush_interval)
+            try:
+                while True:
+                    records.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            stop = False
+            events = []
+            batch = []
+            for record in records:
+                if record is None:
+                    stop = True
+                elif isinstance(record, threading.Event):
+                    events.append(record)
+                else:
+                    batch.append(record)
+
+            try:
+                batch = self._rate_limit(batch)
+                if stop:
+                    batch.extend(self._pending_repeats())
+                self._write(batch)
+            except Exception as e:
+                self._report(e, len(batch))
+            finally:
+                for event in events:
+                    event.set()
+            if stop:
+                return
+
+    @staticmethod
+    def _report(error, n):
+        try:
+            sys.__stderr__.write('[AsyncLogWriter] dropped %i records: %s: %s\n'
+                                 % (n, type(error).__name__, error))
+        except Exception:
+            pass
+
+    def _rate_limit(self, batch):
+        if self.rate_limit is None:
+            return batch
+
+        ret = []
+        for t, name, level, color, msg in batch:
+            key = (name, msg)
+            last = self._last_emitted.get(key)
+            if last is not None and t - last[0] < self.rate_limit:
+                last[1] += 1
+                continue
+            if last is not None and last[1]:
+                msg = '%s [%i repeats suppressed]' % (msg, last[1])
+            self._last_emitted[key] = [t, 0]
+            ret.append((t, name, level, color, msg))
+
+        # forget keys that are outside the window and have nothing pending
+        if len(self._last_emitted) > 10000:
+            now = time.time()
+            self._last_emitted = {k: v for k, v in self._last_emitted.items()
+                                  if v[1] or now - v[0] < self.rate_limit}
+        return ret
+
+    def _pending_repeats(self):
+        now = time.time()
+        ret = [(now, name, 0, 'default', '%s [%i repeats suppressed]' % (msg, v[1]))
+               for (name, msg), v in self._last_emitted.items() if v[1]]
+        self._last_emitted = {}
+        return ret
+
+    def _write(self, batch):
+        if not batch:
+            return
+        if self.stream:
+            lines = ['%s %s\n' % (colors.color_string(name, color) + '... ' * max(level - 1, 0), msg)
+                     for t, name, level, color, msg in batch]
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        if self.json_file is not None:
+            lines = [json.dumps({'time': t, 'name': name.strip(), 'verbose': level, 'msg': str(msg)}) + '\n'
+                     for t, name, level, color, msg in batch]
+            self.json_file.write(''.join(lines))
+            self.json_file.flush()
+
+
+class LogHandler(logging.Handler):
+    """stdlib `logging` handler that routes records through an
+    `AsyncLogWriter`, so `logging` calls get the same non-blocking, colored
+    and JSON-lines output as `Logger`."""
+    level_colors = {logging.DEBUG: 'cyan', logging.INFO: 'green',
+                    logging.WARNING: 'yellow', logging.ERROR: 'red'}
+    # `Logger` verbose levels: -1 => warning, -2 => error
+    level_verbose = {logging.DEBUG: 2, logging.INFO: 1, logging.WARNING: -1, logging.ERROR: -2}
+
+    def __init__(self, writer, level=logging.NOTSET):
+        super(LogHandler, self).__init__(level=level)
+        self.writer = writer
+
+    def emit(self, record):
+        try:
+            color = self.level_colors.get(record.levelno, 'red' if record.levelno > logging.ERROR else 'default')
+            verbose = self.level_verbose.get(record.levelno, -2 if record.levelno > logging.ERROR else 0)
+            self.writer.put((record.created, '[%s] ' % record.name, verbose, color, self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Blocks until the writer has written every record emitted so far;
+        called by `logging.shutdown()` at exit"""
+        self.writer.flush()
+
+    def close(self):
+        self.flush()
+        super(LogHandler, self).close()
+
+
 class Timer(object):
     """ """
     def __init__(self):
@@ -50,9 +264,322 @@ class Timer(object):
         return ret
 
     def summary(self):
-        return ['%s: %0.3f secs' % (k, v) for k, v in self.timers.iteritems()]
+        return ['%s: %0.3f secs' % (k, v) for k, v in self.timers.items()]
 
     def print_summary(self):
         timers = self.summary()
         for s in timers:
             print(s)
+
+
+
+class _Scope(object):
+    """Context manager for one profiled scope. See `Profiler.__call__`"""
+    __slots__ = ('profiler', 'time_key')
+
+    def __init__(self, profiler, time_key):
+        self.profiler = profiler
+        self.time_key = time_key
+
+    def __enter__(self):
+        self.profiler.start(self.time_key)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.end(self.time_key)
+
+
+class _ScopeStats(object):
+    """Running aggregates of one profiled scope in ns. count, total, min and
+    max are exact; p50/p99 are computed from a uniform reservoir sample of
+    at most `size` durations, so memory stays bounded in hot loops."""
+    __slots__ = ('count', 'total', 'min', 'max', 'reservoir', 'size', '_random')
+
+    def __init__(self, size):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.reservoir = []
+        self.size = size
+        self._random = random.Random(0)
+
+    def add(self, d):
+        self.count += 1
+        self.total += d
+        if self.min is None or d < self.min:
+            self.min = d
+        if self.max is None or d > self.max:
+            self.max = d
+        if len(self.reservoir) < self.size:
+            self.reservoir.append(d)
+        else:
+            i = self._random.randrange(self.count)
+            if i < self.size:
+                self.reservoir[i] = d
+
+    def snapshot(self):
+        return self.count, self.total, self.min, self.max, list(self.reservoir)
+
+
+class Profiler(Timer):
+    """Hierarchical profiler built on `Timer`. Scopes nest, the same key can
+    be timed any number of times, and every call is recorded with
+    `time.perf_counter_ns` so that count/min/mean/p50/p99 can be reported.
+    count/total/min/max are exact; p50/p99 are estimated from a reservoir of
+    at most `reservoir_size` durations per scope.
+
+    The active scope stack lives in a `contextvars.ContextVar`, so scopes
+    opened in different threads or asyncio tasks never interleave.
+    Recording a call is a frame push/pop and a few running updates under a
+    lock (a handful of times the cost of an empty `with` block), cheap
+    enough to leave in hot loops.
+
+    # Example
+    prof = Profiler()
+    with prof('epoch'):
+        with prof('load'):
+            ...
+
+    @prof.profile('step')
+    def step(): ...
+
+    prof.print_summary()
+    prof.to_collapsed('profile.folded')  # for flamegraph.pl / speedscope
+    """
+    def __init__(self, reservoir_size=1024):
+        super(Profiler, self).__init__()
+        self.reservoir_size = reservoir_size
+        # active scope is a linked frame: (path, start_ns, parent_frame)
+        self._frame = contextvars.ContextVar('pylho_profiler_%i' % id(self), default=None)
+        self._lock = threading.Lock()
+
+    def __call__(self, time_key):
+        return _Scope(self, time_key)
+
+    def start(self, time_key):
+        parent = self._frame.get()
+        path = (time_key,) if parent is None else parent[0] + (time_key,)
+        self._frame.set((path, time.perf_counter_ns(), parent))
+
+    def end(self, time_key):
+        t1 = time.perf_counter_ns()
+        frame = self._frame.get()
+        if frame is None or frame[0][-1] != time_key:
+            raise RuntimeError('Can not end %s, open scope is: %s' % (time_key, frame and '/'.join(map(str, frame[0]))))
+        path, t0, parent = frame
+        self._frame.set(parent)
+
+        with self._lock:
+            scope = self.timers.get(path)
+            if scope is None:
+                scope = self.timers[path] = _ScopeStats(self.reservoir_size)
+            scope.add(t1 - t0)
+        return (t1 - t0) / 1e9
+
+    def profile(self, time_key=None):
+        """Decorator to profile every call of a function or coroutine
+        function. time_key defaults to the function's qualified name."""
+        def decorator(fn):
+            key = fn.__qualname__ if time_key is None else time_key
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with _Scope(self, key):
+                        return await fn(*args, **kwargs)
+            else:
+                @functools.wraps(fn)
+                def wrapper(*args, **kwargs):
+                    with _Scope(self, key):
+                        return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.timers = OrderedDict()
+
+    def _snapshot(self):
+        with self._lock:
+            return [(path, scope.snapshot()) for path, scope in self.timers.items()]
+
+    def stats(self):
+        """Returns OrderedDict of scope path ('a/b/c') to aggregates in secs:
+        count, total, min, mean, p50, p99, max"""
+        ret = OrderedDict()
+        for path, (count, total, t_min, t_max, reservoir) in self._snapshot():
+            p50, p99 = np.percentile(np.array(reservoir, dtype=np.float64) / 1e9, [50, 99])
+            ret['/'.join(str(k) for k in path)] = OrderedDict([
+                ('count', count), ('total', total / 1e9), ('min', t_min / 1e9),
+                ('mean', total / 1e9 / count), ('p50', p50), ('p99', p99), ('max', t_max / 1e9)])
+        return ret
+
+    def summary(self):
+        return ['%s: %0.3f secs [n=%i | min %0.6f | mean %0.6f | p50 %0.6f | p99 %0.6f]'
+                % (k, v['total'], v['count'], v['min'], v['mean'], v['p50'], v['p99'])
+                for k, v in self.stats().items()]
+
+    def to_collapsed(self, path=None):
+        """Exports self time per scope stack in collapsed-stack format
+        ('a;b;c <microseconds>' per line), as read by flamegraph.pl and
+        speedscope. Writes to path if given; returns the string."""
+        totals = dict((k, v[1]) for k, v in self._snapshot())
+        self_times = dict(totals)
+        for k, total in totals.items():
+            if len(k) > 1 and k[:-1] in self_times:
+                self_times[k[:-1]] -= total
+
+        lines = ['%s %i' % (';'.join(str(x) for x in k), max(v, 0) // 1000)
+                 for k, v in self_times.items()]
+        ret = '\n'.join(lines) + '\n'
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(ret)
+        return ret
+
+    def to_json(self, path=None):
+        """Exports `stats` as JSON. Writes to path if given; returns the
+        string."""
+        ret = json.dumps(self.stats(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(ret)
+        return ret
+
+
+class ResourceSampler(object):
+    """Samples the resource usage of a process every `interval` secs on a
+    daemon thread: CPU time, RSS, I/O bytes and open file descriptors, read
+    from /proc/<pid>. Without /proc (e.g. macOS) only CPU time and peak RSS
+    of this process are available, from `resource`; other fields are nan.
+
+    # Arguments
+    pid: [int] process to sample. Defaults to this process
+
+    interval: [float] secs between samples
+
+    csv_path: [str] If given, each sample is appended to this CSV file as it
+        is taken (columns: `FIELDS`)
+
+    # Example
+    with ResourceSampler(interval=1, csv_path='train_resources.csv') as sampler:
+        train()
+    print(sampler.summary_text())
+    """
+    FIELDS = ['time', 'cpu_secs', 'rss_mb', 'read_mb', 'write_mb', 'open_fds']
+
+    def __init__(self, pid=None, interval=1.0, csv_path=None):
+        self.pid = pid
+        self.interval = interval
+        self.csv_path = csv_path
+        self.samples = []
+        self._proc = '/proc/%s' % ('self' if pid is None else pid)
+        self._has_proc = os.path.exists(self._proc)
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._page_mb = (os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096) / 1024.0 ** 2
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read(self, name):
+        with open(os.path.join(self._proc, name)) as f:
+            return f.read()
+
+    def sample(self):
+        """Takes one sample now; returns it as a tuple of `FIELDS`"""
+        t = time.time()
+        if not self._has_proc:
+            import resource
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            rss = usage.ru_maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+            return (t, usage.ru_utime + usage.ru_stime, rss, np.nan, np.nan, np.nan)
+
+        # fields after the parenthesized command name; utime, stime are 14, 15
+        stat = self._read('stat').rsplit(')', 1)[1].split()
+        cpu = (int(stat[11]) + int(stat[12])) / float(self._ticks)
+        rss = int(self._read('statm').split()[1]) * self._page_mb
+        read_mb = write_mb = np.nan
+        try:
+            io = dict(line.split(': ') for line in self._read('io').splitlines())
+            read_mb, write_mb = int(io['read_bytes']) / 1024.0 ** 2, int(io['write_bytes']) / 1024.0 ** 2
+        except (OSError, KeyError, ValueError):
+            pass
+        try:
+            fds = len(os.listdir(os.path.join(self._proc, 'fd')))
+        except OSError:
+            fds = np.nan
+        return (t, cpu, rss, read_mb, write_mb, fds)
+
+    def _run(self):
+        f = open(self.csv_path, 'a') if self.csv_path is not None else None
+        try:
+            if f is not None and f.tell() == 0:
+                f.write(','.join(self.FIELDS) + '\n')
+            while True:
+                try:
+                    row = self.sample()
+                except (OSError, ValueError, IndexError):
+                    break  # process is gone
+                self.samples.append(row)
+                if f is not None:
+                    f.write('%0.3f,%0.3f,%0.2f,%0.2f,%0.2f,%s\n' % row)
+                    f.flush()
+                if self._stop.wait(self.interval):
+                    break
+        finally:
+            if f is not None:
+                f.close()
+
+    def start(self):
+        """Starts sampling on a daemon thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ResourceSampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Takes a last sample and stops the thread"""
+        if self._thread is None:
+            return self
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            self.samples.append(self.sample())
+        except (OSError, ValueError, IndexError):
+            pass
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def timeline(self):
+        """Returns the samples as a (n_samples, len(FIELDS)) float array"""
+        return np.array(self.samples, dtype=float).reshape(-1, len(self.FIELDS))
+
+    def summary(self):
+        """Returns dict of peak and average figures over all samples: wall
+        secs, cpu secs, average cpu %, peak and mean RSS MB, MB read and
+        written, peak open fds"""
+        a = self.timeline()
+        if not len(a):
+            return {}
+        wall = a[-1, 0] - a[0, 0]
+        cpu = a[-1, 1] - a[0, 1]
+        with np.errstate(all='ignore'):
+            return {'wall_secs': wall, 'cpu_secs': cpu,
+                    'cpu_percent': 100.0 * cpu / wall if wall > 0 else np.nan,
+                    'rss_peak_mb': np.nanmax(a[:, 2]), 'rss_mean_mb': np.nanmean(a[:, 2]),
+                    'read_mb': a[-1, 3] - a[0, 3], 'write_mb': a[-1, 4] - a[0, 4],
+                    'open_fds_peak': np.nanmax(a[:, 5]) if not np.isnan(a[:, 5]).all() else np.nan}
+
+    def summary_text(self):
+        """One-line `summary` for alerts"""
+        s = self.summary()
+        if not s:
+            return 'no resource samples'
+        return ('cpu %0.1f secs (%0.0f%%) | rss peak %0.0f MB, mean %0.0f MB | io read %0.1f MB, write %0.1f MB | fds peak %s'
+                % (s['cpu_secs'], s['cpu_percent'], s['rss_peak_mb'], s['rss_mean_mb'],
+                   s['read_mb'], s['write_mb'], 'n/a' if np.isnan(s['open_fds_peak']) else '%i' % s['open_fds_peak']))
@@ -0,0 +1,288 @@
+'''
+Querying and monitoring nvidia GPUs without blocking.
+
+`nvidia-smi` is run asynchronously through a provider, so a fake command can
+stand in for it (see scripts/fake_nvidia_smi.py).
+'''
+import asyncio
+import threading
+import time
+import numpy as np
+
+# fields sampled by `GPUMetricsCollector`, as named by `nvidia-smi --query-gpu`
+QUERY_FIELDS = ['utilization.gpu', 'memory.used', 'memory.total', 'temperature.gpu']
+SPARK_CHARS = u'\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+
+
+class GPUQueryError(Exception):
+    """Raises error if the GPU query command failed"""
+    pass
+
+
+class NvidiaSmiProvider(object):
+    '''Runs nvidia-smi as an asyncio subprocess.
+
+    # Arguments
+    cmd: [list] command to run. Replace with a fake command to test, eg.
+        ['python', 'scripts/fake_nvidia_smi.py']
+
+    timeout: [float] secs before the command is killed
+    '''
+    def __init__(self, cmd=('nvidia-smi',), timeout=10.0):
+        self.cmd = list(cmd)
+        self.timeout = timeout
+
+    async def run(self, *args):
+        '''Runs cmd with args, returns stdout as str'''
+        proc = await asyncio.create_subprocess_exec(*(self.cmd + list(args)),
+                                                    stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise GPUQueryError('%s timed out after %0.1f secs' % (' '.join(self.cmd), self.timeout))
+
+        if proc.returncode != 0:
+            raise GPUQueryError('%s exited with %i: %s' % (' '.join(self.cmd), proc.returncode,
+                                                           stderr.decode(errors='replace').strip()))
+        return stdout.decode(errors='replace')
+
+    async def status(self):
+        '''Returns the plain `nvidia-smi` status table'''
+        return await self.run()
+
+    async def query(self, fields=QUERY_FIELDS):
+        '''Queries fields with `--query-gpu` CSV output.
+
+        # Returns
+        gpu_ids: [ndarray] int index of each gpu
+
+        values: [ndarray] (n_gpus, len(fields)) float array; unsupported
+            fields ([N/A]) are nan
+        '''
+        out = await self.run('--query-gpu=%s' % ','.join(['index'] + list(fields)),
+                             '--format=csv,noheader,nounits')
+        rows = [[_to_float(x) for x in line.split(',')] for line in out.strip().splitlines() if line.strip()]
+        values = np.array(rows, dtype=float).reshape(-1, len(fields) + 1)
+        return values[:, 0].astype(int), values[:, 1:]
+
+
+def _nanmean(v):
+    v = v[~np.isnan(v)]
+    return v.mean() if len(v) else np.nan
+
+
+def _to_float(x):
+    try:
+        return float(x)
+    except ValueError:
+        return np.nan
+
+
+def free_gpus(provider=None, max_memory_used=500.0, max_utilization=10.0):
+    '''Returns ids of gpus that look idle: at most max_memory_used MiB used
+    and max_utilization % busy. Blocks while nvidia-smi runs, so call it
+    outside of event loops.
+
+    # Arguments
+    provider: object with an async `query(fields)`. Defaults to
+        `NvidiaSmiProvider()`
+    '''
+    provider = NvidiaSmiProvider() if provider is None else provider
+    gpu_ids, values = asyncio.run(provider.query(['memory.used', 'utilization.gpu']))
+    idle = (np.nan_to_num(values[:, 0]) <= max_memory_used) & (np.nan_to_num(values[:, 1]) <= max_utilization)
+    return [int(i) for i in gpu_ids[idle]]
+
+
+class GPUStatusService(object):
+    '''Serves GPU status to many concurrent callers. The status is cached
+    for `ttl` secs, and concurrent requests while a query is running share
+    that one query, so replies are served from memory.
+
+    # Arguments
+    provider: object with an async `status()`. Defaults to
+        `NvidiaSmiProvider()`
+
+    ttl: [float] secs to reuse a status before querying again
+
+    # Example
+    service = GPUStatusService(ttl=5)
+    text = await service.status()
+    '''
+    def __init__(self, provider=None, ttl=2.0):
+        self.provider = NvidiaSmiProvider() if provider is None else provider
+        self.ttl = ttl
+        self._value = None
+        self._stamp = -float('inf')
+        self._inflight = None
+
+    async def status(self):
+        if time.monotonic() - self._stamp < self.ttl:
+            return self._value
+
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        # shield so one cancelled caller doesn't cancel the shared query
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self):
+        try:
+            self._value = await self.provider.status()
+            self._stamp = time.monotonic()
+            return self._value
+        finally:
+            self._inflight = None
+
+
+class RingBuffer(object):
+    '''Fixed-size time series buffer: the newest `capacity` rows of
+    `n_fields` floats, with their timestamps, in preallocated numpy arrays.'''
+    def __init__(self, capacity, n_fields):
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan)
+        self.values = np.full((capacity, n_fields), np.nan)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, row):
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.values[i] = row
+        self.count += 1
+
+    def last(self, seconds=None, now=None):
+        '''Returns (times, values) in time order, for the last `seconds`
+        (or everything if None)'''
+        n = len(self)
+        order = (np.arange(self.count - n, self.count)) % self.capacity
+        times, values = self.times[order], self.values[order]
+        if seconds is not None:
+            now = time.time() if now is None else now
+            keep = times >= now - seconds
+            times, values = times[keep], values[keep]
+        return times, values
+
+
+class GPUMetricsCollector(object):
+    '''Samples GPU utilization, memory and temperature at a fixed cadence
+    into one `RingBuffer` per GPU, so trend summaries and sparklines are
+    answered from memory instead of re-querying nvidia-smi.
+
+    # Arguments
+    provider: object with an async `query(fields)`. Defaults to
+        `NvidiaSmiProvider()`
+
+    interval: [float] secs between samples
+
+    capacity: [int] samples kept per GPU (default: 1 hour at 5 secs)
+
+    fields: [list] `nvidia-smi --query-gpu` fields to sample
+
+    # Example
+    collector = GPUMetricsCollector(interval=5).start()
+    print(collector.summary_text(minutes=10))
+    '''
+    def __init__(self, provider=None, interval=5.0, capacity=720, fields=QUERY_FIELDS):
+        self.provider = NvidiaSmiProvider() if provider is None else provider
+        self.interval = interval
+        self.capacity = capacity
+        self.fields = list(fields)
+        self.buffers = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    async def sample(self):
+        '''Queries once and appends a row to each GPU's buffer'''
+        t = time.time()
+        gpu_ids, values = await self.provider.query(self.fields)
+        for gpu_id, row in zip(gpu_ids, values):
+            if gpu_id not in self.buffers:
+                self.buffers[gpu_id] = RingBuffer(self.capacity, len(self.fields))
+            self.buffers[gpu_id].append(t, row)
+
+    async def run(self):
+        '''Samples every `interval` secs (without drift) until `stop`'''
+        loop = asyncio.get_running_loop()
+        next_t = loop.time()
+        while not self._stop.is_set():
+            try:
+                await self.sample()
+            except GPUQueryError as e:
+                print('[GPUMetricsCollector] %s' % e)
+            except Exception as e:
+                # e.g. nvidia-smi missing or unparsable output; keep sampling
+                print('[GPUMetricsCollector] %s: %s' % (type(e).__name__, e))
+            next_t += self.interval
+            await asyncio.sleep(max(next_t - loop.time(), 0))
+
+    def start(self):
+        '''Runs the sampler in a background daemon thread'''
+        self._stop.clear()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run()),
+                                        name='GPUMetricsCollector', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def last(self, gpu_id, field, minutes=None):
+        '''Returns (times, values) of field for gpu_id over the last minutes'''
+        times, values = self.buffers[gpu_id].last(None if minutes is None else minutes * 60.)
+        return times, values[:, self.fields.index(field)]
+
+    def summary(self, minutes=10):
+        '''Returns pd.DataFrame with mean/max/last of every field per GPU over
+        the last minutes'''
+        import pandas as pd
+
+        rows = {}
+        for gpu_id in sorted(self.buffers):
+            _, values = self.buffers[gpu_id].last(minutes * 60.)
+            row = {}
+            for i, field in enumerate(self.fields):
+                v = values[:, i]
+                row[(field, 'last')] = v[-1] if len(v) else np.nan
+                v = v[~np.isnan(v)]
+                row[(field, 'mean')] = v.mean() if len(v) else np.nan
+                row[(field, 'max')] = v.max() if len(v) else np.nan
+            rows[gpu_id] = row
+        return pd.DataFrame.from_dict(rows, orient='index')
+
+    def sparkline(self, gpu_id, field='utilization.gpu', minutes=10, width=30, vmin=0, vmax=None):
+        '''Returns unicode sparkline of field for gpu_id over the last minutes.
+        Samples are averaged into `width` bins.'''
+        _, v = self.last(gpu_id, field, minutes)
+        if not len(v):
+            return ''
+        bins = np.array([b.mean() for b in np.array_split(v, min(width, len(v)))])
+        vmax = np.nanmax(bins) if vmax is None else vmax
+        scale = (len(SPARK_CHARS) - 1) / float(vmax - vmin) if vmax > vmin else 0.
+        idxs = np.clip(np.nan_to_num((bins - vmin) * scale), 0, len(SPARK_CHARS) - 1).astype(int)
+        return ''.join(SPARK_CHARS[i] for i in idxs)
+
+    def summary_text(self, minutes=10):
+        '''Returns a short per-GPU trend report (eg. for slack)'''
+        lines = ['GPU trends over the last %g minutes' % minutes]
+        for gpu_id in sorted(self.buffers):
+            _, values = self.buffers[gpu_id].last(minutes * 60.)
+            if not len(values):
+                continue
+            last = dict(zip(self.fields, values[-1]))
+            mean = {f: _nanmean(values[:, i]) for i, f in enumerate(self.fields)}
+            line = 'GPU%i util %3.0f%% (mean %3.0f%%) %s' % (
+                gpu_id, last.get('utilization.gpu', np.nan), mean.get('utilization.gpu', np.nan),
+                self.sparkline(gpu_id, 'utilization.gpu', minutes, vmax=100) if 'utilization.gpu' in last else '')
+            if 'memory.used' in last and 'memory.total' in last:
+                line += ' | mem %0.1f/%0.1fG' % (last['memory.used'] / 1024., last['memory.total'] / 1024.)
+            if 'temperature.gpu' in last:
+                line += ' | %0.0fC' % last['temperature.gpu']
+            lines.append(line)
+        return '\n'.join(lines)
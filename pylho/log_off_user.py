@@ -1,12 +1,22 @@
 """
-Forcefully log off linux user from server
+Forcefully log off linux users from server
+
+Processes are read from /proc once and indexed by controlling terminal
+(pts/N for remote logins, ttyN for local ones). Each user's session, plus
+every descendant of it, is sent SIGTERM, then SIGKILL after a timeout; the
+result is verified against the same index by checking each target pid
+(and its start time, so reused pids are not mistaken for survivors).
 """
-import subprocess
+import os
+import signal
 import sys
+import time
 
 
 class BashError(Exception):
-    """Raises error if bash command was not successfully executed"""
+    """Raises error if bash command was not successfully executed. No longer
+    raised here (processes are read from /proc); kept so code importing it
+    keeps working."""
     def __init__(self, cmd, err):
         self.msg = "Error executing bash command: %s"
         self.msg += '\n========== Err ============\n'
@@ -16,50 +26,172 @@ class BashError(Exception):
         return repr(self.msg)
 
 
-def find_user(user_num, tty=False):
-    """Finds PID associated with login of user_num. if tty=True, will search
-    for tty user (aka local)"""
-    if tty:
-        prefix = 'tty'
-    else:
-        prefix = 'pts/'
-
-    cmd = 'ps -dN|grep %s%i' % (prefix, user_num)
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-    out, err = p.communicate()
+def _tty_name(tty_nr):
+    """Decodes the tty_nr field of /proc/<pid>/stat, eg. 'pts/3' or 'tty1'.
+    Returns None for processes without a terminal."""
+    major = (tty_nr >> 8) & 0xfff
+    minor = (tty_nr & 0xff) | ((tty_nr >> 12) & 0xfff00)
+    if 136 <= major <= 143:
+        return 'pts/%i' % (minor + (major - 136) * 256)
+    if major == 4 and minor < 64:
+        return 'tty%i' % minor
+    return None
+
+
+def _read_stat(pid, proc='/proc'):
+    """Returns (state, ppid, tty_nr, starttime) of pid, or None if it is gone"""
+    try:
+        with open('%s/%s/stat' % (proc, pid)) as f:
+            stat = f.read()
+    except (OSError, IOError):
+        return None
+    # the command name is parenthesized and may contain spaces
+    fields = stat.rsplit(')', 1)[1].split()
+    return fields[0], int(fields[1]), int(fields[4]), int(fields[19])
+
+
+def scan_processes(proc='/proc'):
+    """Reads every process from /proc in one pass.
+
+    # Returns
+    procs: dict pid -> (state, ppid, tty name or None, starttime)
+    """
+    procs = {}
+    for name in os.listdir(proc):
+        if not name.isdigit():
+            continue
+        stat = _read_stat(name, proc=proc)
+        if stat is not None:
+            state, ppid, tty_nr, starttime = stat
+            procs[int(name)] = (state, ppid, _tty_name(tty_nr), starttime)
+    return procs
+
+
+def session_index(procs):
+    """Returns dict tty name -> list of pids with that controlling terminal"""
+    index = {}
+    for pid, (_, _, tty, _) in procs.items():
+        if tty is not None:
+            index.setdefault(tty, []).append(pid)
+    return index
+
+
+def process_trees(procs, roots):
+    """Returns the set of roots and all of their descendants"""
+    children = {}
+    for pid, (_, ppid, _, _) in procs.items():
+        children.setdefault(ppid, []).append(pid)
+    ret, stack = set(), list(roots)
+    while stack:
+        pid = stack.pop()
+        if pid not in ret:
+            ret.add(pid)
+            stack.extend(children.get(pid, []))
+    return ret
+
+
+def _alive(pid, starttime, proc='/proc'):
+    stat = _read_stat(pid, proc=proc)
+    return stat is not None and stat[3] == starttime and stat[0] not in ('Z', 'X')
+
+
+def _signal_all(pids, sig):
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def log_off_users(user_nums, tty=False, timeout=5.0, poll_interval=0.1, proc='/proc'):
+    """Forcefully logs off many users (use `who`) in one pass: SIGTERM to
+    every process of their sessions and descendants, SIGKILL to whatever is
+    left after timeout secs. This process and its ancestors are spared.
+
+    # Arguments
+    user_nums: [list] terminal numbers, eg. 3 for pts/3
+
+    tty: [bool] If True, users are local ttyN logins instead of pts/N
+
+    timeout: [float] secs to wait after SIGTERM (and after SIGKILL) before
+        giving up
+
+    poll_interval: [float] secs between checks that the processes are gone
+
+    # Returns
+    survivors: dict user_num -> list of pids still alive (empty if logged off)
+    """
+    prefix = 'tty' if tty else 'pts/'
+    procs = scan_processes(proc=proc)
+    index = session_index(procs)
+
+    # never kill ourselves or the shell that runs us
+    spared, pid = set(), os.getpid()
+    while pid in procs and pid not in spared:
+        spared.add(pid)
+        pid = procs[pid][1]
+
+    targets = {}
+    for user_num in user_nums:
+        pids = process_trees(procs, index.get('%s%i' % (prefix, user_num), [])) - spared
+        targets[user_num] = dict((pid, procs[pid][3]) for pid in pids)
+
+    def remaining():
+        return dict((pid, start) for t in targets.values() for pid, start in t.items()
+                    if _alive(pid, start, proc=proc))
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        alive = remaining()
+        if not alive:
+            break
+        _signal_all(alive, sig)
+        deadline = time.time() + timeout
+        while alive and time.time() < deadline:
+            time.sleep(poll_interval)
+            alive = dict((pid, start) for pid, start in alive.items() if _alive(pid, start, proc=proc))
+
+    return dict((user_num, sorted(pid for pid, start in t.items() if _alive(pid, start, proc=proc)))
+                for user_num, t in targets.items())
+
+
+def find_session_pids(user_num, tty=False):
+    """Finds sorted PIDs on the terminal of login user_num. if tty=True, will
+    search for tty user (aka local)"""
+    prefix = 'tty' if tty else 'pts/'
+    return sorted(session_index(scan_processes()).get('%s%i' % (prefix, user_num), []))
 
-    if err:
-        raise BashError(cmd, err)
 
-    return out.split(prefix)[0].strip()
+def find_user(user_num, tty=False):
+    """Finds PID associated with login of user_num. if tty=True, will search
+    for tty user (aka local). Returns the lowest PID on its terminal as a
+    str, or '' if there is none"""
+    pids = find_session_pids(user_num, tty=tty)
+    return str(pids[0]) if pids else ''
 
 
 def kill_pid(pid):
     """Kills -9 based on PID"""
-    cmd = 'kill -9 %s' % pid
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
-    out, err = p.communicate()
-
-    if err:
-        raise BashError(cmd, err)
+    os.kill(int(pid), signal.SIGKILL)
 
 
-def log_off_user(user_num, tty=False):
+def log_off_user(user_num, tty=False, timeout=5.0):
     """Forcefully logs off user identified user_num (use `who`). if tty=True,
     will search for tty user (aka local)"""
-    pid = find_user(user_num, tty=tty)
-    kill_pid(pid)
-    pid = find_user(user_num, tty=tty)
-    if pid:
-        raise Exception("Could not log off user: %s" % user_num)
+    survivors = log_off_users([user_num], tty=tty, timeout=timeout)[user_num]
+    if survivors:
+        raise Exception("Could not log off user: %s (pids %s still running)" % (user_num, survivors))
 
     print("Successfully logged off %s" % user_num)
 
 
 if __name__ == '__main__':
-    args = sys.argv
-    if len(args) > 2:
-        raise Exception("Too many system arguments",
-                        "Only argument is user_num (int)")
-    user_num = int(args[1])
-    log_off_user(user_num)
+    args = sys.argv[1:]
+    if not args:
+        raise Exception("Missing system arguments",
+                        "Arguments are user_nums (int), eg. 3 5 for pts/3 and pts/5")
+    results = log_off_users([int(x) for x in args])
+    for user_num, survivors in results.items():
+        if survivors:
+            print("Could not log off %s: pids %s still running" % (user_num, survivors))
+        else:
+            print("Successfully logged off %s" % user_num)
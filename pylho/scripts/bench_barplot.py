@@ -0,0 +1,45 @@
+'''
+Benchmark `bokeh_utils.barplot` data preparation and rendering over many
+categories and groups.
+
+usage: python -m pylho.scripts.bench_barplot [n_categories] [n_groups] [output_path]
+'''
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pylho.bokeh_utils import barplot
+
+
+def make_data(n_categories=10000, n_groups=50, seed=0):
+    rs = np.random.RandomState(seed)
+    n = n_categories * n_groups
+    return pd.DataFrame({'x': np.tile(['cat%i' % i for i in range(n_categories)], n_groups),
+                         'group': np.repeat(['group%i' % i for i in range(n_groups)], n_categories),
+                         'y': rs.randn(n), 'error': rs.rand(n)})
+
+
+def bench_barplot(n_categories=10000, n_groups=50, output_path='bench_barplot.html'):
+    df = make_data(n_categories, n_groups)
+    before = df.copy()
+
+    t0 = time.perf_counter()
+    barplot.bar_data(df, 'x', 'y', group_col='group', error_col='error')
+    t_prep = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    barplot.barplot(df, 'x', 'y', output_path, group_col='group', error_col='error')
+    t_plot = time.perf_counter() - t0
+
+    assert df.equals(before), 'barplot modified the input frame'
+    print('barplot [%i categories x %i groups = %i bars]: prep %0.3f secs | prep + render + save %0.3f secs'
+          % (n_categories, n_groups, len(df), t_prep, t_plot))
+    return t_prep, t_plot
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    n_categories = int(args[0]) if len(args) > 0 else 10000
+    n_groups = int(args[1]) if len(args) > 1 else 50
+    output_path = args[2] if len(args) > 2 else 'bench_barplot.html'
+    bench_barplot(n_categories, n_groups, output_path)
@@ -0,0 +1,41 @@
+'''
+Benchmark the vectorized color conversions in `pylho.colors` against the
+original per-element versions.
+
+usage: python bench_colors.py [n]
+'''
+import sys
+import time
+import numpy as np
+from pylho import colors
+
+
+def timeit(fn, *args, **kwargs):
+    '''Returns best-of-3 wall time (secs) of fn(*args, **kwargs)'''
+    best = np.inf
+    for _ in range(3):
+        t0 = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_hex_rgb(n=200000):
+    rgb = np.random.RandomState(0).randint(0, 256, size=(n, 3))
+    hexes = colors.rgb_to_hex_batch(rgb)
+    assert (colors.rgb_to_hex(rgb) == hexes).all()
+    assert (np.array(colors.hex_to_rgb(list(hexes))) == colors.hex_to_rgb_batch(hexes)).all()
+
+    rows = [
+        ('hex_to_rgb', timeit(colors.hex_to_rgb, list(hexes)), timeit(colors.hex_to_rgb_batch, hexes)),
+        ('rgb_to_hex', timeit(colors.rgb_to_hex, rgb), timeit(colors.rgb_to_hex_batch, rgb)),
+    ]
+    for name, t_old, t_new in rows:
+        print('%s [n=%i]: original %0.4f secs | batch %0.4f secs | %0.1fx'
+              % (name, n, t_old, t_new, t_old / t_new))
+    return rows
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    bench_hex_rgb(n)
@@ -0,0 +1,50 @@
+'''
+Benchmark `import pylho` wall time in a fresh interpreter and check it stays
+under a fixed budget. Exits non-zero if the budget is exceeded or if the
+heavy dependencies (numpy, pandas, bokeh) are loaded eagerly.
+
+usage: python bench_import.py [budget_ms] [repeats]
+'''
+import subprocess
+import sys
+
+BUDGET_MS = 50.0
+HEAVY = ['numpy', 'pandas', 'bokeh']
+
+CODE = '''
+import sys, time
+t0 = time.perf_counter()
+import pylho
+dt = (time.perf_counter() - t0) * 1e3
+heavy = [m for m in %r if m in sys.modules]
+print('%%f %%s' %% (dt, ','.join(heavy)))
+''' % (HEAVY,)
+
+
+def time_import(repeats=10):
+    '''Returns list of `import pylho` times (ms), each in a new interpreter,
+    along with any heavy modules that were imported as a side effect.'''
+    times = []
+    heavy = set()
+    for _ in range(repeats):
+        out = subprocess.check_output([sys.executable, '-c', CODE]).decode().split()
+        times.append(float(out[0]))
+        if len(out) > 1:
+            heavy.update(out[1].split(','))
+    return times, sorted(heavy)
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    times, heavy = time_import(repeats)
+    best = min(times)
+    print('import pylho: best %0.2f ms | median %0.2f ms | budget %0.2f ms'
+          % (best, sorted(times)[len(times) // 2], budget))
+    if heavy:
+        print('[Fail] heavy modules loaded on import: %s' % ', '.join(heavy))
+        sys.exit(1)
+    if best > budget:
+        print('[Fail] import time over budget')
+        sys.exit(1)
+    print('[Success]')
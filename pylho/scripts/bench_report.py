@@ -0,0 +1,65 @@
+'''
+Benchmark writing many bar and box plots as one `Report` against one
+standalone html file per figure.
+
+usage: python -m pylho.scripts.bench_report [n_figures] [output_dir]
+'''
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pylho.bokeh_utils import barplot, boxplot
+from pylho.bokeh_utils.report import Report
+
+
+def make_data(n=20000, seed=0):
+    rs = np.random.RandomState(seed)
+    return pd.DataFrame({'x': rs.choice(['cat%i' % i for i in range(30)], n),
+                         'group': rs.choice(['group%i' % i for i in range(4)], n),
+                         'a': rs.randn(n), 'b': rs.exponential(size=n), 'c': rs.standard_t(3, n)})
+
+
+def make_figures(df, n_figures, output_dir=None):
+    '''Yields n_figures alternating bar and box plots, each saved to its own
+    file if output_dir is given'''
+    for i in range(n_figures):
+        path = None if output_dir is None else os.path.join(output_dir, 'figure%i.html' % i)
+        if i % 2:
+            yield boxplot.boxplot(df, ['a', 'b', 'c'], path, group_col='group')
+        else:
+            yield barplot.barplot(df, 'x', 'a', path, group_col='group', agg='mean', error_agg='sem')
+
+
+def bench_report(n_figures=40, output_dir='bench_report'):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    df = make_data()
+    per_file_dir = os.path.join(output_dir, 'per_file')
+    if not os.path.isdir(per_file_dir):
+        os.makedirs(per_file_dir)
+
+    t0 = time.perf_counter()
+    for _ in make_figures(df, n_figures, per_file_dir):
+        pass
+    t_files = time.perf_counter() - t0
+    size_files = sum(os.path.getsize(os.path.join(per_file_dir, f)) for f in os.listdir(per_file_dir))
+
+    t0 = time.perf_counter()
+    report = Report(title='bench_report')
+    for i, p in enumerate(make_figures(df, n_figures)):
+        report.add(p, title='figure %i' % i)
+    report_path = report.save(os.path.join(output_dir, 'report.html'))
+    t_report = time.perf_counter() - t0
+    size_report = os.path.getsize(report_path)
+
+    print('%i figures, one file each: %0.2f secs | %0.1f kB' % (n_figures, t_files, size_files / 1e3))
+    print('%i figures, one report:    %0.2f secs | %0.1f kB' % (n_figures, t_report, size_report / 1e3))
+    return t_files, size_files, t_report, size_report
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    n_figures = int(args[0]) if len(args) > 0 else 40
+    output_dir = args[1] if len(args) > 1 else 'bench_report'
+    bench_report(n_figures, output_dir)
@@ -0,0 +1,37 @@
+'''
+Benchmark `terminal.print_dfs` against the previous implementation, which
+rendered each frame with pd.DataFrame.__str__, for growing frame sizes.
+print_dfs should take about the same time for every size.
+
+usage: python bench_terminal.py [max_rows]
+'''
+import sys
+import time
+import numpy as np
+import pandas as pd
+from pylho import terminal
+
+SIZES = [(1000, 10), (100000, 10), (1000000, 10), (1000000, 200)]
+
+
+def bench_terminal(max_rows=None, sizes=SIZES):
+    rs = np.random.RandomState(0)
+    for nrows, ncols in sizes:
+        dfs = [pd.DataFrame(rs.randn(nrows, ncols), columns=['col%i' % i for i in range(ncols)])
+               for _ in range(2)]
+
+        t0 = time.perf_counter()
+        terminal.print_dfs(dfs, stdout=False, width=200, max_rows=max_rows)
+        t_new = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        [pd.DataFrame(df).__str__().split('\n') for df in dfs]
+        t_old = time.perf_counter() - t0
+
+        print('2 frames [%i rows x %i columns]: print_dfs %0.4f secs | DataFrame.__str__ %0.4f secs'
+              % (nrows, ncols, t_new, t_old))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    bench_terminal(int(args[0]) if args else None)
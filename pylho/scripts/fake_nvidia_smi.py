@@ -0,0 +1,52 @@
+'''
+Stand-in for `nvidia-smi` on machines without GPUs, for testing `pylho.gpus`
+with NvidiaSmiProvider(cmd=[python, this]). Prints a canned status table, or
+CSV for `--query-gpu=... --format=csv,noheader,nounits` with values that
+drift over time for 2 fake GPUs.
+
+usage: python fake_nvidia_smi.py [delay_secs] [--query-gpu=...] [--format=...]
+'''
+import math
+import sys
+import time
+
+N_GPUS = 2
+STATUS = '''+-----------------------------------------------------------------------------+
+| NVIDIA-SMI 390.48                 Driver Version: 390.48                    |
+|-------------------------------+----------------------+----------------------+
+| GPU  Name        Persistence-M| Bus-Id        Disp.A | Volatile Uncorr. ECC |
+| Fan  Temp  Perf  Pwr:Usage/Cap|         Memory-Usage | GPU-Util  Compute M. |
+|===============================+======================+======================|
+|   0  TITAN X (Pascal)    Off  | 00000000:02:00.0 Off |                  N/A |
+| 23%%   %2iC    P8    9W / 250W |     %5iMiB / 12196MiB |    %3i%%      Default |
++-------------------------------+----------------------+----------------------+
+'''
+
+
+def fake_value(field, gpu, t):
+    util = 50 + 45 * math.sin(t / 30. + gpu)
+    return {
+        'index': gpu,
+        'utilization.gpu': util,
+        'memory.used': 1000 + 100 * util,
+        'memory.total': 12196,
+        'temperature.gpu': 35 + 0.4 * util,
+    }.get(field, '[N/A]')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    # seconds to sleep before answering, to mimic a slow query
+    delay = float(args[0]) if args and not args[0].startswith('-') else 0.
+    time.sleep(delay)
+
+    query = [a.split('=', 1)[1] for a in args if a.startswith('--query-gpu=')]
+    t = time.time()
+    if query:
+        fields = query[0].split(',')
+        for gpu in range(N_GPUS):
+            vals = [fake_value(f, gpu, t) for f in fields]
+            print(', '.join(v if isinstance(v, str) else '%i' % round(v) for v in vals))
+    else:
+        util = fake_value('utilization.gpu', 0, t)
+        sys.stdout.write(STATUS % (fake_value('temperature.gpu', 0, t), fake_value('memory.used', 0, t), util))
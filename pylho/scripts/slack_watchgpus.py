@@ -1,47 +1,69 @@
 '''
+Slack bot that replies to "watchgpus" messages with the `nvidia-smi` status,
+and to "gputrends" messages with utilization/memory/temperature trends over
+the last 10 minutes (sampled in the background by `gpus.GPUMetricsCollector`).
 
+Event driven: waits on the RTM websocket instead of polling, runs
+`nvidia-smi` asynchronously through `gpus.GPUStatusService` (cached, so
+concurrent requests share one query) and posts replies off the event loop.
 '''
+import asyncio
 from slackclient import SlackClient
+from pylho import gpus
 from pylho import personal_keys
-import time
-from subprocess import Popen, PIPE
-
-
-butterbot_info = personal_keys.Long.butterbot
-sc = SlackClient(**butterbot_info)
-
-print('Starting')
-try:
-    if sc.rtm_connect():
-        while True:
-            events = sc.rtm_read()
-            for event in events:
-                if (('channel' in event) and ('text' in event) and (event.get('type') == 'message')):
-                    channel = event['channel']
-                    text = event['text']
-                    thread_ts = event['ts']
-                    if 'watchgpus' in text.lower():
-                        proc = Popen(['nvidia-smi'], stdout=PIPE, stderr=PIPE)
-
-                        while True:
-                            retcode = proc.poll()
-                            if retcode is not None:
-                                stdout = proc.stdout.readlines()
-                                stderr = proc.stderr.readlines()
-
-                                # break while loop
-                                break
-
-                        msg = '```' + ''.join(stdout) + '```'
-                        sc.api_call('chat.postMessage', channel=channel,
-                                    text=msg, as_user='true:',
-                                    thread_ts=thread_ts, reply_broadcast=False)
-            time.sleep(5)
+
+
+async def reply(sc, service, channel, thread_ts, collector=None):
+    if collector is None:
+        stdout = await service.status()
     else:
-        print('Connection failed, invalid token?')
-except Exception, e:
+        stdout = collector.summary_text(minutes=10)
+    msg = '```' + stdout + '```'
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lambda: sc.api_call('chat.postMessage', channel=channel,
+                                                         text=msg, as_user='true:',
+                                                         thread_ts=thread_ts, reply_broadcast=False))
+
+
+async def watch(sc, service, collector, poll_interval=1.0):
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    loop.add_reader(sc.server.websocket.sock.fileno(), readable.set)
+    while True:
+        # wake up on socket activity; the timeout covers frames already
+        # buffered by ssl, which don't make the socket readable again
+        try:
+            await asyncio.wait_for(readable.wait(), poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        readable.clear()
+
+        for event in sc.rtm_read():
+            if (('channel' in event) and ('text' in event) and (event.get('type') == 'message')):
+                if 'watchgpus' in event['text'].lower():
+                    asyncio.ensure_future(reply(sc, service, event['channel'], event['ts']))
+                elif 'gputrends' in event['text'].lower():
+                    asyncio.ensure_future(reply(sc, service, event['channel'], event['ts'], collector))
+
+
+def main():
     butterbot_info = personal_keys.Long.butterbot
     sc = SlackClient(**butterbot_info)
-    sc.api_call('chat.postMessage', channel='#vpicu-gpu', text='slack_watchgpus stopped running: %s' % e)
+    service = gpus.GPUStatusService(ttl=5.0)
+    collector = gpus.GPUMetricsCollector(interval=5.0).start()
+
+    print('Starting')
+    try:
+        if sc.rtm_connect():
+            asyncio.run(watch(sc, service, collector))
+        else:
+            print('Connection failed, invalid token?')
+    except Exception as e:
+        sc = SlackClient(**butterbot_info)
+        sc.api_call('chat.postMessage', channel='#vpicu-gpu', text='slack_watchgpus stopped running: %s' % e)
+
+    print('Done')
+
 
-print('Done')
+if __name__ == '__main__':
+    main()
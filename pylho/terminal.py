@@ -10,6 +10,7 @@ df.loc[(slice(None), slice(12, None)), :]
 '''
 import pandas as pd
 import os
+import shutil
 import numpy as np
 
 
@@ -30,7 +31,7 @@ def import_runfile():
     return runfile
 
 
-def run_script(driver_path, description=None, args=None):
+def run_script(driver_path, description=None, args=None, sample_resources=None):
     '''
     Runs python script with logging information sent to vpicu-gpu slack channel
     Uses spyderlab's runfile to run python script; this is so we can maintain
@@ -43,6 +44,12 @@ def run_script(driver_path, description=None, args=None):
                  None, will use driver_path basename
 
     args: [str] Arguments to pass to driver_path
+
+    sample_resources: [float] If given, samples this process' resource usage
+                 every sample_resources secs (see `debug.ResourceSampler`),
+                 writes the timeline to <driver>_resources.csv next to
+                 driver_path and adds peak/average figures to the [Done]
+                 alert
     '''
     from pylho import alerts
     runfile = import_runfile()
@@ -54,17 +61,152 @@ def run_script(driver_path, description=None, args=None):
     if args is None:
         args = ''
 
-    alerts.send_slack('[Starting] %s' % description)
+    sampler = None
+    if sample_resources is not None:
+        from pylho.debug import ResourceSampler
+        csv_path = os.path.splitext(driver_path)[0] + '_resources.csv'
+        sampler = ResourceSampler(interval=sample_resources, csv_path=csv_path).start()
+
+    # status messages of separate runs must never be suppressed as repeats
+    alerts.send_slack('[Starting] %s' % description, block=False, dedup=False)
     try:
         runfile(driver_path, args=args, wdir=os.path.dirname(driver_path))
-        alerts.send_slack('[Done] %s' % description)
+        usage = '' if sampler is None else '\n' + sampler.stop().summary_text()
+        alerts.send_slack('[Done] %s%s' % (description, usage), block=False, dedup=False)
     except Exception as e:
-        alerts.send_slack('[%s] Found error:\n%s' % (description, e))
+        usage = '' if sampler is None else '\n' + sampler.stop().summary_text()
+        alerts.send_slack('[%s] Found error:\n%s%s' % (description, e, usage), block=False)
 
     gc.collect()
     return locals()
 
 
+def _job_name(i, script):
+    return '%03i_%s' % (i, os.path.splitext(os.path.basename(script))[0])
+
+
+def _peak_rss_mb(pid):
+    '''Peak RSS (VmHWM) of a running process in MB, or None if unavailable'''
+    try:
+        with open('/proc/%i/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, IOError, ValueError):
+        pass
+    return None
+
+
+def run_sweep(jobs, processes=2, gpus=None, log_dir='sweep_logs', description='sweep',
+              alert=True, python=None, poll_interval=0.2):
+    '''
+    Runs python scripts in parallel, at most `processes` at a time, each in
+    its own process with stdout/stderr written to log files. With gpus,
+    every job gets one gpu (CUDA_VISIBLE_DEVICES) from a queue of free gpus
+    and returns it when done. Sends one slack alert summarizing the sweep
+    when all jobs are done.
+
+    # Arguments
+    jobs: [list] (script path, args) pairs; args is a str (split like a
+        shell would) or a list
+
+    processes: [int] max jobs running at once
+
+    gpus: [list] gpu ids to hand out, e.g. `gpus.free_gpus()` or a fake
+        inventory like [0, 1]. None runs jobs without assigning gpus
+
+    log_dir: [str] directory for <job>.out / <job>.err files
+
+    description: [str] prefix of the alert
+
+    alert: [bool] Send the summary to slack
+
+    python: [str] interpreter to run the scripts with. Defaults to this one
+
+    poll_interval: [float] secs between checks for finished jobs
+
+    # Returns
+    results: pd.DataFrame with one row per job: script, args, gpu,
+        returncode, seconds (wall time), max_rss_mb (peak RSS, sampled from
+        /proc/<pid>/status VmHWM every poll_interval; growth in the last
+        interval before exit is missed), stdout and stderr paths
+    '''
+    import shlex
+    import subprocess
+    import sys
+    import time
+    from collections import deque
+
+    if python is None:
+        python = sys.executable
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    if gpus is not None and not len(gpus):
+        raise RuntimeError('gpus is empty; pass None to run without gpus')
+    free = deque(gpus) if gpus is not None else None
+    slots = processes if gpus is None else min(processes, len(gpus))
+
+    pending = deque(enumerate(jobs))
+    running = {}
+    results = [None] * len(jobs)
+    try:
+        while pending or running:
+            # launch while there is a free slot (and gpu)
+            while pending and len(running) < slots:
+                i, (script, args) = pending.popleft()
+                args = shlex.split(args) if isinstance(args, str) else list(args or [])
+                name = _job_name(i, script)
+                out, err = os.path.join(log_dir, name + '.out'), os.path.join(log_dir, name + '.err')
+                env = dict(os.environ)
+                gpu = None
+                if free is not None:
+                    gpu = free.popleft()
+                    env['CUDA_VISIBLE_DEVICES'] = str(gpu)
+                with open(out, 'wb') as f_out, open(err, 'wb') as f_err:
+                    proc = subprocess.Popen([python, script] + args, stdout=f_out, stderr=f_err, env=env,
+                                            cwd=os.path.dirname(os.path.abspath(script)))
+                running[proc.pid] = (i, proc, gpu, time.time())
+                results[i] = {'script': script, 'args': ' '.join(args), 'gpu': gpu, 'returncode': None,
+                              'seconds': np.nan, 'max_rss_mb': np.nan, 'stdout': out, 'stderr': err}
+
+            time.sleep(poll_interval)
+
+            for pid in list(running):
+                i, proc, gpu, t0 = running[pid]
+                # VmHWM is the job's own peak RSS (it resets at exec, unlike
+                # wait4's ru_maxrss, which starts from this process' peak)
+                peak = _peak_rss_mb(pid)
+                if peak is not None:
+                    results[i]['max_rss_mb'] = np.fmax(results[i]['max_rss_mb'], peak)
+
+                done_pid, status = os.waitpid(pid, os.WNOHANG)
+                if not done_pid:
+                    continue
+                del running[pid]
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                results[i].update({'returncode': proc.returncode, 'seconds': time.time() - t0})
+                if free is not None:
+                    free.append(gpu)
+    finally:
+        # don't leave orphaned jobs behind on KeyboardInterrupt or errors
+        for i, proc, gpu, t0 in running.values():
+            proc.kill()
+            proc.wait()
+
+    results = pd.DataFrame(results, columns=['script', 'args', 'gpu', 'returncode', 'seconds',
+                                             'max_rss_mb', 'stdout', 'stderr'])
+    if alert:
+        from pylho import alerts
+        failed = results[results['returncode'] != 0]
+        lines = ['[%s] %i/%i jobs done, %i failed' % (description, len(results) - len(failed), len(results), len(failed))]
+        for row in results.itertuples():
+            lines.append('%s %s %s: exit %s | %0.1f secs | %0.0f MB'
+                         % ('ok  ' if row.returncode == 0 else 'FAIL', os.path.basename(row.script),
+                            row.args, row.returncode, row.seconds, row.max_rss_mb))
+        alerts.send_slack('\n'.join(lines))
+    return results
+
+
 def set_terminal(max_rows=40, precision=4, threshold=100, not_scientific=True):
     '''Resets terminal for neater printing of dataframes'''
     # set pandas stuff
@@ -81,17 +223,116 @@ def set_terminal(max_rows=40, precision=4, threshold=100, not_scientific=True):
     return '[Success] Set pandas terminal: [width %i] | [max_rows %i] | [precision %i]' % (w, max_rows, precision)
 
 
-def print_dfs(dfs, names=None, stdout=True):
+def _format_column(values, precision):
+    '''Formats a 1d array of cell values as strings'''
+    if values.dtype.kind == 'f':
+        return ['NaN' if v != v else '%.*f' % (precision, v) for v in values]
+    return [str(v) for v in values]
+
+
+def _clip(s, width):
+    return s if len(s) <= width else s[:max(width - 3, 0)] + '...'
+
+
+def format_df(df, width=None, max_rows=None, max_colwidth=None, precision=None):
+    '''Formats the visible part of a DataFrame as lines of text. Only the
+    head/tail window of rows and the columns that fit in width are ever
+    formatted, so the cost does not depend on the size of df.
+
+    # Arguments
+    df: [pd.DataFrame or pd.Series]
+
+    width: [int] max characters per line. Defaults to the terminal width
+
+    max_rows: [int] rows shown; longer frames show the first and last
+        max_rows / 2 rows. Defaults to pandas display.max_rows (or 60)
+
+    max_colwidth: [int] cells are clipped to this many characters. Defaults
+        to pandas display.max_colwidth (or 50)
+
+    precision: [int] decimals shown for floats. Defaults to pandas
+        display.precision
+
+    # Returns
+    lines: list of str, all of the same length
     '''
-    Neatly prints to dataframes next to each other.
+    df = pd.DataFrame(df)
+    if width is None:
+        width = shutil.get_terminal_size().columns
+    if max_rows is None:
+        max_rows = pd.get_option('display.max_rows') or 60
+    if max_colwidth is None:
+        max_colwidth = pd.get_option('display.max_colwidth') or 50
+    if precision is None:
+        precision = pd.get_option('display.precision')
+    nrows, ncols = df.shape
+
+    # row window
+    if nrows > max_rows:
+        n_head = max(max_rows // 2, 1)
+        rows = np.r_[0:n_head, nrows - max(max_rows - n_head, 1):nrows]
+    else:
+        rows = np.arange(nrows)
+    gap = n_head if nrows > max_rows else None
+    window = df.iloc[rows]
+
+    def column(header, values):
+        cells = [_clip(c, max_colwidth) for c in [str(header)] + _format_column(values, precision)]
+        if gap is not None:
+            cells.insert(gap + 1, '...')
+        w = max(len(c) for c in cells)
+        return [c.rjust(w) for c in cells]
+
+    # index, then columns left to right until the width is used up
+    index_name = '' if window.index.name is None else window.index.name
+    cols = [column(index_name, window.index.to_numpy())]
+    used = len(cols[0][0])
+    for i in range(ncols):
+        col = column(df.columns[i], window.iloc[:, i].to_numpy())
+        more = i < ncols - 1
+        if used + 2 + len(col[0]) + (5 if more else 0) > width:
+            cols.append(['...'] * len(col))
+            break
+        cols.append(col)
+        used += 2 + len(col[0])
+
+    lines = ['  '.join(cells) for cells in zip(*cols)]
+    lines.append('[%i rows x %i columns]' % (nrows, ncols))
+    w = max(len(line) for line in lines)
+    return [line.ljust(w) for line in lines]
+
+
+def iter_dfs(dfs, names=None, width=None, max_rows=None, spacer='   |   ', **kwargs):
+    '''Yields the lines of dataframes printed side by side, each titled by
+    its name. The terminal width is shared evenly between the frames; see
+    `format_df` for kwargs.'''
+    if width is None:
+        width = shutil.get_terminal_size().columns
+    frame_width = max((width - len(spacer) * (len(dfs) - 1)) // max(len(dfs), 1), 10)
+    blocks = []
+    for df, name in zip(dfs, names):
+        lines = format_df(df, width=frame_width, max_rows=max_rows, **kwargs)
+        w = max(len(lines[0]), len(name))
+        blocks.append([name.ljust(w)] + [line.ljust(w) for line in lines])
+
+    # frames shorter than the longest are padded with blank lines
+    for i in range(max(len(b) for b in blocks)):
+        yield spacer.join(b[i] if i < len(b) else ' ' * len(b[0]) for b in blocks).rstrip()
+
+
+def print_dfs(dfs, names=None, stdout=True, width=None, max_rows=None):
+    '''
+    Neatly prints dataframes next to each other, fitted to the terminal
+    width. Only the head/tail rows and the columns that fit are formatted
+    (see `format_df`), so huge frames print as fast as small ones.
 
     # Arguments
-    df1: [pd.DataFrame] df1
-    df2: [pd.DataFrame] df2
-    name1: [str] Name to title df1
-    name2: [str] Nmae to title df2
+    dfs: [list] pd.DataFrame or pd.Series to print
+    names: [list] Names to title each frame. Defaults to df0, df1, ...
+    stdout: [bool] Print the result
+    width: [int] Total width. Defaults to the terminal width
+    max_rows: [int] Rows shown per frame. Defaults to pandas display.max_rows
     '''
-    SPACER = '   |   '
     if not isinstance(dfs, list):
         raise RuntimeError('dfs needs to be a list of dataframes. got %s' % type(dfs))
 
@@ -104,22 +345,137 @@ def print_dfs(dfs, names=None, stdout=True):
     else:
         names = ['df%i' % i for i in range(len(dfs))]
 
-    # make sure dfs are dataframes and not series, series is a little different
-    dfs_str = [pd.DataFrame(df).__str__().split('\n') for df in dfs]
+    lines = []
+    for line in iter_dfs(dfs, names=names, width=width, max_rows=max_rows):
+        if stdout:
+            print(line)
+        lines.append(line)
+    return '\n'.join(lines)
 
-    # find lowest dataframe length
-    min_length = np.min([len(x) for x in dfs_str])
 
-    # also index locates to min_length so all dataframes will print same length
-    dfs_str = [df_str[:min_length] for df_str in dfs_str]
+def _cells_differ(v1, v2, rtol, atol):
+    '''Elementwise v1 != v2; floats within tolerance and nan == nan are equal'''
+    if v1.dtype.kind in 'biuf' and v2.dtype.kind in 'biuf':
+        return ~np.isclose(v1.astype(float), v2.astype(float), rtol=rtol, atol=atol, equal_nan=True)
+    null = pd.isnull(v1) & pd.isnull(v2)
+    return ~(np.asarray(v1 == v2, dtype=bool) | null)
 
-    # construct string list to print
-    ret = [''.join(['%s' % n + ' ' * (len(df_str[0]) - len(n) + len(SPACER)) for df_str, n in zip(dfs_str, names)])]
-    for i in range(min_length - 2):
-        ret.append(''.join([df_str[i] + SPACER for df_str in dfs_str]))
 
-    ret = '\n'.join(ret)
-    if stdout:
-        print(ret)
+def diff_dfs(df1, df2, rtol=1e-5, atol=1e-8, block_size=1000000):
+    '''Cell-level differences between two dataframes aligned on their index.
+
+    Rows are compared block by block: each block is first reduced to one
+    hash per row (pd.util.hash_pandas_object) and only rows whose hashes
+    differ are compared column by column, so identical stretches of large
+    frames cost one hash pass.
 
-    return ret
+    # Arguments
+    df1, df2: [pd.DataFrame] frames to compare. Indexes must be unique
+    rtol, atol: [float] tolerance for numeric cells (see np.isclose); nan
+        equals nan
+    block_size: [int] rows hashed and compared at a time
+
+    # Returns
+    diff: dict with
+        - 'changed': bool pd.DataFrame, one row per changed row and one
+          column per compared column, True for changed cells
+        - 'left', 'right': the changed rows of df1 and df2
+        - 'only_left', 'only_right': index labels found in one frame only
+        - 'columns_only_left', 'columns_only_right': columns found in one
+          frame only (not compared)
+    '''
+    if not (df1.index.is_unique and df2.index.is_unique):
+        raise RuntimeError('diff_dfs needs unique indexes; found duplicate labels in %s'
+                           % ' and '.join(n for n, df in [('df1', df1), ('df2', df2)] if not df.index.is_unique))
+    columns = [c for c in df1.columns if c in set(df2.columns)]
+    diff = {'columns_only_left': [c for c in df1.columns if c not in set(df2.columns)],
+            'columns_only_right': [c for c in df2.columns if c not in set(df1.columns)]}
+
+    if df1.index.equals(df2.index):
+        a, b = df1[columns], df2[columns]
+        diff['only_left'] = diff['only_right'] = df1.index[:0]
+    else:
+        common = df1.index.intersection(df2.index, sort=False)
+        diff['only_left'] = df1.index.difference(common, sort=False)
+        diff['only_right'] = df2.index.difference(common, sort=False)
+        a, b = df1.loc[common, columns], df2.loc[common, columns]
+
+    rows, masks = [], []
+    # without shared columns there are no cells to compare
+    for start in range(0, len(a) if columns else 0, block_size):
+        a_block, b_block = a.iloc[start:start + block_size], b.iloc[start:start + block_size]
+        h1 = pd.util.hash_pandas_object(a_block, index=False).to_numpy()
+        h2 = pd.util.hash_pandas_object(b_block, index=False).to_numpy()
+        candidates = np.flatnonzero(h1 != h2)
+        if not len(candidates):
+            continue
+        mask = np.stack([_cells_differ(a_block.iloc[candidates, i].to_numpy(), b_block.iloc[candidates, i].to_numpy(), rtol, atol)
+                         for i in range(len(columns))], axis=1)
+        keep = mask.any(axis=1)
+        rows.append(start + candidates[keep])
+        masks.append(mask[keep])
+
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=int)
+    mask = np.concatenate(masks) if masks else np.zeros((0, len(columns)), dtype=bool)
+    diff['changed'] = pd.DataFrame(mask, index=a.index[rows], columns=columns)
+    diff['left'], diff['right'] = a.iloc[rows], b.iloc[rows]
+    return diff
+
+
+def print_diff(df1, df2, names=None, max_rows=50, stdout=True, precision=None, **kwargs):
+    '''Prints the rows and columns that differ between two dataframes,
+    changed cells as "old -> new" highlighted with `colors.ascii`. See
+    `diff_dfs` for kwargs.
+
+    # Arguments
+    df1, df2: [pd.DataFrame] frames to compare
+    names: [list] names of the two frames. Defaults to df0, df1
+    max_rows: [int] changed rows printed at most
+    stdout: [bool] Print the result
+    precision: [int] decimals shown for floats. Defaults to pandas
+        display.precision
+
+    # Returns
+    diff: dict from `diff_dfs`
+    '''
+    from pylho.colors import ascii
+    if names is None:
+        names = ['df0', 'df1']
+    if precision is None:
+        precision = pd.get_option('display.precision')
+    diff = diff_dfs(df1, df2, **kwargs)
+    changed = diff['changed']
+
+    lines = ['%s vs %s: %i changed rows, %i rows only in %s, %i rows only in %s'
+             % (names[0], names[1], len(changed), len(diff['only_left']), names[0],
+                len(diff['only_right']), names[1])]
+    for key, name in (('columns_only_left', names[0]), ('columns_only_right', names[1])):
+        if diff[key]:
+            lines.append('columns only in %s: %s' % (name, ', '.join(str(c) for c in diff[key])))
+
+    # table of changed rows x columns with any change; cells are padded on
+    # their visible text since the color codes take no space
+    cols = [c for c in changed.columns if changed[c].any()]
+    if len(cols):
+        show = changed.iloc[:max_rows]
+        table = [[(str(i), str(i)) for i in show.index]]
+        table[0].insert(0, ('', ''))
+        for c in cols:
+            old = _format_column(diff['left'][c].iloc[:max_rows].to_numpy(), precision)
+            new = _format_column(diff['right'][c].iloc[:max_rows].to_numpy(), precision)
+            cells = [(str(c), str(c))]
+            for o, n, is_changed in zip(old, new, show[c].to_numpy()):
+                if is_changed:
+                    cells.append(('%s -> %s' % (o, n), '%s%s%s -> %s%s%s' % (ascii.RED, o, ascii.DEFAULT, ascii.GREEN, n, ascii.DEFAULT)))
+                else:
+                    cells.append((o, o))
+            table.append(cells)
+        widths = [max(len(text) for text, _ in cells) for cells in table]
+        for i in range(len(table[0])):
+            lines.append('  '.join(' ' * (w - len(cells[i][0])) + cells[i][1] for w, cells in zip(widths, table)))
+        if len(changed) > max_rows:
+            lines.append('... %i more changed rows' % (len(changed) - max_rows))
+
+    if stdout:
+        print('\n'.join(lines))
+    return diff
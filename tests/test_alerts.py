@@ -0,0 +1,51 @@
+import pytest
+
+from pylho import alerts
+
+
+@pytest.mark.parametrize('a, b', [
+    ('[Starting] train_1.py', '[Starting] train_2.py'),
+    ('job 3 failed', 'job 4 failed'),
+    ('model_v2.3.pt saved', 'model_v2.4.pt saved'),
+])
+def test_fingerprint_keeps_identifiers(a, b):
+    assert alerts.fingerprint(a) != alerts.fingerprint(b)
+
+
+@pytest.mark.parametrize('a, b', [
+    ('loss 0.341 at step 123456', 'LOSS 0.298  at step 123999'),
+    ('object at 0x7f3a2b1c failed', 'object at 0x7f3a99 failed'),
+    ('run 2026-10-18 12:01:02 crashed', 'run 2026-10-19 08:00:00 crashed'),
+    ('id 3f2a9c1e-1111-2222-3333-444455556666', 'id 00000000-aaaa-bbbb-cccc-dddddddddddd'),
+])
+def test_fingerprint_ignores_volatile_tokens(a, b):
+    assert alerts.fingerprint(a) == alerts.fingerprint(b)
+
+
+def test_fingerprint_depends_on_channel():
+    assert alerts.fingerprint('job 3 failed', '#a') != alerts.fingerprint('job 3 failed', '#b')
+
+
+def test_deduper_suppresses_repeats_and_digests():
+    deduper = alerts.AlertDeduper(ttl=10)
+    assert deduper.should_send('loss 0.5', now=0)
+    assert not deduper.should_send('loss 0.4', now=1)
+    assert not deduper.should_send('loss 0.3', now=2)
+    assert deduper.should_send('job 3 failed', now=2)
+    assert deduper.digests(now=5) == []
+    assert deduper.digests(now=11) == [('', '[2 repeats suppressed] loss 0.5')]
+    assert deduper.should_send('loss 0.2', now=12)
+
+
+def test_dispatcher_dedups_unless_asked_not_to():
+    posted = []
+    dispatcher = alerts.AlertDispatcher(post=lambda msg, channel: posted.append(msg) or 'ok',
+                                        window=0.01, deduper=alerts.AlertDeduper(ttl=600))
+    try:
+        futures = [dispatcher.send('job failed in 0.5 secs'), dispatcher.send('job failed in 0.7 secs'),
+                   dispatcher.send('[Done] train_1.py', dedup=False),
+                   dispatcher.send('[Done] train_1.py', dedup=False)]
+        assert [f.result(5) for f in futures] == ['ok', None, 'ok', 'ok']
+    finally:
+        dispatcher.close(timeout=5)
+    assert '\n'.join(posted).split('\n') == ['job failed in 0.5 secs', '[Done] train_1.py', '[Done] train_1.py']
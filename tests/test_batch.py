@@ -0,0 +1,74 @@
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pylho.bokeh_utils import batch
+
+
+def make_df():
+    return pd.DataFrame({'x': ['a', 'b', None, 'a'], 'y': [1.0, 2.0, 3.0, np.nan],
+                         'n': np.arange(4), 't': pd.date_range('2020-01-01', periods=4)})
+
+
+def crash_or_render(df, spec):
+    if spec.get('crash'):
+        os._exit(1)
+    return len(df)
+
+
+@pytest.fixture
+def shm_names(monkeypatch):
+    names = []
+    share_frame = batch.share_frame
+
+    def record(df):
+        manifest, shms = share_frame(df)
+        names.extend(shm.name for shm in shms)
+        return manifest, shms
+    monkeypatch.setattr(batch, 'share_frame', record)
+    return names
+
+
+def assert_unlinked(names):
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_share_and_attach_round_trip():
+    df = make_df()
+    manifest, shms = batch.share_frame(df)
+    try:
+        df2, attached = batch.attach_frame(manifest)
+        pd.testing.assert_frame_equal(df2, df, check_dtype=False)
+        for shm in attached:
+            shm.close()
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def test_failing_spec_is_isolated(shm_names):
+    results = batch.render_batch(make_df(), [{'plot': 'nope'}, {'plot': 'barplot', 'query': 'not valid ('}],
+                                 processes=2, progress=False)
+    assert 'Do not understand plot' in results[0]['error']
+    assert results[1]['error'] is not None
+    assert_unlinked(shm_names)
+
+
+@pytest.mark.skipif(mp.get_start_method() != 'fork', reason='workers must inherit the patched render_spec')
+def test_dead_worker_fails_remaining_specs(monkeypatch, shm_names):
+    monkeypatch.setattr(batch, 'render_spec', crash_or_render)
+    specs = [{'output_path': 'ok.html'}, {'output_path': 'crash.html', 'crash': True}] + \
+        [{'output_path': '%i.html' % i} for i in range(4)]
+    results = batch.render_batch(make_df(), specs, processes=1, progress=False)
+    assert results[0] == {'output_path': 'ok.html', 'error': None, 'seconds': results[0]['seconds']}
+    for result in results[1:]:
+        assert 'BrokenProcessPool' in result['error'] and result['seconds'] is None
+    assert_unlinked(shm_names)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from pylho import colors
+
+
+@pytest.mark.parametrize('output, shape', [('hex', (0,)), ('bytes', (0,)), ('rgb', (0, 3))])
+def test_colormap_empty(output, shape):
+    assert colors.colormap([], output=output).shape == shape
+
+
+def test_colormap_ends_and_nan():
+    ret = colors.colormap([0., 0.5, 1., np.nan], nan_color='#000000')
+    rgb_lut, hex_lut = colors.colormap_lut()
+    assert list(ret[[0, 2]]) == [hex_lut[0], hex_lut[-1]]
+    assert ret[3] == '#000000'
+
+
+def test_colormap_lut_is_read_only():
+    rgb_lut, hex_lut = colors.colormap_lut('hot', n=16)
+    with pytest.raises(ValueError):
+        rgb_lut[0] = 0
+    with pytest.raises(ValueError):
+        hex_lut[0] = '#000000'
+    out = colors.colormap([0.], 'hot', n=16, output='rgb')
+    out[0] = 0
+    assert colors.colormap_lut('hot', n=16)[0][0].tolist() != [0, 0, 0]
@@ -0,0 +1,79 @@
+import io
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from pylho import debug
+
+
+class BrokenStream(object):
+    def __init__(self):
+        self.fail = True
+        self.lines = []
+
+    def write(self, s):
+        if self.fail:
+            raise ValueError('I/O operation on closed file')
+        self.lines.append(s)
+
+    def flush(self):
+        pass
+
+
+def test_writer_writes_stream_and_json(tmp_path):
+    stream = io.StringIO()
+    path = str(tmp_path / 'log.jsonl')
+    with debug.AsyncLogWriter(stream=stream, json_path=path, flush_interval=0.01) as writer:
+        debug.Logger('[t]', writer=writer)('hello', -2)
+    assert 'hello' in stream.getvalue()
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [(r['name'], r['verbose'], r['msg']) for r in rows] == [('[t]', -2, 'hello')]
+
+
+def test_unknown_color_raises_in_caller():
+    writer = debug.AsyncLogWriter(stream=io.StringIO(), flush_interval=0.01)
+    with pytest.raises(RuntimeError):
+        debug.Logger('[t]', writer=writer)('hello', -2, color='not-a-color')
+    writer.close(timeout=5)
+
+
+def test_failed_write_is_dropped_and_writer_keeps_running():
+    stream = BrokenStream()
+    writer = debug.AsyncLogWriter(stream=stream, flush_interval=0.01)
+    writer.put((time.time(), '[t] ', -2, 'red', 'lost'))
+    done = threading.Thread(target=writer.flush)
+    done.start()
+    done.join(5)
+    assert not done.is_alive()
+
+    stream.fail = False
+    writer.put((time.time(), '[t] ', -2, 'red', 'kept'))
+    writer.flush(timeout=5)
+    writer.close(timeout=5)
+    text = ''.join(stream.lines)
+    assert 'kept' in text and 'lost' not in text
+
+
+def test_flush_does_not_block_after_close():
+    writer = debug.AsyncLogWriter(stream=io.StringIO(), flush_interval=0.01)
+    writer.close(timeout=5)
+    t = time.time()
+    writer.flush()
+    assert time.time() - t < 1
+
+
+def test_process_exits_with_pending_records_and_broken_stream():
+    code = ('from pylho import debug\n'
+            'class S(object):\n'
+            '    def write(self, s): raise ValueError("closed")\n'
+            '    def flush(self): pass\n'
+            'w = debug.AsyncLogWriter(stream=S(), exit_timeout=2)\n'
+            'debug.Logger("[t]", writer=w)("last", -2)\n')
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, timeout=30)
+    assert proc.returncode == 0
+    assert b'dropped 1 records' in proc.stderr
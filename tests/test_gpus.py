@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from pylho import gpus
+
+FAKE = [sys.executable, os.path.join(os.path.dirname(gpus.__file__), 'scripts', 'fake_nvidia_smi.py')]
+
+
+def test_query_parses_fake_nvidia_smi():
+    fields = ['utilization.gpu', 'memory.total', 'power.draw']
+    gpu_ids, values = asyncio.run(gpus.NvidiaSmiProvider(FAKE).query(fields))
+    assert gpu_ids.tolist() == [0, 1]
+    assert values.shape == (2, 3)
+    assert (values[:, 1] == 12196).all()
+    assert np.isnan(values[:, 2]).all()
+
+
+def test_failing_command_raises_query_error():
+    provider = gpus.NvidiaSmiProvider([sys.executable, '-c', 'import sys; sys.exit("no gpus")'])
+    with pytest.raises(gpus.GPUQueryError, match='no gpus'):
+        asyncio.run(provider.status())
+
+
+def test_slow_command_times_out():
+    provider = gpus.NvidiaSmiProvider(FAKE + ['5'], timeout=0.2)
+    with pytest.raises(gpus.GPUQueryError, match='timed out'):
+        asyncio.run(provider.status())
+
+
+def test_free_gpus():
+    assert gpus.free_gpus(gpus.NvidiaSmiProvider(FAKE), max_memory_used=1e9, max_utilization=100) == [0, 1]
+    assert gpus.free_gpus(gpus.NvidiaSmiProvider(FAKE), max_memory_used=0) == []
+
+
+def test_status_service_shares_one_query():
+    class Provider(object):
+        calls = 0
+
+        async def status(self):
+            Provider.calls += 1
+            await asyncio.sleep(0.05)
+            return 'status'
+
+    async def main():
+        service = gpus.GPUStatusService(Provider(), ttl=10)
+        return await asyncio.gather(*[service.status() for _ in range(20)])
+    assert asyncio.run(main()) == ['status'] * 20
+    assert Provider.calls == 1
+
+
+def test_collector_keeps_sampling_after_errors():
+    class Provider(object):
+        calls = 0
+
+        async def query(self, fields):
+            Provider.calls += 1
+            if Provider.calls % 2:
+                raise FileNotFoundError('nvidia-smi')
+            return np.array([0]), np.ones((1, len(fields)))
+
+    collector = gpus.GPUMetricsCollector(Provider(), interval=0.02).start()
+    try:
+        time.sleep(0.3)
+        assert collector._thread.is_alive()
+    finally:
+        collector.stop()
+    assert Provider.calls > 4
+    assert len(collector.buffers[0]) >= 2
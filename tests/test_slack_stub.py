@@ -0,0 +1,92 @@
+import http.server
+import json
+import threading
+
+import pytest
+
+from pylho import alerts
+
+
+class SlackStub(http.server.BaseHTTPRequestHandler):
+    '''Answers Web API posts with the queued (status, body, headers) replies,
+    then with {"ok": true}'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.requests.append((self.path, self.headers['Authorization'], body))
+        server.ports.add(self.client_address[1])
+        status, reply, headers = server.replies.pop(0) if server.replies else (200, {'ok': True}, {})
+        data = json.dumps(reply).encode('utf-8')
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SlackStub)
+    server.requests, server.ports, server.replies = [], set(), []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(stub):
+    return alerts.SlackWebClient('xoxb-test', base_url='http://127.0.0.1:%i/api/' % stub.server_address[1])
+
+
+def test_post_reuses_one_connection(stub):
+    c = client(stub)
+    for i in range(3):
+        assert c.post('msg %i' % i, channel='#c')['ok']
+    c.close()
+    assert [r[0] for r in stub.requests] == ['/api/chat.postMessage'] * 3
+    assert stub.requests[0][1] == 'Bearer xoxb-test'
+    assert stub.requests[2][2] == {'channel': '#c', 'text': 'msg 2'}
+    assert len(stub.ports) == 1
+
+
+def test_errors(stub):
+    stub.replies = [(429, {}, {'Retry-After': '3'}), (200, {'ok': False, 'error': 'channel_not_found'}, {}),
+                    (500, {}, {})]
+    c = client(stub)
+    with pytest.raises(alerts.AlertError) as e:
+        c.post('x')
+    assert e.value.retry_after == 3.0
+    with pytest.raises(alerts.AlertError, match='channel_not_found'):
+        c.post('x')
+    with pytest.raises(alerts.AlertError, match='HTTP 500'):
+        c.post('x')
+    c.close()
+
+
+def test_dispatcher_retries_and_coalesces(stub):
+    stub.replies = [(429, {}, {'Retry-After': '0'})]
+    dispatcher = alerts.AlertDispatcher(post=client(stub).post, window=0.2, backoff=0.01)
+    try:
+        futures = [dispatcher.send('a', channel='#c'), dispatcher.send('b', channel='#c')]
+        assert all(f.result(5)['ok'] for f in futures)
+    finally:
+        dispatcher.close(timeout=5)
+    assert [r[2] for r in stub.requests] == [{'channel': '#c', 'text': 'a\nb'}] * 2
+
+
+def test_dispatcher_fails_futures_after_max_retries(stub):
+    stub.replies = [(500, {}, {})] * 3
+    dispatcher = alerts.AlertDispatcher(post=client(stub).post, window=0.01, max_retries=2, backoff=0.01)
+    try:
+        with pytest.raises(alerts.AlertError, match='HTTP 500'):
+            dispatcher.send('a').result(5)
+    finally:
+        dispatcher.close(timeout=5)
+    assert len(stub.requests) == 3
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pylho import terminal
+
+
+def test_diff_dfs_finds_changed_cells():
+    df1 = pd.DataFrame({'a': [1.0, 2.0, np.nan], 'b': ['x', 'y', 'z']}, index=[10, 11, 12])
+    df2 = pd.DataFrame({'a': [1.0, 2.5, np.nan], 'b': ['x', 'y', 'w']}, index=[10, 11, 12])
+    diff = terminal.diff_dfs(df1, df2)
+    assert list(diff['changed'].index) == [11, 12]
+    assert diff['changed'].to_numpy().tolist() == [[True, False], [False, True]]
+    assert list(diff['left']['a'].iloc[:1]) == [2.0]
+
+
+def test_diff_dfs_tolerance():
+    df1 = pd.DataFrame({'a': [1.0, 2.0]})
+    diff = terminal.diff_dfs(df1, df1 + 1e-9)
+    assert diff['changed'].empty
+
+
+def test_diff_dfs_rows_and_columns_in_one_frame_only():
+    df1 = pd.DataFrame({'a': [1, 2, 3], 'b': [4, 5, 6]}, index=['p', 'q', 'r'])
+    df2 = pd.DataFrame({'a': [2, 9], 'c': [0, 0]}, index=['q', 's'])
+    diff = terminal.diff_dfs(df1, df2)
+    assert list(diff['only_left']) == ['p', 'r']
+    assert list(diff['only_right']) == ['s']
+    assert diff['columns_only_left'] == ['b']
+    assert diff['columns_only_right'] == ['c']
+    assert diff['changed'].empty
+
+
+def test_diff_dfs_no_shared_columns():
+    df1 = pd.DataFrame({'a': [1, 2]})
+    df2 = pd.DataFrame({'b': [1, 2]}, index=[1, 2])
+    diff = terminal.diff_dfs(df1, df2)
+    assert diff['changed'].shape == (0, 0)
+    assert list(diff['only_left']) == [0] and list(diff['only_right']) == [2]
+    assert diff['columns_only_left'] == ['a'] and diff['columns_only_right'] == ['b']
+
+
+def test_diff_dfs_empty_frames():
+    df = pd.DataFrame({'a': []})
+    assert terminal.diff_dfs(df, df)['changed'].empty
+
+
+def test_diff_dfs_blocks():
+    df1 = pd.DataFrame({'a': np.arange(10)})
+    df2 = df1.copy()
+    df2.loc[[1, 7], 'a'] = -1
+    diff = terminal.diff_dfs(df1, df2, block_size=3)
+    assert list(diff['changed'].index) == [1, 7]
+
+
+def test_diff_dfs_rejects_duplicate_index():
+    df1 = pd.DataFrame({'a': [1, 2]}, index=[0, 0])
+    df2 = pd.DataFrame({'a': [1, 2]})
+    with pytest.raises(RuntimeError, match='df1'):
+        terminal.diff_dfs(df1, df2)